@@ -0,0 +1 @@
+""" Benchmark scripts for the m5 package. Run them with python -m benchmarks.<name>. """
@@ -0,0 +1,63 @@
+""" A synthetic corpus of scraped jobs, so that benchmarks don't need the company server. """
+
+from datetime import date, timedelta
+from random import Random
+
+from m5.factory import Packager
+from m5.records import Job, Address
+from m5.utilities import Stamped, Stamp
+
+
+def serial_jobs(n: int, addresses: int=3, records: bool=True, seed: int=134):
+    """
+    Generate n scraped jobs, the way the Scraper hands them over.
+
+    :param records: slotted records if True, dictionaries otherwise
+    """
+
+    random = Random(seed)
+    first = date(2013, 3, 1)
+
+    for i in range(n):
+        day = first + timedelta(days=i // 20)
+
+        job_details = {'order_id': str(1300000000 + i),
+                       'type': random.choice(['OV', 'Ladehilfe', 'Stadtkurier']),
+                       'cash': random.choice(['BAR', None]),
+                       'client_id': str(random.randint(10000, 10500)),
+                       'client_name': 'Client %d' % random.randint(0, 500),
+                       'km': '%d,%03d' % (random.randint(0, 20), random.randint(0, 999)),
+                       'city_tour': '%d,%02d' % (random.randint(5, 30), random.randint(0, 99)),
+                       'extra_stops': random.choice(['3,50', None]),
+                       'overnight': None,
+                       'fax_confirm': random.choice(['3,50', None]),
+                       'waiting_time': random.choice(['2,00', None])}
+
+        stops = list()
+        for j in range(addresses):
+            hour = 8 + (i % 20) // 2
+            stops.append({'company': 'Company %d' % random.randint(0, 5000),
+                          'address': 'Strasse %d' % random.randint(1, 200),
+                          'city': 'Berlin',
+                          'postal_code': str(random.randint(10115, 14199)),
+                          'purpose': 'Abholung' if j == 0 else 'Zustellung',
+                          'timestamp': '%02d:%02d' % (hour, 10 * j + i % 10),
+                          'after': '%02d:00' % hour,
+                          'until': '%02d:59' % hour})
+
+        if records:
+            yield Stamped(Stamp(day, str(1000000 + i)), (Job(**job_details), [Address(**s) for s in stops]))
+        else:
+            yield Stamped(Stamp(day, str(1000000 + i)), (job_details, stops))
+
+
+class OfflinePackager(Packager):
+    """ A Packager that makes up coordinates instead of asking Nominatim. """
+
+    @staticmethod
+    def geocode(raw_address: dict) -> dict:
+        key = abs(hash((raw_address['address'], raw_address['postal_code'])))
+        return {'osm_id': str(key % 100000),
+                'lat': 52.4 + (key % 1000) / 5000,
+                'lon': 13.2 + (key // 1000 % 1000) / 2500,
+                'display_name': raw_address['address']}
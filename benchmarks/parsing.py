@@ -0,0 +1,69 @@
+"""
+Compare the cached parsers with the way the Packager used to parse timestamps and prices.
+
+Usage: python -m benchmarks.parsing [number of addresses]
+"""
+
+from datetime import datetime
+from sys import argv
+from time import strptime, perf_counter
+
+from m5.parsers import decimal, decimals, timestamp
+from benchmarks.corpus import serial_jobs
+
+
+def legacy_timestamp(day, raw_time: str):
+    if raw_time in ('', None):
+        return None
+    else:
+        t = strptime(raw_time, '%H:%M')
+        return datetime(day.year, day.month, day.day, hour=t.tm_hour, minute=t.tm_min)
+
+
+def legacy_float(raw_price: str):
+    if raw_price in (None, ''):
+        return None
+    else:
+        return float(raw_price.replace(',', '.'))
+
+
+def legacy(jobs: list):
+    """ Two strptime() calls per checkin timestamp (key + value), one float() per price. """
+
+    for stamped in jobs:
+        day = stamped.stamp.date
+        job_details, addresses = stamped.data
+        [legacy_float(job_details[f]) for f in ('km', 'city_tour', 'extra_stops',
+                                                'overnight', 'fax_confirm', 'waiting_time')]
+        for address in addresses:
+            legacy_timestamp(day, address['timestamp']).__hash__()
+            legacy_timestamp(day, address['timestamp'])
+            legacy_timestamp(day, address['after'])
+            legacy_timestamp(day, address['until'])
+
+
+def cached(jobs: list):
+    """ One cached parse per checkin timestamp, one batch of cached prices per job. """
+
+    for stamped in jobs:
+        day = stamped.stamp.date
+        job_details, addresses = stamped.data
+        decimals(job_details[f] for f in ('km', 'city_tour', 'extra_stops',
+                                          'overnight', 'fax_confirm', 'waiting_time'))
+        for address in addresses:
+            timestamp(day, address['timestamp']).__hash__()
+            timestamp(day, address['after'])
+            timestamp(day, address['until'])
+
+
+if __name__ == '__main__':
+    n = int(argv[1]) if len(argv) > 1 else 100000
+    jobs = list(serial_jobs(n // 3))
+
+    for label, f in (('strptime + float', legacy), ('cached parsers', cached)):
+        tic = perf_counter()
+        f(jobs)
+        toc = perf_counter()
+        print('{:<20} {:>8.3f} s {:>12.0f} addresses/s'.format(label + ':', toc - tic, n / (toc - tic)))
+
+    print('Cache: {}'.format(decimal.cache_info()))
@@ -0,0 +1,87 @@
+"""
+Compare the memory and throughput of the record types between the Scraper and the database:
+
+    - dictionaries vs slotted records for scraped jobs held in memory
+    - ORM instances pushed with merge() vs named tuples inserted at the Core level
+
+Usage: python -m benchmarks.records [number of jobs]
+"""
+
+from contextlib import redirect_stdout
+from io import StringIO
+from sys import argv
+from time import perf_counter
+from tracemalloc import start, stop, get_traced_memory, reset_peak
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from m5.factory import Pusher
+from m5.model import Base
+from benchmarks.corpus import serial_jobs, OfflinePackager
+
+
+def measure(f):
+    """ Return the result of f(), the time it took and the peak memory it allocated. """
+
+    reset_peak()
+    before = get_traced_memory()[0]
+    tic = perf_counter()
+    result = f()
+    toc = perf_counter()
+    peak = get_traced_memory()[1] - before
+    return result, toc - tic, peak
+
+
+def database_session():
+    engine = create_engine('sqlite://', echo=False)
+    Base.metadata.create_all(engine)
+    return sessionmaker(bind=engine)()
+
+
+def scraped(n: int):
+    """ The memory held by n scraped jobs. """
+
+    for records in (False, True):
+        label = 'records' if records else 'dictionaries'
+        jobs, seconds, peak = measure(lambda: list(serial_jobs(n, records=records)))
+        print('{:<26} {:>8.1f} MB {:>8.2f} s'.format('Scraped as ' + label + ':', peak / 2 ** 20, seconds))
+        del jobs
+
+
+def packaged(n: int):
+    """ The time and memory it takes to package and write n jobs. """
+
+    packager = OfflinePackager()
+
+    def orm():
+        pusher = Pusher(database_session())
+        for tables in packager.stream(serial_jobs(n)):
+            pusher.push(tables)
+
+    def core():
+        pusher = Pusher(database_session())
+        for tables in packager.rows(serial_jobs(n)):
+            pusher.insert(tables)
+
+    def orm_package():
+        return list(packager.stream(serial_jobs(n)))
+
+    def core_package():
+        return list(packager.rows(serial_jobs(n)))
+
+    for label, f in (('ORM packaged', orm_package), ('Rows packaged', core_package),
+                     ('ORM pushed', orm), ('Rows inserted', core)):
+        with redirect_stdout(StringIO()):
+            _, seconds, peak = measure(f)
+        print('{:<26} {:>8.1f} MB {:>8.2f} s {:>10.0f} jobs/s'
+              .format(label + ':', peak / 2 ** 20, seconds, n / seconds))
+
+
+if __name__ == '__main__':
+    jobs = int(argv[1]) if len(argv) > 1 else 2000
+
+    start()
+    scraped(jobs * 10)
+    packaged(jobs)
+    stop()
@@ -0,0 +1,87 @@
+"""
+A long-run soak test: push synthetic jobs through the Packager and the Pusher
+into a database file and check that memory stays flat. The number of live Python
+objects must stay flat. The resident memory may drift a little, because
+SQLite and the allocator hold on to pages as the database file grows.
+
+Usage: python -m benchmarks.soak [number of jobs] [jobs per sample]
+"""
+
+from contextlib import redirect_stdout
+from gc import collect, get_objects
+from io import StringIO
+from os import sysconf
+from os.path import join
+from shutil import rmtree
+from sys import argv
+from tempfile import mkdtemp
+from time import perf_counter
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from m5.factory import Pusher
+from m5.model import Base
+from benchmarks.corpus import serial_jobs, OfflinePackager
+
+
+# Tolerated growth between the first and the last samples
+RSS_TOLERANCE = 0.15
+OBJECTS_TOLERANCE = 0.01
+
+
+def rss() -> int:
+    """ The current resident set size of this process, in bytes (Linux). """
+
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * sysconf('SC_PAGE_SIZE')
+
+
+def soak(n: int, every: int) -> list:
+    """
+    Push n jobs one at a time and sample the memory every so many jobs.
+
+    :return: a list of (jobs, MB, live objects) samples
+    """
+
+    directory = mkdtemp()
+    engine = create_engine('sqlite:///%s' % join(directory, 'soak.sqlite'), echo=False)
+    Base.metadata.create_all(engine)
+
+    pusher = Pusher(sessionmaker(bind=engine)())
+    packager = OfflinePackager()
+
+    samples = list()
+    tic = perf_counter()
+
+    try:
+        with redirect_stdout(StringIO()):
+            for i, tables in enumerate(packager.stream(serial_jobs(n)), start=1):
+                pusher.push(tables)
+                if i % every == 0:
+                    collect()
+                    samples.append((i, rss() / 2 ** 20, len(get_objects())))
+    finally:
+        engine.dispose()
+        rmtree(directory)
+
+    seconds = perf_counter() - tic
+    print('{} jobs in {:.0f} s ({:.0f} jobs/s)'.format(n, seconds, n / seconds))
+
+    return samples
+
+
+if __name__ == '__main__':
+    jobs = int(argv[1]) if len(argv) > 1 else 100000
+    every = int(argv[2]) if len(argv) > 2 else jobs // 20
+
+    samples = soak(jobs, every)
+
+    for i, mb, objects in samples:
+        print('{:>8} jobs {:>8.1f} MB {:>10} objects'.format(i, mb, objects))
+
+    # The first sample is taken once the caches have warmed up
+    for n, label, tolerance in ((1, 'RSS', RSS_TOLERANCE), (2, 'Objects', OBJECTS_TOLERANCE)):
+        first, last = samples[0][n], samples[-1][n]
+        growth = (last - first) / first
+        print('{} growth: {:+.1%} ({})'.format(label, growth, 'flat' if growth <= tolerance else 'GROWING'))
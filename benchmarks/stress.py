@@ -0,0 +1,268 @@
+"""
+A scaling stress test for the user database and the queries on it. A synthetic
+history is written through Pusher.insert(), then doubled again and again. After
+each doubling, a standard workload is timed:
+
+    - monthly totals and per-client revenue (Stats)
+    - the route of one day and of one month (Router.route)
+    - a geohash neighbourhood, an in-memory spatial index and a heatmap
+
+The data follows the shape of a real courier's history: a few clients make most
+of the orders, weekends are quiet, most orders have one pickup and one or two
+dropoffs, and the addresses cluster around a handful of districts. The report
+gives the median latency of each query at each size, and how fast it grows: an
+exponent of 1 means linear in the size of the history, 0 means flat.
+
+Usage: python -m benchmarks.stress [doublings] [days to start with] [orders per weekday]
+"""
+
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+from io import StringIO
+from math import log
+from os.path import getsize, join
+from random import Random
+from shutil import rmtree
+from statistics import median
+from sys import argv
+from tempfile import mkdtemp
+from time import perf_counter
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from m5.factory import Pusher
+from m5.model import Base, Checkin
+from m5.records import ClientRow, OrderRow, CheckpointRow, CheckinRow
+from m5.routes import Router
+from m5.spatial import geohash, neighbourhood, SpatialIndex
+from m5.statistics import Stats
+from m5.utilities import Tables, MAX_STOPS
+
+
+FIRST_DAY = date(2013, 3, 1)
+
+# The business: clients, addresses, and the districts they cluster around
+CLIENTS = 2000
+CHECKPOINTS = 20000
+DISTRICTS = [(52.520, 13.405), (52.507, 13.332), (52.484, 13.438),
+             (52.538, 13.424), (52.456, 13.321), (52.545, 13.355)]
+
+# Each query runs that many times per size, and the median is reported
+REPEATS = 5
+
+
+class History():
+    """ A reproducible synthetic history, generated one day after the other. """
+
+    def __init__(self, orders: int, seed: int=134):
+        """
+        :param orders: the average number of orders on a weekday
+        """
+
+        self.orders = orders
+        self.random = Random(seed)
+        self.day = FIRST_DAY
+        self.next_order = 1
+
+        # Zipf-like popularity: the client of rank r orders about 1/r as often
+        self.clients = [ClientRow(client_id=10000 + n, name='Client %d' % n) for n in range(CLIENTS)]
+        self.weights = [1 / rank for rank in range(1, CLIENTS + 1)]
+
+        self.checkpoints = [self._checkpoint(n) for n in range(CHECKPOINTS)]
+
+    def rows(self, days: int) -> Tables:
+        """ The rows of the next days, with the clients and checkpoints they refer to. """
+
+        orders, checkins = list(), list()
+
+        for _ in range(days):
+            self._day(orders, checkins)
+            self.day += timedelta(days=1)
+
+        clients = {order.client_id for order in orders}
+        checkpoints = {checkin.checkpoint_id for checkin in checkins}
+
+        return Tables([client for client in self.clients if client.client_id in clients],
+                      orders,
+                      [checkpoint for checkpoint in self.checkpoints if checkpoint.checkpoint_id in checkpoints],
+                      checkins)
+
+    def _day(self, orders: list, checkins: list):
+        random = self.random
+        n = int(random.gauss(self.orders, self.orders / 5)) if self.day.weekday() < 5 else random.randint(0, 3)
+
+        start = datetime.combine(self.day, datetime.min.time()) + timedelta(hours=8)
+        clients = random.choices(self.clients, weights=self.weights, k=max(n, 0))
+
+        for i, client in enumerate(clients):
+            order_id = self.next_order
+            self.next_order += 1
+
+            kind = random.choices(('city_tour', 'overnight', 'help'), weights=(90, 7, 3))[0]
+            orders.append(OrderRow(order_id=order_id,
+                                   client_id=client.client_id,
+                                   type=kind,
+                                   city_tour=round(random.uniform(5, 30), 2),
+                                   overnight=round(random.uniform(10, 40), 2) if kind == 'overnight' else 0,
+                                   waiting_time=random.choice((0, 0, 0, 2.0)),
+                                   extra_stops=random.choice((0, 0, 3.5)),
+                                   fax_confirm=random.choice((0, 0, 0, 3.5)),
+                                   distance=round(random.expovariate(1 / 6), 3),
+                                   cash=random.random() < 0.2,
+                                   date=datetime.combine(self.day, datetime.min.time()),
+                                   uuid=order_id))
+
+            # One pickup, mostly one or two dropoffs, a long tail of multi-drops
+            stops = 1 + min(1 + int(random.expovariate(1.2)), MAX_STOPS - 1)
+            timestamp = start + timedelta(minutes=i * 600 // max(n, 1))
+
+            for rank in range(stops):
+                timestamp += timedelta(minutes=random.randint(5, 40))
+                checkins.append(CheckinRow(checkin_id=order_id * MAX_STOPS + rank,
+                                           checkpoint_id=random.choice(self.checkpoints).checkpoint_id,
+                                           order_id=order_id,
+                                           timestamp=timestamp,
+                                           purpose='pickup' if rank == 0 else 'dropoff',
+                                           after_=timestamp - timedelta(minutes=30),
+                                           until=timestamp + timedelta(minutes=30)))
+
+    def _checkpoint(self, n: int) -> CheckpointRow:
+        lat, lon = self.random.choice(DISTRICTS)
+        lat += self.random.gauss(0, 0.015)
+        lon += self.random.gauss(0, 0.025)
+
+        return CheckpointRow(checkpoint_id=str(100000 + n),
+                             lat=lat,
+                             lon=lon,
+                             city='Berlin',
+                             display_name='Strasse %d, Berlin' % n,
+                             postal_code=10115 + n % 4000,
+                             street='Strasse %d' % n,
+                             company='Company %d' % n,
+                             geohash=geohash(lat, lon))
+
+
+def workload(session, first: date, last: date, random: Random) -> dict:
+    """
+    Time each query of the standard workload over a history from first to last.
+
+    :return: query name -> median seconds
+    """
+
+    stats = Stats(session)
+    router = Router(session)
+    day = first + timedelta(days=random.randrange((last - first).days))
+    lat, lon = random.choice(DISTRICTS)
+
+    def monthly_totals():
+        stats.clear()
+        return stats.monthly_totals()
+
+    def client_revenue():
+        stats.clear()
+        return stats.top_clients(n=50)
+
+    def route_day():
+        return router.route(day)
+
+    def route_month():
+        return router.route(day, day + timedelta(days=30))
+
+    def neighbourhood_():
+        return neighbourhood(session, lat, lon).count()
+
+    def spatial_index():
+        index = SpatialIndex()
+        index.update(session)
+        return index.radius(lat, lon, 1000)
+
+    def density():
+        stats.clear()
+        return stats.density(day, day + timedelta(days=30), bins=(50, 50))
+
+    queries = (monthly_totals, client_revenue, route_day, route_month, neighbourhood_, spatial_index, density)
+
+    latencies = dict()
+    for query in queries:
+        seconds = list()
+        for _ in range(REPEATS):
+            tic = perf_counter()
+            query()
+            seconds.append(perf_counter() - tic)
+        latencies[query.__name__.strip('_')] = median(seconds)
+
+    return latencies
+
+
+def stress(doublings: int, days: int, orders: int) -> list:
+    """
+    Grow a database file from days of history to days * 2 ** doublings,
+    and run the workload at each size.
+
+    :return: a list of (checkins, megabytes, {query: seconds}) samples
+    """
+
+    directory = mkdtemp()
+    filepath = join(directory, 'stress.sqlite')
+    engine = create_engine('sqlite:///%s' % filepath, echo=False)
+    Base.metadata.create_all(engine)
+
+    session = sessionmaker(bind=engine)()
+    pusher = Pusher(session)
+    history = History(orders)
+    random = Random(2013)
+
+    samples = list()
+    added = 0
+
+    try:
+        for size in (days * 2 ** k for k in range(doublings + 1)):
+            tic = perf_counter()
+
+            # A month at a time, so that memory stays small
+            with redirect_stdout(StringIO()):
+                while added < size:
+                    chunk = min(31, size - added)
+                    pusher.insert(history.rows(chunk))
+                    added += chunk
+
+            checkins = session.query(func.count(Checkin.checkin_id)).scalar()
+            print('{:>8} days, {:>9} checkins written in {:.0f} s'.format(size, checkins, perf_counter() - tic))
+
+            latencies = workload(session, FIRST_DAY, history.day - timedelta(days=1), random)
+            megabytes = getsize(filepath) / 2 ** 20
+
+            samples.append((checkins, megabytes, latencies))
+    finally:
+        session.close()
+        engine.dispose()
+        rmtree(directory)
+
+    return samples
+
+
+def report(samples: list) -> str:
+    """ One line per size, then the growth exponent of each query over the last doubling. """
+
+    queries = list(samples[0][2])
+
+    lines = ['{:>10} {:>8} '.format('checkins', 'MB') + ' '.join('{:>15}'.format(q) for q in queries)]
+    for checkins, megabytes, latencies in samples:
+        lines.append('{:>10} {:>8.1f} '.format(checkins, megabytes) +
+                     ' '.join('{:>12.1f} ms'.format(latencies[q] * 1000) for q in queries))
+
+    if len(samples) > 1:
+        (n1, _, t1), (n2, _, t2) = samples[-2], samples[-1]
+        exponents = [log(t2[q] / t1[q]) / log(n2 / n1) if t1[q] and t2[q] else 0 for q in queries]
+        lines.append('{:>19} '.format('growth exponent') + ' '.join('{:>15.2f}'.format(e) for e in exponents))
+
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    doublings = int(argv[1]) if len(argv) > 1 else 7
+    days = int(argv[2]) if len(argv) > 2 else 365
+    orders = int(argv[3]) if len(argv) > 3 else 40
+
+    print(report(stress(doublings, days, orders)))
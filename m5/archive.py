@@ -0,0 +1,200 @@
+"""
+The archive module: pack the downloaded html files into one container per month.
+
+Years of history are tens of thousands of small files in a single folder. Instead,
+each month goes into an append-only pack (<directory>/<YYYY-MM>.pack) with an offset
+index next to it (<directory>/<YYYY-MM>.index). Pages are compressed one by one, so
+any page can be read on its own, straight from a memory map of the pack.
+
+The Miner keeps writing loose files: they are cheap to write and safe with several
+processes downloading at once. The compaction folds them into the archives later.
+"""
+
+from json import dump, load
+from mmap import mmap, ACCESS_READ
+from os import fsync, listdir, remove, replace
+from os.path import getsize, isfile, join
+from zlib import compress, decompress
+
+from m5.utilities import notify
+
+
+_PACK = '.pack'
+_INDEX = '.index'
+
+
+class Archive():
+    """ Monthly packs of html pages, read by filename with random access. """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+        # month -> {filename: (offset, length)}
+        self._indexes = dict()
+        # month -> memory map of the pack
+        self._maps = dict()
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self._index(self._month(filename))
+
+    def get(self, filename: str) -> str:
+        """ Return a page, or None if it isn't archived. """
+
+        month = self._month(filename)
+        index = self._index(month)
+
+        if filename not in index:
+            return None
+
+        offset, length = index[filename]
+        return decompress(self._map(month)[offset:offset + length]).decode('utf-8')
+
+    def add(self, pages: dict):
+        """
+        Append pages to their monthly packs. A page that is already
+        archived is appended again and the index points to the new copy.
+
+        :param pages: filename -> html
+        """
+
+        months = dict()
+        for filename, html in pages.items():
+            months.setdefault(self._month(filename), []).append((filename, html))
+
+        for month, entries in months.items():
+            self._append(month, entries)
+
+    def months(self) -> list:
+        return sorted(filename[:-len(_INDEX)] for filename in listdir(self.directory)
+                      if filename.endswith(_INDEX))
+
+    def compact(self) -> int:
+        """
+        Fold the loose html files into the archives and delete them, then
+        rewrite the packs that hold superseded copies of a page.
+
+        :return: the number of loose files archived
+        """
+
+        loose = sorted(filename for filename in listdir(self.directory) if filename.endswith('.html'))
+
+        months = dict()
+        for filename in loose:
+            months.setdefault(self._month(filename), []).append(filename)
+
+        # One month at a time, and one page at a time within it, so that memory
+        # doesn't grow with the downloads: a month's loose files are only deleted
+        # once its pack is safely on disk.
+        for month, filenames in sorted(months.items()):
+            self._append(month, ((filename, self._read(filename)) for filename in filenames))
+
+            for filename in filenames:
+                remove(join(self.directory, filename))
+
+            self._repack(month)
+
+        for month in self.months():
+            self._repack(month)
+
+        notify('Archived {} loose files into {} monthly packs.', len(loose), len(self.months()))
+        return len(loose)
+
+    def close(self):
+        for memory_map in self._maps.values():
+            memory_map.close()
+        self._maps.clear()
+        self._indexes.clear()
+
+    def _append(self, month: str, entries):
+        """
+        Append pages to the pack of a month, then save its index.
+
+        :param entries: an iterable of (filename, html) pairs, consumed one by one
+        """
+
+        index = dict(self._index(month))
+        pack = join(self.directory, month + _PACK)
+
+        with open(pack, 'ab') as f:
+            offset = f.tell()
+            for filename, html in entries:
+                blob = compress(html.encode('utf-8'))
+                f.write(blob)
+                index[filename] = (offset, len(blob))
+                offset += len(blob)
+
+            f.flush()
+            fsync(f.fileno())
+
+        # The pack is appended first, so the index never points past its end
+        self._save_index(month, index)
+
+    def _read(self, filename: str) -> str:
+        with open(join(self.directory, filename), 'r') as f:
+            return f.read()
+
+    def _repack(self, month: str):
+        """ Drop the superseded copies, if any, by rewriting the pack in index order. """
+
+        index = self._index(month)
+        pack = join(self.directory, month + _PACK)
+
+        if sum(length for _, length in index.values()) == getsize(pack):
+            return
+
+        # The blobs are copied straight from the memory map of the old pack
+        memory_map = self._map(month)
+        temporary = pack + '.tmp'
+        repacked = dict()
+
+        with open(temporary, 'wb') as f:
+            for filename, (offset, length) in sorted(index.items(), key=lambda item: item[1]):
+                repacked[filename] = (f.tell(), length)
+                f.write(memory_map[offset:offset + length])
+
+            f.flush()
+            fsync(f.fileno())
+
+        self._forget(month)
+        replace(temporary, pack)
+        self._save_index(month, repacked)
+
+    def _index(self, month: str) -> dict:
+        """ The index of a month, empty if nothing has been archived for it yet. """
+
+        if month not in self._indexes:
+            filepath = join(self.directory, month + _INDEX)
+            if isfile(filepath):
+                with open(filepath, 'r') as f:
+                    self._indexes[month] = {k: tuple(v) for k, v in load(f).items()}
+            else:
+                return dict()
+
+        return self._indexes[month]
+
+    def _save_index(self, month: str, index: dict):
+        filepath = join(self.directory, month + _INDEX)
+        with open(filepath + '.tmp', 'w') as f:
+            dump(index, f)
+        replace(filepath + '.tmp', filepath)
+
+        self._forget(month)
+
+    def _map(self, month: str) -> mmap:
+        if month not in self._maps:
+            with open(join(self.directory, month + _PACK), 'rb') as f:
+                self._maps[month] = mmap(f.fileno(), 0, access=ACCESS_READ)
+        return self._maps[month]
+
+    def _forget(self, month: str):
+        """ Drop the cached index and memory map of a month that has changed. """
+
+        self._indexes.pop(month, None)
+        memory_map = self._maps.pop(month, None)
+        if memory_map is not None:
+            memory_map.close()
+
+    @staticmethod
+    def _month(filename: str) -> str:
+        """ Filenames start with the day, c.f. Miner._filepath. """
+        return filename[:7]
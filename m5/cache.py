@@ -0,0 +1,245 @@
+"""
+The cache module: remember query results until a push changes the days they depend on.
+
+Each entry is stored with the range of days it was computed from. When the Pusher writes
+a batch, it hands over the days it touched and only the overlapping entries are dropped.
+There's an in-memory LRU tier and an optional on-disk tier shared between processes.
+
+Geocoded addresses don't depend on any day: they are kept in a small SQLite file that
+every user (and every process) shares, so each address is geocoded once in total.
+The Scraper's output is kept the same way, per page fragment, next to the downloads.
+"""
+
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date, datetime
+from hashlib import sha1
+from json import dumps, loads
+from os import listdir, makedirs, remove, rename
+from os.path import isdir, isfile, join
+from pickle import dump, load, HIGHEST_PROTOCOL
+from sqlite3 import connect
+
+
+_OPEN = '-'
+
+
+class QueryCache():
+    """ A least-recently-used cache for query results with targeted invalidation. """
+
+    def __init__(self, size: int=128, directory: str=None):
+        """
+        :param size: the maximum number of entries kept in memory
+        :param directory: where to keep the on-disk tier (default: no disk tier)
+        """
+
+        self.size = size
+        self.directory = directory
+
+        if directory and not isdir(directory):
+            makedirs(directory)
+
+        # key -> (filename, begin, end, value)
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def cached(self, key: tuple, compute, begin: date=None, end: date=None):
+        """
+        Return the cached result for a key, or compute it and cache it.
+
+        :param key: a hashable description of the query and its parameters
+        :param compute: a function without arguments that runs the query
+        :param begin: the first day the result depends on (default: the beginning of time)
+        :param end: the last day the result depends on (default: the end of time)
+        """
+
+        filename = self._filename(key, begin, end)
+
+        if key in self._entries:
+            # Another process may have invalidated the
+            # entry, in which case the file is gone too.
+            if not self.directory or isfile(join(self.directory, filename)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][3]
+            del self._entries[key]
+
+        if self.directory and isfile(join(self.directory, filename)):
+            with open(join(self.directory, filename), 'rb') as f:
+                value = load(f)
+            self.hits += 1
+        else:
+            value = compute()
+            self.misses += 1
+            if self.directory:
+                self._save(filename, value)
+
+        self._entries[key] = (filename, begin, end, value)
+        if len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+        return value
+
+    def invalidate(self, days) -> int:
+        """
+        Drop every entry that depends on at least one of the days.
+
+        :param days: an iterable of date objects
+        :return: the number of entries dropped, counted once per tier
+        """
+
+        days = sorted(d.date() if isinstance(d, datetime) else d for d in days)
+        if not days:
+            return 0
+
+        stale = [key for key, (_, begin, end, _) in self._entries.items()
+                 if self._overlaps(begin, end, days)]
+        for key in stale:
+            del self._entries[key]
+
+        dropped = len(stale)
+
+        if self.directory:
+            for filename in listdir(self.directory):
+                if not filename.endswith('.pickle'):
+                    continue
+                begin, end = self._parse(filename)
+                if self._overlaps(begin, end, days):
+                    remove(join(self.directory, filename))
+                    dropped += 1
+
+        return dropped
+
+    def clear(self):
+        """ Drop everything, on disk too. """
+
+        self._entries.clear()
+
+        if self.directory:
+            for filename in listdir(self.directory):
+                if filename.endswith('.pickle'):
+                    remove(join(self.directory, filename))
+
+    def _save(self, filename: str, value):
+        """ Write to a temporary file first, so readers never see half a pickle. """
+
+        temporary = join(self.directory, filename + '.tmp')
+        with open(temporary, 'wb') as f:
+            dump(value, f, HIGHEST_PROTOCOL)
+        rename(temporary, join(self.directory, filename))
+
+    @staticmethod
+    def _overlaps(begin: date, end: date, days: list) -> bool:
+        """ Does the range [begin, end] contain any of the (sorted) days? """
+
+        n = 0 if begin is None else bisect_left(days, begin)
+        return n < len(days) and (end is None or days[n] <= end)
+
+    @staticmethod
+    def _filename(key: tuple, begin: date, end: date) -> str:
+        """ The date range goes into the filename, so invalidation never opens a file. """
+
+        digest = sha1(repr(key).encode('utf-8')).hexdigest()
+        begin = begin.strftime('%Y%m%d') if begin else _OPEN
+        end = end.strftime('%Y%m%d') if end else _OPEN
+        return '{}_{}_{}.pickle'.format(digest, begin, end)
+
+    @staticmethod
+    def _parse(filename: str) -> tuple:
+        _, begin, end = filename[:-len('.pickle')].split('_')
+        begin = None if begin == _OPEN else datetime.strptime(begin, '%Y%m%d').date()
+        end = None if end == _OPEN else datetime.strptime(end, '%Y%m%d').date()
+        return begin, end
+
+
+class GeocodeCache():
+    """ Geocoded addresses in a SQLite file shared between users and processes. """
+
+    # What the Packager needs from a geocoded address
+    _FIELDS = ('osm_id', 'lat', 'lon', 'display_name')
+
+    def __init__(self, filepath: str):
+        """
+        :param filepath: the SQLite file (created if needed)
+        """
+
+        self.filepath = filepath
+
+        # Several processes write at the same time: wait for the lock
+        self._connection = connect(filepath, timeout=30, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS geocode (address TEXT PRIMARY KEY, geocoded TEXT)')
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, raw_address) -> dict:
+        """ Return the geocoded address, or None if we've never seen it. """
+
+        row = self._connection.execute('SELECT geocoded FROM geocode WHERE address = ?',
+                                       (self._key(raw_address),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return loads(row[0])
+
+    def put(self, raw_address, geocoded: dict):
+        geocoded = {field: geocoded[field] for field in self._FIELDS}
+        self._connection.execute('INSERT OR REPLACE INTO geocode VALUES (?, ?)',
+                                 (self._key(raw_address), dumps(geocoded)))
+
+    def close(self):
+        self._connection.close()
+
+    @staticmethod
+    def _key(raw_address) -> str:
+        """ The fields sent to Nominatim, c.f. Packager.geocode. """
+        return '|'.join(raw_address[field] or '' for field in ('postal_code', 'address', 'city'))
+
+
+class ScrapeCache():
+    """
+    What the Scraper got out of each fragment of each page, keyed by the hash of
+    the page and stamped with the fingerprint of the instructions it was scraped with.
+    """
+
+    def __init__(self, filepath: str):
+        """
+        :param filepath: the SQLite file (created if needed)
+        """
+
+        self.filepath = filepath
+
+        self._connection = connect(filepath, timeout=30, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('CREATE TABLE IF NOT EXISTS scraped (page TEXT, fragment TEXT, '
+                                 'fingerprint TEXT, value TEXT, PRIMARY KEY (page, fragment))')
+
+    def get(self, page: str) -> dict:
+        """
+        :param page: the hash of the page
+        :return: fragment -> (fingerprint, value)
+        """
+
+        rows = self._connection.execute('SELECT fragment, fingerprint, value FROM scraped WHERE page = ?', (page,))
+        return {fragment: (fingerprint, loads(value)) for fragment, fingerprint, value in rows}
+
+    def put(self, page: str, fragments: dict):
+        """
+        :param page: the hash of the page
+        :param fragments: fragment -> (fingerprint, value)
+        """
+
+        self._connection.executemany('INSERT OR REPLACE INTO scraped VALUES (?, ?, ?, ?)',
+                                     [(page, fragment, fingerprint, dumps(value))
+                                      for fragment, (fingerprint, value) in fragments.items()])
+
+    def close(self):
+        self._connection.close()
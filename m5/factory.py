@@ -2,23 +2,45 @@
 The factory module: to make it short, we're duplicating a database. But not the easiest way.
 """
 
-from os import path
-from geopy.exc import GeocoderTimedOut
+from os import path, getpid, replace
 from os.path import isfile
-from geopy import Nominatim
 from datetime import datetime, date, timedelta
-from time import strptime
-from requests import Session as RemoteSession
-from bs4 import BeautifulSoup
+from typing import TYPE_CHECKING
 from pprint import PrettyPrinter
 from re import findall, match
+from hashlib import sha1
+from json import load, dump
+from queue import Queue, Empty
+from contextlib import contextmanager, nullcontext
+from threading import Thread
+from time import monotonic
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.session import Session as DatabaseSession
 
-from m5.utilities import notify, log_me, time_me, Stamped, Stamp, Tables, DEBUG
+from m5.utilities import notify, log_me, time_me, Stamped, Stamp, Tables, DEBUG, MAX_STOPS
 from m5.model import Checkin, Checkpoint, Client, Order
+from m5.spatial import geohash
+from m5.routes import Router
+from m5.cache import QueryCache, GeocodeCache, ScrapeCache
+from m5.archive import Archive
+from m5.profiling import StageProfiler
+from m5.partitions import Partitions
+from m5.records import Job, Address, ClientRow, OrderRow, CheckpointRow, CheckinRow
+from m5.parsers import decimal, decimals, timestamp
 from m5.user import User
 
+# Geopy and beautiful soup are only imported
+# by the departments that actually use them.
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+    from requests import Session as RemoteSession
+
+# Write-behind pushes: a group is committed when it holds
+# GROUP_ROWS rows or when its first batch is GROUP_SECONDS old.
+QUEUE_SIZE = 64
+GROUP_ROWS = 500
+GROUP_SECONDS = 1.0
+
 # TODO Refactor this module DRY.
 #   - blueprints (scraping specifications) should be defined
 #     within the db declarative model and unwrapped on the fly.
@@ -32,43 +54,167 @@ class Factory():
     It's basically a user-friendly wrapper around the Miner, Scraper, Packager and Pusher classes.
     """
 
-    def __init__(self, user: User, overwrite: bool=None):
-        """  Prepare everything we need for a data migration process. """
+    def __init__(self, user: User,
+                 overwrite: bool=None,
+                 cache: QueryCache=None,
+                 recency: int=None,
+                 geocache: GeocodeCache=None,
+                 write_behind: bool=False,
+                 scrape_cache: ScrapeCache=None,
+                 profiler: StageProfiler=None):
+        """
+        Prepare everything we need for a data migration process.
+
+        :param write_behind: push from a background writer thread, with group commits
+        :param scrape_cache: skip parsing the pages that have already been scraped
+        :param profiler: profile some stages (default: as set by the M5_PROFILE variables, if any)
+        """
 
         assert isinstance(user, User), 'Argument 1 must be a User object'
 
         # Factory departments
-        self.miner = Miner(user.remote_session, user.downloads, overwrite=overwrite)
-        self.scraper = Scraper()
-        self.packager = Packager()
-        self.pusher = Pusher(user.database_session)
+        self.miner = Miner(user.remote_session, user.downloads, overwrite=overwrite, recency=recency)
+        self.scraper = Scraper(cache=scrape_cache)
+        self.packager = Packager(geocache=geocache)
+        if write_behind:
+            self.pusher = WriteBehindPusher(user.database_session, cache=cache, partitions=user.partitions)
+        else:
+            self.pusher = Pusher(user.database_session, cache=cache, partitions=user.partitions)
+        self.router = Router(user.database_session, partitions=user.partitions)
+
+        # None unless profiling is asked for: then nothing is wrapped
+        self.profiler = profiler or StageProfiler.from_environment(path.join(user.m5_path, '../profiles', user.username))
+        if self.profiler:
+            self.profiler.bind(miner=self.miner, scraper=self.scraper, packager=self.packager,
+                               pusher=self.pusher, router=self.router)
+
+    def migrate(self, begin: date, end: date, progress=None, plan: bool=False):
+        """
+        Migrate data in bulk from the remote server into the local database.
 
-    def migrate(self, begin: date, end: date):
-        """  Migrate data in bulk from the remote server into the local database. """
+        :param progress: a function called with (day, number of jobs) after each day
+        :param plan: fetch all the summaries and download all the jobs in parallel first
+        """
 
         assert isinstance(begin, date), 'Argument 1 must be a date object'
         assert isinstance(end, date), 'Argument 2 must be a date object'
 
-        period = end - begin
-        days = range(period.days)
+        with self._run():
+            period = end - begin
+            days = range(period.days)
+
+            # day -> uuids, or None to ask for each day's summary as we go,
+            # and the pages that the planner has just brought up to date
+            planned = None
+            fresh = None
+
+            if plan:
+                from m5.planner import CrawlPlanner
+
+                planner = CrawlPlanner(self.miner)
+                with self._stage('miner'):
+                    work = planner.plan(begin, end)
+                    planner.download(work)
+                planned = planner.days(work)
+                fresh = set(work)
+
+            for d in days:
+                # Take one day's worth of data and
+                # walk through the data migration
+                # process from beginning to end
+                day = begin + timedelta(days=d)
+
+                # One job at a time flows through the pipeline,
+                # so memory doesn't grow with the number of jobs.
+                uuids = None if planned is None else planned.get(day, [])
+
+                pushed = 0
+                for table_job in self.stream(day, uuids=uuids, fresh=fresh):
+                    self.push(table_job)
+                    pushed += 1
+
+                if pushed:
+                    self.flush()
+                    self.route(day)
+
+                if progress:
+                    progress(day, pushed)
+
+                print('Migrated {n}/{N} ({percent}%).'
+                      .format(n=d, N=len(days), percent=int((d+1)/len(days)*100)))
+
+    def refresh(self, begin: date, end: date):
+        """
+        Re-migrate only the jobs that changed on the server. Cached pages are
+        checked again if they fall inside the Miner's recency window or if the
+        summary of their day has changed. Unchanged pages are not re-scraped.
+        """
+
+        assert isinstance(begin, date), 'Argument 1 must be a date object'
+        assert isinstance(end, date), 'Argument 2 must be a date object'
+
+        with self._run():
+            for d in range((end - begin).days):
+                day = begin + timedelta(days=d)
+
+                pushed = 0
+                for table_job in self.stream(day, changed_only=True):
+                    self.push(table_job)
+                    pushed += 1
+
+                if pushed:
+                    self.flush()
+                    self.route(day)
+
+            notify('Refreshed: {} pages unchanged.', self.miner.unchanged)
+
+    def stream(self, day: date, changed_only: bool=False, uuids: list=None, fresh: set=None):
+        """
+        Generate one day's Tables one job at a time, ready to be pushed. The
+        rows are light named tuples, inserted without the ORM (c.f. Pusher.insert).
+        """
+
+        # With a scrape cache, the pages go to the Scraper unparsed
+        soups = self.miner.stream(day, changed_only=changed_only, uuids=uuids, fresh=fresh,
+                                  raw=self.scraper.cache is not None)
+
+        if not self.profiler:
+            return self.packager.rows(self.scraper.stream(soups))
+
+        serial_jobs = self.profiler.iterate('scraper', self.scraper.stream(self.profiler.iterate('miner', soups)))
+        return self.profiler.iterate('packager', self.packager.rows(serial_jobs))
 
-        for d in days:
-            # Take one day's worth of data and
-            # walk through the data migration
-            # process from beginning to end
-            day = begin + timedelta(days=d)
+    def flush(self):
+        """ Routing reads the database, so it waits for the write-behind pushes. """
+        if isinstance(self.pusher, WriteBehindPusher):
+            with self._stage('pusher'):
+                self.pusher.flush()
 
-            soup_jobs = self.mine(day)
-            if soup_jobs:
-                serial_jobs = self.scrape(soup_jobs)
-                table_jobs = self.package(serial_jobs)
-                self.push(table_jobs)
+    def route(self, day: date) -> int:
+        with self._stage('router'):
+            return self.router.update(day)
 
-            print('Migrated {n}/{N} ({percent}%).'
-                  .format(n=d, N=len(days), percent=int((d+1)/len(days)*100)))
+    def push(self, table_jobs: Tables) -> set:
+        with self._stage('pusher'):
+            return self.pusher.insert(table_jobs)
 
-    def push(self, table_jobs: Tables) -> dict:
-        return self.pusher.push(table_jobs)
+    @contextmanager
+    def _run(self):
+        """ The scope of a migration: then the writer thread stops and the profiles are saved. """
+
+        try:
+            yield
+        finally:
+            try:
+                if isinstance(self.pusher, WriteBehindPusher):
+                    self.pusher.close()
+            finally:
+                if self.profiler:
+                    self.profiler.save()
+
+    def _stage(self, stage: str):
+        """ The profiler's context for a stage, or a no-op. """
+        return self.profiler.stage(stage) if self.profiler else nullcontext()
 
     def package(self, serial_jobs: list) -> Tables:
         return self.packager.package(serial_jobs)
@@ -81,36 +227,321 @@ class Factory():
 
 
 class Pusher():
+    """
+    The Pusher writes packaged rows into the database. Each batch gets its own
+    short-lived session, bound to the user's engine and closed after the commit:
+    nothing outlives a batch, so memory stays flat however long the migration.
+    """
+
+    def __init__(self, database_session: DatabaseSession, cache: QueryCache=None, partitions: Partitions=None):
+        """
+        :param partitions: write the orders and checkins into the partitions of their dates
+        """
 
-    def __init__(self, database_session: DatabaseSession):
         self.database_session = database_session
+        self.cache = cache
+        self.partitions = partitions
+
+    def push(self, tables: Tables) -> set:
+        """
+        Merge the rows into the database and invalidate the
+        cached query results that depend on the days touched.
+        With partitions, the rows are inserted or replaced instead.
+
+        :return: the set of days touched
+        """
+
+        if self.partitions is not None:
+            return self.insert(tables)
+
+        with self._batch() as session:
+            # Checkin keys are stable, so pushing the same rows again just
+            # updates them: the whole batch goes in with a single commit.
+            try:
+                for table in tables:
+                    for row in table:
+                        session.merge(row)
+                session.commit()
+
+            except IntegrityError:
+                # Something is wrong in the batch: find out what, row by row.
+                session.rollback()
+
+                for table in tables:
+                    for row in table:
+                        try:
+                            session.merge(row)
+                            session.commit()
+                        except IntegrityError:
+                            session.rollback()
+                            print('Database Intergrity ERROR: {table}'
+                                  .format(table=str(row)))
+
+        return self._touched(tables)
+
+    def insert(self, tables: Tables) -> set:
+        """
+        Insert or replace packaged rows (named tuples, c.f. Packager.rows)
+        with one Core-level statement per table: no ORM instances, no
+        identity map and one commit. Rows that miss a non-nullable
+        column are dropped, just like the database would refuse them.
+
+        :return: the set of days touched
+        """
+
+        if self.partitions is not None:
+            self.partitions.write(self._values(tables))
+            return self._touched(tables)
+
+        with self._batch() as session:
+            connection = session.connection()
+
+            for table, values in self._values(tables).items():
+                connection.execute(table.insert().prefix_with('OR REPLACE'), values)
+
+            session.commit()
+
+        return self._touched(tables)
+
+    @staticmethod
+    def _values(tables: Tables) -> dict:
+        """ The complete rows of each table as dictionaries, from named tuples or ORM instances. """
+
+        values = dict()
+
+        for model, rows in zip((Client, Order, Checkpoint, Checkin), tables):
+            table = model.__table__
+            required = [column.name for column in table.columns
+                        if column.primary_key or not column.nullable]
+
+            complete = [row._asdict() if hasattr(row, '_asdict') else
+                        {column.name: getattr(row, column.key) for column in table.columns}
+                        for row in rows
+                        if all(getattr(row, name) is not None for name in required)]
+
+            if len(complete) < len(rows) and DEBUG:
+                print('Dropped {n} incomplete {table} row(s).'
+                      .format(n=len(rows) - len(complete), table=table.name))
+
+            if complete:
+                values[table] = complete
+
+        return values
+
+    @contextmanager
+    def _batch(self):
+        """ A session for one batch, on the same engine as the user's session. """
+
+        session = DatabaseSession(bind=self.database_session.get_bind())
+        try:
+            yield session
+        finally:
+            session.close()
+
+    def _touched(self, tables: Tables) -> set:
+        """ Invalidate the cache for the days present in the tables and return them. """
+
+        days = self._days(tables)
+
+        if self.cache is not None:
+            self.cache.invalidate(days)
+
+        return days
+
+    @staticmethod
+    def _days(tables: Tables) -> set:
+        days = {order.date.date() if isinstance(order.date, datetime) else order.date
+                for order in tables.orders if order.date is not None}
+        days.update(checkin.timestamp.date()
+                    for checkin in tables.checkins if checkin.timestamp is not None)
+
+        return days
+
+
+class WriteBehindPusher(Pusher):
+    """
+    A Pusher that writes in the background. A writer thread does all the database
+    work and drains a bounded queue of Tables, which it merges into group commits:
+    the migration thread goes on mining while SQLite writes and syncs. The cache is
+    not thread-safe, so it's invalidated by flush(), on the migration thread.
+
+    A failed write sticks: the batches queued behind it are not written (their days
+    are in the failed set), new batches are refused, and every call raises the error
+    until close(). The writer starts with the first push and stops with close().
+    """
+
+    _BARRIER = object()
+
+    def __init__(self, database_session: DatabaseSession,
+                 cache: QueryCache=None,
+                 partitions: Partitions=None,
+                 queue_size: int=QUEUE_SIZE,
+                 group_rows: int=GROUP_ROWS,
+                 group_seconds: float=GROUP_SECONDS):
+        """
+        :param queue_size: how many Tables can wait before push() blocks
+        :param group_rows: commit when the group holds that many rows
+        :param group_seconds: commit when the group's first Tables is that old
+        """
+
+        super().__init__(database_session, cache=cache, partitions=partitions)
+
+        self.group_rows = group_rows
+        self.group_seconds = group_seconds
+
+        self.commits = 0
+        self.days = set()
+        self.failed = set()
+
+        self._queue = Queue(maxsize=queue_size)
+        self._error = None
+        self._writer = None
 
     def push(self, tables: Tables):
+        """ Queue the rows for the writer: blocks while the queue is full. """
+
+        self._raise()
+
+        if self._writer is None:
+            self.failed = set()
+            self._writer = Thread(target=self._write, name='m5-writer', daemon=True)
+            self._writer.start()
+
+        self._queue.put(tables)
+
+    # ORM instances or named tuples alike: the writer inserts them at the Core level
+    insert = push
+
+    def flush(self) -> set:
+        """
+        Wait until everything pushed so far is committed.
 
-        for table in tables:
-            for row in table:
+        :return: the set of days touched since the previous flush
+        """
+
+        if self._writer is not None:
+            # The barrier tells the writer not to wait for more batches
+            self._queue.put(self._BARRIER)
+            self._queue.join()
+        self._raise()
+
+        days, self.days = self.days, set()
+        if self.cache is not None:
+            self.cache.invalidate(days)
+
+        return days
+
+    def close(self):
+        """ Flush and stop the writer, then raise the write error if there was one. """
+
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+
+        days, self.days = self.days, set()
+        if self.cache is not None:
+            self.cache.invalidate(days)
+
+        error, self._error = self._error, None
+        if error is not None:
+            raise error
+
+    def _write(self):
+        """ The writer thread: take a group of Tables, commit them at once, repeat. """
+
+        while True:
+            tables = self._queue.get()
+
+            if tables is self._BARRIER:
+                self._queue.task_done()
+                continue
+            if tables is None:
+                self._queue.task_done()
+                return
+
+            group = [tables]
+            rows = sum(map(len, tables))
+            deadline = monotonic() + self.group_seconds
+            stop = False
+
+            # Keep filling the group while more batches keep coming
+            while rows < self.group_rows:
                 try:
-                    self.database_session.merge(row)
-                    self.database_session.commit()
-                except IntegrityError:
-                    self.database_session.rollback()
-                    print('Database Intergrity ERROR: {table}'
-                          .format(table=str(row)))
+                    tables = self._queue.get(timeout=max(deadline - monotonic(), 0))
+                except Empty:
+                    break
+
+                self._queue.task_done()
+                if tables is self._BARRIER:
+                    break
+                if tables is None:
+                    stop = True
+                    break
+
+                group.append(tables)
+                rows += sum(map(len, tables))
+
+            merged = Tables(*(sum(table, []) for table in zip(*group)))
+
+            try:
+                if self._error is None:
+                    self.days |= super().insert(merged)
+                    self.commits += 1
+                else:
+                    self.failed |= self._days(merged)
+            except Exception as error:
+                self._error = error
+                self.failed |= self._days(merged)
+            finally:
+                # Only the first batch is still
+                # unfinished: the others are done.
+                self._queue.task_done()
+
+            if stop:
+                return
+
+    def _touched(self, tables: Tables) -> set:
+        """ The writer thread only collects the days: the cache belongs to the migration thread. """
+        return self._days(tables)
+
+    def _raise(self):
+        if self._error is not None:
+            raise self._error
 
 
 class Miner():
     """ The Miner class downloads html files from the remote server. """
 
-    def __init__(self, remote_session: RemoteSession, directory: str, overwrite: bool=None):
-        """ Instantiate a re-useable Miner object. """
+    # Validators and content hashes of the cached pages
+    _INDEX = '.index.json'
+
+    def __init__(self, remote_session: 'RemoteSession', directory: str, overwrite: bool=None, recency: int=None,
+                 write_index: bool=True):
+        """
+        Instantiate a re-useable Miner object.
+
+        :param overwrite: always ask the server again, even for cached pages
+        :param recency: ask the server again for cached pages of the last n days
+        :param write_index: save the index of the cached pages (off when another process merges it)
+        """
 
         self.overwrite = overwrite
+        self.recency = recency
+        self.write_index = write_index
         self.remote_session = remote_session
         self.directory = directory
+        self.archive = Archive(directory)
 
         # The current job
         self.stamp = None
 
+        # The days whose summary has changed
+        self._relisted = set()
+        self._index = self._load_index()
+
+        self.unchanged = 0
+
     def mine(self, day: date):
         """
         Download the web-page showing one day of messenger data.
@@ -120,37 +551,77 @@ class Miner():
         :return: a list of Stamped beautiful soups
         """
 
+        soup_jobs = list(self.stream(day))
+        return soup_jobs or None
+
+    def stream(self, day: date, changed_only: bool=False, raw: bool=False, uuids: list=None, fresh: set=None):
+        """
+        Same as mine() but generate the Stamped beautiful soups one by one,
+        so that only the current job is held in memory.
+
+        :param changed_only: skip the pages that the server says haven't changed
+        :param raw: generate the html as saved on disk instead of soups
+        :param uuids: the jobs of the day, if already known (c.f. the planner module)
+        :param fresh: the stamps just downloaded (or checked) by the planner: served from the cache
+        """
+
         assert isinstance(day, date), 'Argument must be a date object'
 
         # Go browse the 'summary' for that day
         # and find out how many jobs we have.
-        uuids = self._scrape_uuids(day)
-
-        soup_jobs = list()
+        if uuids is None:
+            uuids = self._scrape_uuids(day)
 
         if not uuids:
-            soup_jobs = None
             if DEBUG:
                 print('No jobs to download on {day}.'.format(day=str(day)))
+            return
 
-        else:
-            for i, uuid in enumerate(uuids):
-                self.stamp = Stamp(day, uuid)
+        for i, uuid in enumerate(uuids):
+            self.stamp = Stamp(day, uuid)
 
-                if self._is_cached() and not self.overwrite:
-                    soup = self._load_job()
-                    verb = 'Loaded'
+            if self._is_cached() and (self.stamp in (fresh or ()) or not self.overwrite and not self._is_stale()):
+                if changed_only and self.stamp not in (fresh or ()):
+                    # Not checked against the server, so not changed either
+                    soup = None
+                    verb = 'Unchanged'
+                    self.unchanged += 1
                 else:
-                    soup = self._get_job()
-                    verb = 'Downloaded'
+                    soup = self._load_html() if raw else self._load_job()
+                    verb = 'Loaded'
+            else:
+                soup = self._get_job()
+                verb = 'Downloaded'
 
-                if DEBUG:
-                    print('{verb} {n}/{N}. {url}'.
-                          format(verb=verb, n=i+1, N=len(uuids), url=self._job_url()))
+                if soup is None:
+                    verb = 'Unchanged'
+                    self.unchanged += 1
+                elif raw:
+                    soup = self._load_html()
+
+            if DEBUG:
+                print('{verb} {n}/{N}. {url}'.
+                      format(verb=verb, n=i+1, N=len(uuids), url=self._job_url()))
+
+            if soup is None:
+                if changed_only:
+                    continue
+                soup = self._load_html() if raw else self._load_job()
 
-                soup_jobs.append(Stamped(self.stamp, soup))
+            yield Stamped(self.stamp, soup)
 
-        return soup_jobs
+        self.save_index()
+
+    def _is_stale(self, stamp: Stamp=None) -> bool:
+        """ Cached pages can still change if they are recent or if the day's summary has changed. """
+
+        stamp = stamp or self.stamp
+
+        if stamp.date in self._relisted:
+            return True
+        if self.recency is not None:
+            return (date.today() - stamp.date).days <= self.recency
+        return False
 
     def _scrape_uuids(self, day: date) -> set:
         """ Return uuid request parameters for each job by scraping the summary page. """
@@ -159,9 +630,22 @@ class Miner():
         self.stamp = Stamp(day, 'NO_JOBS')
 
         # Avoid doing things twice
-        if self._is_cached():
+        if self.is_empty(day):
             return None
 
+        uuids, digest = self.summary(day)
+        self.record(day, uuids, digest)
+
+        return uuids
+
+    def summary(self, day: date) -> tuple:
+        """
+        Fetch the summary page of a day. It leaves the current stamp
+        alone, so it's safe to call from several threads at once.
+
+        :return: the set of uuids and the hash of the listing
+        """
+
         url = 'http://bamboo-mec.de/ll.php5'
         payload = {'status': 'delivered', 'datum': day.strftime('%d.%m.%Y')}
         response = self.remote_session.get(url, params=payload)
@@ -172,56 +656,168 @@ class Miner():
 
         jobs = findall(pattern, response.text)
 
+        # Only the lines of the listing itself are
+        # hashed: the rest of the page is noise.
+        listing = '\n'.join(findall(r'[^\n]*uuid=\d{7}[^\n]*', response.text))
+        digest = sha1(listing.encode('utf-8')).hexdigest()
+
         # Dump the duplicates.
-        return set(jobs)
+        return set(jobs), digest
+
+    def record(self, day: date, uuids: set, digest: str):
+        """ Remember the listing of a day, and the days gone by without any jobs. """
 
-    def _get_job(self) -> BeautifulSoup:
-        """ Browse the web-page for that day and return a beautiful soup. """
+        summaries = self._index.setdefault('summaries', dict())
+        previous = summaries.get(str(day))
+        summaries[str(day)] = digest
+
+        if previous is not None and previous != digest:
+            self._relisted.add(day)
+
+        # Recent days may still get jobs
+        if not uuids and (date.today() - day).days > (self.recency or 0):
+            open(self._filepath(Stamp(day, 'NO_JOBS')), 'w').close()
+
+    def is_empty(self, day: date) -> bool:
+        """ Has the day been recorded without any jobs? """
+        return self._is_cached(Stamp(day, 'NO_JOBS'))
+
+    def fetch(self, stamp: Stamp) -> bool:
+        """
+        Download a job page, unless it's cached and can't have changed. It leaves
+        the current stamp alone, so it's safe to call from several threads at once.
+
+        :return: True if a new version of the page was saved
+        """
+
+        if self._is_cached(stamp) and not self.overwrite and not self._is_stale(stamp):
+            return False
+        return self._get_job(stamp) is not None
+
+    def _get_job(self, stamp: Stamp=None) -> 'BeautifulSoup':
+        """
+        Browse the web-page for that day and return a beautiful soup. If the page
+        is cached and the server (or the content hash) says that it hasn't changed,
+        return None: the page is neither parsed nor saved again.
+        """
+
+        stamp = stamp or self.stamp
 
         url = 'http://bamboo-mec.de/ll_detail.php5'
         payload = {'status': 'delivered',
-                   'uuid': self.stamp.uuid,
-                   'datum': self.stamp.date.strftime('%d.%m.%Y')}
-        response = self.remote_session.get(url, params=payload)
+                   'uuid': stamp.uuid,
+                   'datum': stamp.date.strftime('%d.%m.%Y')}
+
+        filename = path.basename(self._filepath(stamp))
+        cached = self._is_cached(stamp)
+        pages = self._index.setdefault('pages', dict())
+        known = pages.get(filename, dict()) if cached else dict()
+
+        # Conditional request, if the server ever gave us validators
+        headers = dict()
+        if known.get('etag'):
+            headers['If-None-Match'] = known['etag']
+        if known.get('last_modified'):
+            headers['If-Modified-Since'] = known['last_modified']
+
+        response = self.remote_session.get(url, params=payload, headers=headers)
+
+        if response.status_code == 304:
+            return None
+
+        digest = sha1(response.content).hexdigest()
+        pages[filename] = {'etag': response.headers.get('ETag'),
+                           'last_modified': response.headers.get('Last-Modified'),
+                           'sha1': digest}
+
+        if cached and known.get('sha1') == digest:
+            return None
+
+        from bs4 import BeautifulSoup
 
         soup = BeautifulSoup(response.text)
-        self._save_job(soup)
+        self._save_job(soup, stamp)
 
         return soup
 
-    def _filepath(self):
-        """ Where a job's html file is saved. """
-        filename = '%s-uuid-%s.html' % (self.stamp.date.strftime('%Y-%m-%d'), self.stamp.uuid)
+    def _load_index(self) -> dict:
+        filepath = path.join(self.directory, self._INDEX)
+        if isfile(filepath):
+            with open(filepath, 'r') as f:
+                return load(f)
+        return dict()
+
+    @property
+    def index(self) -> dict:
+        """ The validators and content hashes of the cached pages, and the digests of the summaries. """
+        return self._index
+
+    def merge_index(self, index: dict):
+        """ Fold the index of another Miner on the same folder into the one on disk. """
+
+        self._index = self._load_index()
+        for section, entries in index.items():
+            self._index.setdefault(section, dict()).update(entries)
+        self.save_index()
+
+    def save_index(self):
+        """ Replace the index at once, so that a reader never sees half of it. """
+
+        if self.write_index and path.isdir(self.directory):
+            filepath = path.join(self.directory, self._INDEX)
+            temporary = '%s.%d.tmp' % (filepath, getpid())
+            with open(temporary, 'w') as f:
+                dump(self._index, f)
+            replace(temporary, filepath)
+
+    def _filepath(self, stamp: Stamp=None):
+        """ Where a job's html file is saved (the current job by default). """
+        stamp = stamp or self.stamp
+        filename = '%s-uuid-%s.html' % (stamp.date.strftime('%Y-%m-%d'), stamp.uuid)
         return path.join(self.directory, filename)
 
     def _job_url(self):
         return 'http://bamboo-mec.de/ll_detail.php5?status=delivered&uuid={uuid}&datum={date}'\
             .format(uuid=self.stamp.uuid, date=self.stamp.date.strftime('%d.%m.%Y'))
 
-    def _is_cached(self):
-        if isfile(self._filepath()):
+    def _is_cached(self, stamp: Stamp=None):
+        if isfile(self._filepath(stamp)):
             return True
         else:
-            return False
+            return path.basename(self._filepath(stamp)) in self.archive
 
-    def _save_job(self, soup: BeautifulSoup):
+    def _save_job(self, soup: 'BeautifulSoup', stamp: Stamp=None):
         """ Prettify the html and save it to file. """
         pretty_html = soup.prettify()
-        with open(self._filepath(), 'w+') as f:
+        with open(self._filepath(stamp), 'w+') as f:
             f.write(pretty_html)
 
     def _load_job(self):
         """ Load an html file and return a beautiful soup. """
-        with open(self._filepath(), 'r') as f:
-            html = f.read()
-        return BeautifulSoup(html)
+        from bs4 import BeautifulSoup
+        return BeautifulSoup(self._load_html())
+
+    def _load_html(self) -> str:
+        """ Load an html file, loose or archived. """
+
+        # A loose file is newer than its archived copy
+        if isfile(self._filepath()):
+            with open(self._filepath(), 'r') as f:
+                return f.read()
+        return self.archive.get(path.basename(self._filepath()))
 
 
 class Packager():
     """ The Packager class processes the raw serial data produced by the Scraper. """
 
-    def __init__(self):
-        pass
+    # The job fields holding German decimal numbers
+    _PRICES = ('km', 'city_tour', 'extra_stops', 'overnight', 'fax_confirm', 'waiting_time')
+
+    def __init__(self, geocache: GeocodeCache=None):
+        """
+        :param geocache: remember geocoded addresses (optional)
+        """
+        self.geocache = geocache
 
     def package(self, serial_items: list) -> Tables:
         """
@@ -234,10 +830,33 @@ class Packager():
 
         assert serial_items is not None, 'Argument cannot be None.'
 
-        clients = list()
-        orders = list()
-        checkpoints = list()
-        checkins = list()
+        tables = Tables(list(), list(), list(), list())
+
+        for job in self.stream(serial_items):
+            for table, rows in zip(tables, job):
+                table.extend(rows)
+
+        return tables
+
+    def rows(self, serial_items):
+        """
+        Same as stream() but package plain named tuples instead of ORM
+        instances. They are much lighter and go with Pusher.insert().
+
+        :param serial_items: an iterable of Stamped(Stamp, serial_data) objects
+        """
+        return self.stream(serial_items, types=(ClientRow, OrderRow, CheckpointRow, CheckinRow))
+
+    def stream(self, serial_items, types: tuple=None):
+        """
+        Same as package() but generate one Tables object per job, so
+        that the rows can be pushed before the next job is packaged.
+
+        :param serial_items: an iterable of Stamped(Stamp, serial_data) objects
+        :param types: what to package the rows into (default: the ORM classes)
+        """
+
+        Client_, Order_, Checkpoint_, Checkin_ = types or (Client, Order, Checkpoint, Checkin)
 
         for serial_item in serial_items:
 
@@ -247,56 +866,95 @@ class Packager():
             job_details = serial_item[1][0]
             addresses = serial_item[1][1]
 
-            client = Client(**{'client_id': self._unserialise(int, job_details['client_id']),
-                               'name': self._unserialise(str, job_details['client_name'])})
-
-            order = Order(**{'order_id': self._unserialise(int, job_details['order_id']),
-                             'client_id': self._unserialise(int, job_details['client_id']),
-                             'uuid': int(uuid),
-                             'date': day,
-                             'distance': self._unserialise_float(job_details['km']),
-                             'cash': self._unserialise(bool, job_details['cash']),
-                             'city_tour': self._unserialise_float(job_details['city_tour']),
-                             'extra_stops': self._unserialise_float(job_details['extra_stops']),
-                             'overnight': self._unserialise_float(job_details['overnight']),
-                             'fax_confirm': self._unserialise_float(job_details['fax_confirm']),
-                             'waiting_time': self._unserialise_float(job_details['waiting_time']),
-                             'type': self._unserialise_type(job_details['type'])})
-
-            clients.append(client)
-            orders.append(order)
+            # The prices are parsed in one batch
+            distance, city_tour, extra_stops, overnight, fax_confirm, waiting_time = \
+                decimals(job_details[field] for field in self._PRICES)
+
+            client = Client_(**{'client_id': self._unserialise(int, job_details['client_id']),
+                                'name': self._unserialise(str, job_details['client_name'])})
+
+            order = Order_(**{'order_id': self._unserialise(int, job_details['order_id']),
+                              'client_id': self._unserialise(int, job_details['client_id']),
+                              'uuid': int(uuid),
+                              'date': day,
+                              'distance': distance,
+                              'cash': self._unserialise(bool, job_details['cash']),
+                              'city_tour': city_tour,
+                              'extra_stops': extra_stops,
+                              'overnight': overnight,
+                              'fax_confirm': fax_confirm,
+                              'waiting_time': waiting_time,
+                              'type': self._unserialise_type(job_details['type'])})
+
+            checkpoints = list()
+            checkins = list()
+
+            # A checkin without a time or a location can't be stored, so it isn't
+            # ranked either: the keys are the ranks of the stored checkins, just
+            # like the migrations module computes them from the database.
+            order_id = self._unserialise(int, job_details['order_id'])
+            stops = list()
 
             for address in addresses:
-                geocoded = self.geocode(address)
-
-                checkpoint = Checkpoint(**{'checkpoint_id': geocoded['osm_id'],
-                                           'display_name': geocoded['display_name'],
-                                           'lat': geocoded['lat'],
-                                           'lon': geocoded['lat'],
-                                           'street': self._unserialise(str, address['address']),
-                                           'city': self._unserialise(str, address['city']),
-                                           'postal_code': self._unserialise(int, address['postal_code']),
-                                           'company': self._unserialise(str, address['company'])})
-
-                checkin = Checkin(**{'checkin_id': self._hash_timestamp(day, address['timestamp']),
-                                     'checkpoint_id': geocoded['osm_id'],
-                                     'order_id': self._unserialise(int, job_details['order_id']),
-                                     'timestamp': self._unserialise_timestamp(day, address['timestamp']),
-                                     'purpose': self._unserialise_purpose(address['purpose']),
-                                     'after_': self._unserialise_timestamp(day, address['after']),
-                                     'until': self._unserialise_timestamp(day, address['until'])})
+                checkin_time = self._unserialise_timestamp(day, address['timestamp'])
+                geocoded = self._geocode(address)
+
+                if checkin_time is None or geocoded['osm_id'] is None:
+                    if DEBUG:
+                        print('Skipped a stop of order {order}: no time or no location.'.format(order=order_id))
+                    continue
+
+                stops.append((address, checkin_time, geocoded))
+
+            sequences = self._sequence([checkin_time for _, checkin_time, _ in stops])
+
+            for (address, checkin_time, geocoded), sequence in zip(stops, sequences):
+                if sequence >= MAX_STOPS:
+                    print('Skipped stop {n} of order {order}: the keys hold {max} stops per order.'
+                          .format(n=sequence + 1, order=order_id, max=MAX_STOPS))
+                    continue
+
+                checkpoint = Checkpoint_(**{'checkpoint_id': geocoded['osm_id'],
+                                            'display_name': geocoded['display_name'],
+                                            'lat': geocoded['lat'],
+                                            'lon': geocoded['lon'],
+                                            'geohash': geohash(geocoded['lat'], geocoded['lon']),
+                                            'street': self._unserialise(str, address['address']),
+                                            'city': self._unserialise(str, address['city']),
+                                            'postal_code': self._unserialise(int, address['postal_code']),
+                                            'company': self._unserialise(str, address['company'])})
+
+                checkin = Checkin_(**{'checkin_id': self.checkin_key(order_id, sequence),
+                                      'checkpoint_id': geocoded['osm_id'],
+                                      'order_id': order_id,
+                                      'timestamp': checkin_time,
+                                      'purpose': self._unserialise_purpose(address['purpose']),
+                                      'after_': self._unserialise_timestamp(day, address['after']),
+                                      'until': self._unserialise_timestamp(day, address['until'])})
 
                 checkpoints.append(checkpoint)
                 checkins.append(checkin)
 
             notify('Packaged {}-uuid-{}.', str(day), uuid)
 
-        # The order matters when we commit to the database
-        # because foreign keys must be refer to existing
-        # rows in related tables, c.f. the model module.
-        tables = Tables(clients, orders, checkpoints, checkins)
+            # The order matters when we commit to the database
+            # because foreign keys must be refer to existing
+            # rows in related tables, c.f. the model module.
+            yield Tables([client], [order], checkpoints, checkins)
 
-        return tables
+    def _geocode(self, raw_address: dict) -> dict:
+        """ Ask the geocode cache first, and remember the addresses that Nominatim matched. """
+
+        if self.geocache is None:
+            return self.geocode(raw_address)
+
+        geocoded = self.geocache.get(raw_address)
+        if geocoded is None:
+            geocoded = self.geocode(raw_address)
+            if geocoded['osm_id'] is not None:
+                self.geocache.put(raw_address, geocoded)
+
+        return geocoded
 
     @staticmethod
     def geocode(raw_address: dict) -> dict:
@@ -305,7 +963,10 @@ class Packager():
         The returned osm_id is used as the primary key in the checkpoint table.
         So, if we can't geocode an address, it will won't make it into the database.
         """
-    
+
+        from geopy import Nominatim
+        from geopy.exc import GeocoderTimedOut
+
         g = Nominatim()
 
         json_address = {'postalcode': raw_address['postal_code'],
@@ -371,15 +1032,7 @@ class Packager():
     @staticmethod
     def _unserialise_timestamp(day, raw_time: str):
         """ This is a dirty fix """
-        if raw_time in ('', None):
-            return None
-        else:
-            t = strptime(raw_time, '%H:%M')
-            return datetime(day.year,
-                            day.month,
-                            day.day,
-                            hour=t.tm_hour,
-                            minute=t.tm_min)
+        return timestamp(day, raw_time)
 
     @staticmethod
     def _unserialise_type(raw_value: str):
@@ -394,26 +1047,37 @@ class Packager():
             return None
 
     @staticmethod
-    def _hash_timestamp(day, raw_time: str):
-        """ This is a dirty fix """
-        if raw_time in (None, ''):
+    def checkin_key(order_id: int, sequence: int) -> int:
+        """
+        The primary key of a checkin is derived from its order and its rank
+        inside the order, so packaging the same job twice gives the same keys
+        and re-pushing a day is an idempotent upsert. The migrations module
+        uses the same scheme to re-key existing databases.
+        """
+
+        if order_id is None:
             return None
-        else:
-            t = strptime(raw_time, '%H:%M')
-            d = datetime(day.year,
-                         day.month,
-                         day.day,
-                         hour=t.tm_hour,
-                         minute=t.tm_min)
-            return d.__hash__()
+
+        assert 0 <= sequence < MAX_STOPS, 'Too many stops for one order'
+        return order_id * MAX_STOPS + sequence
+
+    @staticmethod
+    def _sequence(checkin_times: list) -> list:
+        """ Rank the checkins of an order by time (ties keep the page order, missing times go last). """
+
+        ranked = sorted(range(len(checkin_times)),
+                        key=lambda n: (checkin_times[n] is None, checkin_times[n] or datetime.min, n))
+
+        sequences = [None] * len(checkin_times)
+        for sequence, n in enumerate(ranked):
+            sequences[n] = sequence
+
+        return sequences
 
     @staticmethod
     def _unserialise_float(raw_price: str):
         """ This is a dirty fix """
-        if raw_price in (None, ''):
-            return None
-        else:
-            return float(raw_price.replace(',', '.'))
+        return decimal(raw_price)
 
 
 class Scraper:
@@ -442,8 +1106,35 @@ class Scraper:
                                    timestamp={'line_nb': -2, 'pattern': r'ST:\s(\d{2}:\d{2})', 'nullable': False},
                                    until={'line_nb': -3, 'pattern': r'(?:.*)bis\s+(\d{2}:\d{2})', 'nullable': True})}
 
-    def __init__(self):
+    # Original price names are no good. Change them.
+    _PRICE_KEYS = [('Stadtkurier', 'city_tour'),
+                   ('Stadt Stopp(s)', 'extra_stops'),
+                   ('OV Ex Nat PU', 'overnight'),
+                   ('ON Ex Nat Del.', 'overnight'),
+                   ('OV EcoNat PU', 'overnight'),
+                   ('OV Ex Int PU', 'overnight'),
+                   ('ON Int Exp Del', 'overnight'),
+                   ('EmpfangsbestÃ¤t.', 'fax_confirm'),
+                   ('Wartezeit min.', 'waiting_time')]
+
+    # The parts of a page that are scraped separately.
+    _FRAGMENTS = ('header', 'client', 'itinerary', 'prices', 'address')
+
+    # Bump this when the scraping code itself changes: the
+    # tag tables and the blueprints are fingerprinted anyway.
+    _VERSION = 1
+
+    def __init__(self, cache: ScrapeCache=None):
+        """
+        :param cache: remember what was scraped out of each page (optional)
+        """
+
         self.stamp = None
+        self.cache = cache
+        self.fingerprints = self._fingerprints()
+
+        self.parsed = 0
+        self.skipped = 0
 
     @time_me
     @log_me
@@ -459,28 +1150,40 @@ class Scraper:
 
         assert soup_jobs is not None, 'Argument cannot be None.'
 
-        serial_jobs = list()
+        return list(self.stream(soup_jobs))
+
+    def stream(self, soup_jobs):
+        """
+        Same as scrape() but generate the serial jobs one by one. Raw html
+        is also accepted instead of soups: then, with a cache, the pages
+        that have already been scraped are not even parsed.
+
+        :param soup_jobs: an iterable of Stamped(Stamp, BeautifulSoup or html)
+        """
 
         for i, soup_job in enumerate(soup_jobs):
             self.stamp = soup_job.stamp
 
-            job_details, addresses = self._scrape_job(soup_job)
+            if not isinstance(soup_job.data, str):
+                job_details, addresses = self._scrape_job(soup_job)
+            elif self.cache is None:
+                from bs4 import BeautifulSoup
+                job_details, addresses = self._scrape_job(Stamped(soup_job.stamp, BeautifulSoup(soup_job.data)))
+            else:
+                job_details, addresses = self._scrape_html(soup_job)
             serial_job = Stamped(soup_job.stamp, (job_details, addresses))
 
-            serial_jobs.append(serial_job)
-
             if DEBUG:
-                print('Scraped {n}/{N}: {date}-uuid-{uuid}.html'
+                print('Scraped {n}: {date}-uuid-{uuid}.html'
                       .format(date=str(soup_job.stamp.date),
                               uuid=soup_job.stamp.uuid,
-                              N=len(soup_jobs),
                               n=i+1))
 
                 pp = PrettyPrinter()
                 pp.pprint(job_details)
                 pp.pprint(addresses)
 
-        return serial_jobs
+            yield serial_job
 
     def _job_url(self):
         """ The url of the web-page for a job. """
@@ -490,7 +1193,7 @@ class Scraper:
     def _scrape_job(self, soup_item: Stamped) -> tuple:
         """
         Scrape out of a job's web page using bs4 and re modules.
-        In goes the soup, out come dictionaries contaning field
+        In goes the soup, out come records contaning field
         name/value pairs as raw strings.
 
         :param soup_item: the job's web page as a soup
@@ -500,39 +1203,95 @@ class Scraper:
         # Pass the soup through the sieve
         soup = soup_item.data.find(id='order_detail')
 
-        # Step 1: scrape job details
-        job_details = dict()
+        fragments = self._scrape_fragments(soup, soup_item.stamp, self._FRAGMENTS)
+        return self._assemble(fragments)
+
+    def _scrape_html(self, html_item: Stamped) -> tuple:
+        """
+        Same as _scrape_job() but for raw html, through the cache. Only the
+        fragments whose instructions have changed since they were cached are
+        scraped again, and the page is only parsed if there are any.
+        """
+
+        page = sha1(html_item.data.encode('utf-8')).hexdigest()
+
+        fragments = {fragment: value for fragment, (fingerprint, value) in self.cache.get(page).items()
+                     if self.fingerprints.get(fragment) == fingerprint}
+        stale = [fragment for fragment in self._FRAGMENTS if fragment not in fragments]
+
+        if stale:
+            from bs4 import BeautifulSoup
 
-        # Step 1.1: everything except prices
-        fragments = ['header', 'client', 'itinerary']
+            soup = BeautifulSoup(html_item.data).find(id='order_detail')
+            scraped = self._scrape_fragments(soup, html_item.stamp, stale)
+
+            self.cache.put(page, {fragment: (self.fingerprints[fragment], scraped[fragment]) for fragment in stale})
+            fragments.update(scraped)
+            self.parsed += 1
+        else:
+            self.skipped += 1
+
+        return self._assemble(fragments)
+
+    def _scrape_fragments(self, soup: 'BeautifulSoup', stamp: Stamp, fragments) -> dict:
+        """
+        Scrape some fragments of the page.
+
+        :return: fragment -> field name/value pairs (a list of them for addresses)
+        """
+
+        scraped = dict()
 
         for fragment in fragments:
-            soup_fragment = soup.find_next(name=self._TAGS[fragment]['name'])
-            fields_subset = self._scrape_fragment(self._BLUEPRINTS[fragment], soup_fragment,
-                                                  soup_item.stamp, fragment)
-            job_details.update(fields_subset)
+            if fragment == 'prices':
+                # The price table
+                soup_fragment = soup.find(self._TAGS['prices']['name'])
+                scraped[fragment] = self._scrape_prices(soup_fragment)
+
+            elif fragment == 'address':
+                # An arbitrary number of addresses
+                soup_fragments = soup.find_all(name=self._TAGS['address']['name'],
+                                               attrs=self._TAGS['address']['attrs'])
+                scraped[fragment] = [self._scrape_fragment(self._BLUEPRINTS['address'], soup_fragment,
+                                                           stamp, 'address')
+                                     for soup_fragment in soup_fragments]
 
-        # Step 1.2: the price table
-        soup_fragment = soup.find(self._TAGS['prices']['name'])
-        prices = self._scrape_prices(soup_fragment)
+            else:
+                # Everything else
+                soup_fragment = soup.find_next(name=self._TAGS[fragment]['name'])
+                scraped[fragment] = self._scrape_fragment(self._BLUEPRINTS[fragment], soup_fragment,
+                                                          stamp, fragment)
+
+        return scraped
 
-        job_details.update(prices)
+    @staticmethod
+    def _assemble(fragments: dict) -> tuple:
+        """ Put the fragments together into job details and addresses. """
 
-        # Step 2: scrape an arbitrary number of addresses
-        soup_fragments = soup.find_all(name=self._TAGS['address']['name'],
-                                       attrs=self._TAGS['address']['attrs'])
-        addresses = list()
-        for soup_fragment in soup_fragments:
-            address = self._scrape_fragment(self._BLUEPRINTS['address'], soup_fragment,
-                                            soup_item.stamp, 'address')
+        job_details = dict()
+        for fragment in ('header', 'client', 'itinerary', 'prices'):
+            job_details.update(fragments[fragment])
 
-            addresses.append(address)
+        # Slotted records are much smaller than dictionaries.
+        return Job(**job_details), [Address(**address) for address in fragments['address']]
 
-        return job_details, addresses
+    @classmethod
+    def _fingerprints(cls) -> dict:
+        """ A hash of the instructions used for each fragment. """
+
+        fingerprints = dict()
+        for fragment in cls._FRAGMENTS:
+            instructions = (cls._VERSION,
+                            cls._TAGS[fragment],
+                            cls._BLUEPRINTS.get(fragment),
+                            cls._PRICE_KEYS if fragment == 'prices' else None)
+            fingerprints[fragment] = sha1(repr(instructions).encode('utf-8')).hexdigest()
+
+        return fingerprints
 
     def _scrape_fragment(self,
                          blueprints: dict,
-                         soup_fragment: BeautifulSoup,
+                         soup_fragment: 'BeautifulSoup',
                          stamp: Stamp,
                          tag: str) -> dict:
         """
@@ -576,8 +1335,8 @@ class Scraper:
 
         return collected
 
-    @staticmethod
-    def _scrape_prices(soup_fragment: BeautifulSoup) -> dict:
+    @classmethod
+    def _scrape_prices(cls, soup_fragment: 'BeautifulSoup') -> dict:
         """
         Scrape the 'prices' table at the bottom of the page. There's no
         objective reason why this section should be treated seperately.
@@ -593,18 +1352,7 @@ class Scraper:
         cells = list(soup_fragment.stripped_strings)
         price_table = dict(zip(cells[::2], cells[1::2]))
 
-        # Original field names are no good. Change them.
-        keys = [('Stadtkurier', 'city_tour'),
-                ('Stadt Stopp(s)', 'extra_stops'),
-                ('OV Ex Nat PU', 'overnight'),
-                ('ON Ex Nat Del.', 'overnight'),
-                ('OV EcoNat PU', 'overnight'),
-                ('OV Ex Int PU', 'overnight'),
-                ('ON Int Exp Del', 'overnight'),
-                ('EmpfangsbestÃ¤t.', 'fax_confirm'),
-                ('Wartezeit min.', 'waiting_time')]
-
-        for old, new in keys:
+        for old, new in cls._PRICE_KEYS:
             if old in price_table:
                 price_table[new] = price_table.pop(old)
             else:
@@ -0,0 +1,150 @@
+"""
+The federation module: shop-wide statistics over the databases of several users.
+
+Every courier has a database of their own (db/<username>.sqlite). The federated
+statistics run the same aggregate on each database in parallel, one thread per
+database, and merge the partial results: counts and revenues add up, per month
+or per client. SQLite lets go of the GIL while it works, so a shop-wide report
+takes about as long as the slowest database, not the sum of them all.
+
+The databases are opened read-only: the federation never competes with the
+migrations for the write lock. A user whose orders and checkins are partitioned
+has a folder next to the database (db/<username>/): the queries go through it.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from glob import glob
+from os.path import abspath, basename, isdir, join, splitext
+from urllib.parse import quote
+
+from sqlalchemy import create_engine, inspect
+from sqlalchemy.orm import sessionmaker
+
+from m5.model import Order
+from m5.partitions import Partitions
+from m5.statistics import Stats
+
+
+class FederatedStats():
+    """ The Stats queries over several user databases, merged. """
+
+    def __init__(self, databases: dict, workers: int=None):
+        """
+        :param databases: username -> the filepath of the user's database (c.f. User.db_path)
+        :param workers: the number of databases queried at once (default: all of them)
+        """
+
+        assert databases, 'Federate at least one database'
+
+        self.workers = workers or len(databases)
+        self.engines = OrderedDict()
+        self.stats = OrderedDict()
+
+        for username, filepath in sorted(databases.items()):
+            engine = _engine(filepath)
+            self.engines[username] = engine
+            self.stats[username] = Stats(sessionmaker(bind=engine)(), partitions=_partitions(filepath))
+
+    @classmethod
+    def from_directory(cls, directory: str, workers: int=None):
+        """
+        Federate every user database in a folder (c.f. User.db_path). The other
+        SQLite files there, like the shared geocode cache, are left out.
+        """
+
+        return cls({splitext(basename(filepath))[0]: filepath
+                    for filepath in glob(join(directory, '*.sqlite'))
+                    if _is_user_database(filepath)}, workers=workers)
+
+    def per_user(self, query: str, *args, **kwargs) -> OrderedDict:
+        """
+        Run one Stats query on every database at once.
+
+        :param query: the name of the Stats method
+        :return: username -> the result of that user's query
+        """
+
+        def run(stats: Stats):
+            try:
+                return getattr(stats, query)(*args, **kwargs)
+            finally:
+                # Don't hold a read transaction open between two reports
+                stats.session.close()
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = pool.map(run, self.stats.values())
+
+        return OrderedDict(zip(self.stats, results))
+
+    def monthly_totals(self, begin: date=None, end: date=None) -> list:
+        """ Return (YYYY-MM, number of orders, revenue) for each month, for the whole shop. """
+
+        months = dict()
+        for partial in self.per_user('monthly_totals', begin, end).values():
+            for month, orders, revenue in partial:
+                total = months.setdefault(month, [0, 0.0])
+                total[0] += orders
+                total[1] += revenue or 0
+
+        return [(month, orders, revenue) for month, (orders, revenue) in sorted(months.items())]
+
+    def top_clients(self, n: int=10, begin: date=None, end: date=None) -> list:
+        """
+        Return (client_id, name, number of orders, revenue) for the shop's n best clients.
+        A client served by several couriers shows up in several databases: the full
+        totals per client are merged first, since the top n of each database are not enough.
+        """
+
+        clients = dict()
+        for partial in self.per_user('client_totals', begin, end).values():
+            for client_id, name, orders, revenue in partial:
+                total = clients.setdefault(client_id, [name, 0, 0.0])
+                total[1] += orders
+                total[2] += revenue or 0
+
+        merged = [(client_id, name, orders, revenue) for client_id, (name, orders, revenue) in clients.items()]
+        return sorted(merged, key=lambda row: row[3], reverse=True)[:n]
+
+    def cash_orders(self, begin: date=None, end: date=None) -> list:
+        """ Return (username, order_id, date, client_id) for the orders paid in cash, by date. """
+
+        merged = [(username,) + row
+                  for username, partial in self.per_user('cash_orders', begin, end).items()
+                  for row in partial]
+        return sorted(merged, key=lambda row: (row[2], row[0]))
+
+    def clear(self):
+        """ Forget the cached results of every database. """
+        for stats in self.stats.values():
+            stats.clear()
+
+    def close(self):
+        for stats in self.stats.values():
+            stats.session.close()
+            if stats.partitions is not None:
+                stats.partitions.engine.dispose()
+        for engine in self.engines.values():
+            engine.dispose()
+
+
+def _engine(filepath: str):
+    return create_engine('sqlite:///file:%s?mode=ro&uri=true' % quote(abspath(filepath)), echo=False)
+
+
+def _is_user_database(filepath: str) -> bool:
+    engine = _engine(filepath)
+    try:
+        return inspect(engine).has_table(Order.__tablename__)
+    finally:
+        engine.dispose()
+
+
+def _partitions(filepath: str) -> Partitions:
+    """ The partitions of a user database, if it has any (c.f. User.partitions). """
+
+    directory = splitext(filepath)[0]
+    if isdir(directory):
+        # Reads don't depend on the period: it's in the name of each file
+        return Partitions(filepath, directory, read_only=True)
@@ -1,11 +1,15 @@
 """ Small scripts using the m5 module API. """
 
 from m5.user import User
-from m5.factory import Miner, Factory
 from datetime import date, timedelta
+from os.path import dirname, join
+
+# Each script imports the departments it needs, so
+# that the light ones don't pay for the heavy ones.
 
 
 def bulk_download():
+    from m5.factory import Miner
 
     u = User('m-134', 'PASSWORD')
     m = Miner(u.remote_session, u.username)
@@ -14,25 +18,80 @@ def bulk_download():
     end = date(2014, 12, 24)
     delta = end - start
 
-    soups = list()
+    # The files are cached on disk as we go: there's
+    # no need to keep the soups around in memory.
+    jobs = 0
     for n in range(delta.days):
         day = start + timedelta(days=n)
-        soup = m.mine(day)
-        soups.append(soup)
+        for _ in m.stream(day):
+            jobs += 1
 
-    return soups
+    return jobs
 
 
 def bulk_migrate():
+    from m5.factory import Factory
+    from m5.cache import ScrapeCache
 
     u = User('m-134', 'PASSWORD')
-    factory = Factory(u)
+    factory = Factory(u, scrape_cache=ScrapeCache(join(u.downloads, '.scraped.sqlite')))
 
     start = date(2013, 3, 1)
     stop = date(2014, 12, 24)
 
     factory.migrate(start, stop)
-    
+
+
+def parallel_migrate():
+    from m5.orchestrator import Orchestrator, Migration
+
+    start = date(2013, 3, 1)
+    stop = date(2014, 12, 24)
+
+    migrations = [Migration('m-134', 'PASSWORD', start, stop),
+                  Migration('m-135', 'PASSWORD', start, stop)]
+
+    o = Orchestrator(migrations, geocache=join(dirname(__file__), '../db/geocode.sqlite'))
+    o.run()
+
+
+def backfill():
+    from m5.orchestrator import Backfill
+
+    u = User('m-134', 'PASSWORD')
+    b = Backfill(u, geocache=join(dirname(__file__), '../db/geocode.sqlite'))
+
+    b.run(date(2013, 3, 1), date(2014, 12, 24))
+
+
+def compact_downloads():
+    from m5.archive import Archive
+
+    u = User('m-134', 'PASSWORD', local=True)
+    a = Archive(u.downloads)
+
+    return a.compact()
+
+
+def export_snapshot():
+    from m5.snapshot import Snapshot
+
+    u = User('m-134', 'PASSWORD', local=True)
+    s = Snapshot(u.database_session, join(u.m5_path, '../snapshots', u.username), partitions=u.partitions)
+
+    s.export()
+
+
+def shop_report():
+    from m5.federation import FederatedStats
+
+    f = FederatedStats.from_directory(join(dirname(__file__), '../db'))
+
+    for month, orders, revenue in f.monthly_totals():
+        print(month, orders, round(revenue, 2))
+
+    f.close()
+
 
 if __name__ == '__main__':
     bulk_migrate()
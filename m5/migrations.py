@@ -0,0 +1,124 @@
+"""
+Schema upgrades for existing user databases.
+
+create_all() only creates missing tables, it never touches existing ones.
+When the model grows a column, old databases are brought up to date here.
+Data migrations are numbered: SQLite's user_version pragma records the last
+one applied, so each of them runs exactly once per database.
+"""
+
+from sqlalchemy import inspect, text, select, bindparam
+from sqlalchemy.engine import Engine, Connection
+
+from m5.model import Base, Checkin, Checkpoint, Leg
+from m5.utilities import notify, MAX_STOPS
+
+
+def upgrade(engine: Engine):
+    """ Add the missing columns and indexes, then apply the pending data migrations. """
+
+    inspector = inspect(engine)
+
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    connection.execute(text('ALTER TABLE "{table}" ADD COLUMN "{column}" {type}'
+                                            .format(table=table.name, column=column.name, type=column_type)))
+                    notify('Upgraded database: added {}.{}.', table.name, column.name)
+
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+
+        version = connection.execute(text('PRAGMA user_version')).scalar()
+
+        for number, migration in enumerate(_MIGRATIONS[version:], start=version + 1):
+            migration(connection)
+            connection.execute(text('PRAGMA user_version = %d' % number))
+            notify('Upgraded database: applied migration {} ({}).', number, migration.__name__)
+
+
+def rekey_checkins(connection: Connection):
+    """
+    Checkin keys used to be the hash of the checkin time, which collides for
+    two stops in the same minute. Replace them with the stable scheme of the
+    Packager: order_id * MAX_STOPS + the rank of the checkin inside its order.
+    Both rank the same checkins, by time: the ones that can be stored, i.e.
+    those in the database. Legs refer to checkins, so they are re-pointed to
+    the new keys. Beyond MAX_STOPS stops, an order's checkins are dropped,
+    as the Packager does.
+    """
+
+    checkin = Checkin.__table__
+    leg = Leg.__table__
+
+    rows = connection.execute(select(checkin)
+                              .order_by(checkin.c.order_id, checkin.c.timestamp, checkin.c.checkin_id))\
+        .mappings().all()
+
+    if not rows:
+        return
+
+    keys = dict()
+    rekeyed = list()
+    sequence = 0
+
+    for n, row in enumerate(rows):
+        if n and row['order_id'] == rows[n - 1]['order_id']:
+            sequence += 1
+        else:
+            sequence = 0
+
+        if sequence >= MAX_STOPS:
+            notify('Dropped checkin {} of order {}: the keys hold {} stops per order.',
+                   row['checkin_id'], row['order_id'], MAX_STOPS)
+            continue
+
+        keys[row['checkin_id']] = row['order_id'] * MAX_STOPS + sequence
+        rekeyed.append(dict(row, checkin_id=keys[row['checkin_id']]))
+
+    # Old and new keys may overlap, so
+    # rewrite the table rather than update it.
+    connection.execute(checkin.delete())
+    connection.execute(checkin.insert(), rekeyed)
+
+    legs = connection.execute(select(leg.c.leg_id, leg.c.departure_id, leg.c.arrival_id)).all()
+    if legs:
+        connection.execute(leg.update()
+                           .where(leg.c.leg_id == bindparam('old_leg'))
+                           .values(departure_id=bindparam('new_departure'), arrival_id=bindparam('new_arrival')),
+                           [{'old_leg': leg_id, 'new_departure': keys.get(departure), 'new_arrival': keys.get(arrival)}
+                            for leg_id, departure, arrival in legs])
+
+
+def fill_geohashes(connection: Connection):
+    """
+    The geohash column is added empty to existing databases: the
+    Packager only computes it for new checkpoints. Fill in the rest.
+    """
+
+    # The spatial module loads numpy: only pay for it when the migration runs
+    from m5.spatial import geohash
+
+    checkpoint = Checkpoint.__table__
+
+    rows = connection.execute(select(checkpoint.c.checkpoint_id, checkpoint.c.lat, checkpoint.c.lon)
+                              .where(checkpoint.c.geohash.is_(None))).all()
+
+    if rows:
+        connection.execute(checkpoint.update()
+                           .where(checkpoint.c.checkpoint_id == bindparam('old_id'))
+                           .values(geohash=bindparam('new_geohash')),
+                           [{'old_id': checkpoint_id, 'new_geohash': geohash(lat, lon)}
+                            for checkpoint_id, lat, lon in rows])
+
+
+# In order: never remove or reorder them.
+_MIGRATIONS = [rekey_checkins, fill_geohashes]
@@ -14,6 +14,9 @@ Base = declarative_base()
 #           ^      ^
 #           |      |
 #           Check-ins
+#               ^
+#               |
+#             Legs (derived)
 #
 #              One
 #               ^
@@ -125,6 +128,7 @@ class Checkpoint(Base):
     postal_code = Column(Integer)
     street = Column(String)
     company = Column(String)
+    geohash = Column(String, index=True)
 
     @synonym_for('checkpoint_id')
     @property
@@ -141,4 +145,37 @@ class Checkpoint(Base):
 
     def __repr__(self):
         """ Return something easy to read. """
-        return self.__str__()
\ No newline at end of file
+        return self.__str__()
+
+
+class Leg(Base):
+    __tablename__ = 'leg'
+
+    leg_id = Column(Integer, primary_key=True)
+    date = Column(DateTime, nullable=False, index=True)
+    sequence = Column(Integer, nullable=False)
+    departure_id = Column(Integer, ForeignKey('checkin.checkin_id'), nullable=False)
+    arrival_id = Column(Integer, ForeignKey('checkin.checkin_id'), nullable=False)
+    departure = Column(DateTime)
+    arrival = Column(DateTime)
+    distance = Column(Float)
+    duration = Column(Float)
+    idle = Column(Float)
+    speed = Column(Float)
+
+    @synonym_for('leg_id')
+    @property
+    def id(self):
+        return self.leg_id
+
+    def __str__(self):
+        """ Return something easy to read. """
+        strings = list()
+        keys = [k for k in self.__dict__.keys() if k[0] is not '_']
+        for key in keys:
+            strings.append('{key}={value}'.format(key=key, value=self.__dict__[key]))
+        return '<' + self.__class__.__name__ + ' (' + ', '.join(strings) + ')>'
+
+    def __repr__(self):
+        """ Return something easy to read. """
+        return self.__str__()
@@ -0,0 +1,322 @@
+"""
+The orchestrator module: migrate several couriers at once, or one courier faster.
+
+Each user is migrated in its own process, with its own remote session, database
+and downloads folder. All processes share a single rate limit toward the server
+and a single geocode cache. They report each day they finish to the parent, which
+aggregates the progress and the metrics of the whole run.
+
+A backfill splits one user's date range into shards instead. The workers mine,
+scrape and package their shards independently, but only the parent process writes
+to the database: SQLite never sees two writers at once. The same goes for the index
+of the downloads: the workers hand theirs back, and the parent merges them.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from multiprocessing import Queue, Value
+from queue import Empty
+from time import sleep, time
+
+from m5.utilities import notify, Tables
+from m5.user import User
+from m5.cache import GeocodeCache
+
+
+# Requests per second toward the server, all users together
+RATE = 2
+
+# Days per shard in a backfill
+SHARD = 7
+
+Migration = namedtuple('Migration', ['username', 'password', 'begin', 'end'])
+Shard = namedtuple('Shard', ['begin', 'end'])
+
+
+def shards(begin: date, end: date, size: int=SHARD) -> list:
+    """ Split [begin, end) into consecutive shards of at most size days. """
+
+    assert size > 0, 'Shards need at least one day'
+
+    return [Shard(begin + timedelta(days=n), min(begin + timedelta(days=n + size), end))
+            for n in range(0, (end - begin).days, size)]
+
+
+class RateLimiter():
+    """ Spaces out calls evenly, across all the processes that inherit the limiter. """
+
+    def __init__(self, rate: float=RATE):
+        self.interval = 1 / rate
+        self._next = Value('d', 0.0)
+
+    def __call__(self):
+        """ Wait for the next free slot. """
+
+        with self._next.get_lock():
+            now = time()
+            slot = max(now, self._next.value)
+            self._next.value = slot + self.interval
+
+        if slot > now:
+            sleep(slot - now)
+
+
+class Progress():
+    """ The aggregated progress and metrics of all the migrations. """
+
+    def __init__(self, migrations: list):
+        self.start = time()
+        self.users = {m.username: {'days': 0,
+                                   'total': (m.end - m.begin).days,
+                                   'jobs': 0,
+                                   'seconds': 0.0,
+                                   'error': None}
+                      for m in migrations}
+
+    def update(self, event: tuple):
+        """ Events are ('day', username, jobs, seconds) or ('error', username, message). """
+
+        kind, username = event[:2]
+        user = self.users[username]
+
+        if kind == 'day':
+            user['days'] += 1
+            user['jobs'] += event[2]
+            user['seconds'] += event[3]
+        elif kind == 'error':
+            user['error'] = event[2]
+
+    @property
+    def days(self) -> int:
+        return sum(user['days'] for user in self.users.values())
+
+    @property
+    def total(self) -> int:
+        return sum(user['total'] for user in self.users.values())
+
+    @property
+    def jobs(self) -> int:
+        return sum(user['jobs'] for user in self.users.values())
+
+    def report(self) -> str:
+        """ One line for the whole run, then one line per user. """
+
+        elapsed = time() - self.start
+        lines = ['{days}/{total} days, {jobs} jobs in {elapsed:.0f}s ({rate:.1f} jobs/s)'
+                 .format(days=self.days, total=self.total, jobs=self.jobs,
+                         elapsed=elapsed, rate=self.jobs / elapsed if elapsed else 0)]
+
+        for username, user in sorted(self.users.items()):
+            status = 'FAILED: ' + user['error'] if user['error'] else \
+                '{seconds:.1f}s per day'.format(seconds=user['seconds'] / user['days'] if user['days'] else 0)
+            lines.append('  {username}: {days}/{total} days, {jobs} jobs, {status}'
+                         .format(username=username, status=status, **user))
+
+        return '\n'.join(lines)
+
+
+class Orchestrator():
+    """ Run the migrations of several users in parallel. """
+
+    def __init__(self, migrations: list, processes: int=None, rate: float=RATE, geocache: str=None):
+        """
+        :param migrations: a list of Migration(username, password, begin, end)
+        :param processes: the number of worker processes (default: one per user)
+        :param rate: the maximum number of requests per second, all users together
+        :param geocache: the SQLite file of the shared geocode cache (optional)
+        """
+
+        usernames = [m.username for m in migrations]
+        assert len(set(usernames)) == len(usernames), 'One migration per user'
+        assert all(isinstance(m.begin, date) and isinstance(m.end, date) for m in migrations), 'Dates please'
+
+        self.migrations = migrations
+        self.processes = processes or len(migrations)
+        self.rate = rate
+        self.geocache = geocache
+
+        self.progress = Progress(migrations)
+
+    def run(self, interval: float=10) -> Progress:
+        """
+        Migrate everybody and print the aggregated progress as we go.
+
+        :param interval: seconds between two progress reports
+        """
+
+        events = Queue()
+        limiter = RateLimiter(self.rate)
+
+        with ProcessPoolExecutor(max_workers=self.processes,
+                                 initializer=_initialise,
+                                 initargs=(limiter, self.geocache, events)) as pool:
+
+            futures = {pool.submit(_migrate, migration): migration for migration in self.migrations}
+            reported = time()
+
+            while not all(future.done() for future in futures):
+                self._collect(events, timeout=0.5)
+
+                if time() - reported > interval:
+                    notify(self.progress.report())
+                    reported = time()
+
+            for future, migration in futures.items():
+                if future.exception():
+                    self.progress.update(('error', migration.username, repr(future.exception())))
+
+        self._collect(events)
+        notify(self.progress.report())
+
+        return self.progress
+
+    def _collect(self, events: Queue, timeout: float=0):
+        """ Fold the pending events into the progress. """
+
+        try:
+            self.progress.update(events.get(timeout=timeout))
+            while True:
+                self.progress.update(events.get_nowait())
+        except Empty:
+            pass
+
+
+class Backfill():
+    """ Migrate one user's long date range with a pool of workers and a single writer. """
+
+    def __init__(self, user: User,
+                 processes: int=None,
+                 size: int=SHARD,
+                 rate: float=RATE,
+                 geocache: str=None,
+                 overwrite: bool=None):
+        """
+        :param user: the user, whose database only this process writes to
+        :param processes: the number of worker processes (default: one per core)
+        :param size: the number of days per shard
+        :param rate: the maximum number of requests per second, all workers together
+        :param geocache: the SQLite file of the shared geocode cache (optional)
+        :param overwrite: download the pages again, even if they are cached
+        """
+
+        from m5.factory import Pusher
+        from m5.routes import Router
+
+        self.user = user
+        self.processes = processes
+        self.size = size
+        self.rate = rate
+        self.geocache = geocache
+        self.overwrite = overwrite
+
+        self.pusher = Pusher(user.database_session, partitions=user.partitions)
+        self.router = Router(user.database_session, partitions=user.partitions)
+
+    def run(self, begin: date, end: date) -> Progress:
+        """ Migrate [begin, end), one shard per task, and write the shards as they come back. """
+
+        assert isinstance(begin, date), 'Argument 1 must be a date object'
+        assert isinstance(end, date), 'Argument 2 must be a date object'
+
+        migration = Migration(self.user.username, self.user._password, begin, end)
+        progress = Progress([migration])
+
+        limiter = RateLimiter(self.rate)
+        tasks = [(migration, shard, self.overwrite, self.user.downloads) for shard in shards(begin, end, self.size)]
+
+        from m5.factory import Miner
+        miner = Miner(None, self.user.downloads)
+
+        with ProcessPoolExecutor(max_workers=self.processes,
+                                 initializer=_initialise,
+                                 initargs=(limiter, self.geocache, None)) as pool:
+
+            for shard, jobs, tables, index in pool.map(_package_shard, tasks):
+                # The single writer, of the database and of the download index
+                if any(tables):
+                    self.pusher.insert(tables)
+                    self.router.update(shard.begin, shard.end - timedelta(days=1))
+                if index:
+                    miner.merge_index(index)
+
+                for n, seconds in jobs:
+                    progress.update(('day', migration.username, n, seconds))
+
+                notify('Backfilled {} to {}: {} jobs.', str(shard.begin), str(shard.end), sum(n for n, _ in jobs))
+
+        notify(progress.report())
+
+        return progress
+
+
+# The state each worker process inherits
+_worker = dict()
+
+
+def _initialise(limiter: RateLimiter, geocache: str, events: Queue):
+    _worker.update(limiter=limiter, geocache=geocache, events=events)
+
+
+def _migrate(migration: Migration) -> str:
+    """ Migrate one user, inside a worker process. """
+
+    from m5.factory import Factory
+
+    events = _worker['events']
+    geocache = GeocodeCache(_worker['geocache']) if _worker['geocache'] else None
+
+    user = User(migration.username, migration.password, transport={'throttle': _worker['limiter']})
+    factory = Factory(user, geocache=geocache)
+
+    clock = [time()]
+
+    def progress(day: date, jobs: int):
+        now = time()
+        events.put(('day', migration.username, jobs, now - clock[0]))
+        clock[0] = now
+
+    factory.migrate(migration.begin, migration.end, progress=progress)
+    user.remote_session.close()
+
+    return migration.username
+
+
+def _package_shard(task: tuple) -> tuple:
+    """
+    Mine, scrape and package one shard, inside a worker process. The worker only
+    goes online: it never opens the user's database, which only the parent writes.
+
+    :return: the shard, a list of (jobs, seconds) per day, the packaged rows
+             and the download index, which only the parent writes
+    """
+
+    from m5.factory import Miner, Scraper, Packager
+
+    migration, shard, overwrite, downloads = task
+    geocache = GeocodeCache(_worker['geocache']) if _worker['geocache'] else None
+
+    user = User(migration.username, migration.password, transport={'throttle': _worker['limiter']}, database=False)
+
+    miner = Miner(user.remote_session, downloads, overwrite=overwrite, write_index=False)
+    scraper = Scraper()
+    packager = Packager(geocache=geocache)
+
+    tables = Tables([], [], [], [])
+    jobs = list()
+
+    for n in range((shard.end - shard.begin).days):
+        start = time()
+        day = shard.begin + timedelta(days=n)
+
+        count = 0
+        for job in packager.rows(scraper.stream(miner.stream(day))):
+            for rows, table in zip(tables, job):
+                rows.extend(table)
+            count += 1
+
+        jobs.append((count, time() - start))
+
+    user.remote_session.close()
+
+    return shard, jobs, tables, miner.index
@@ -0,0 +1,46 @@
+"""
+Fast parsers for the raw strings scraped off the job pages.
+
+There are only 1440 possible 'HH:MM' strings and a few hundred distinct prices,
+so each distinct value is parsed once and served from a cache afterwards.
+"""
+
+from datetime import date, datetime, time
+from functools import lru_cache
+
+
+@lru_cache(maxsize=2048)
+def clock(raw_time: str) -> time:
+    """ Parse 'HH:MM' into a time object. Empty and None return None. """
+
+    if raw_time in (None, ''):
+        return None
+
+    hours, colon, minutes = raw_time.partition(':')
+    if not colon:
+        raise ValueError('Not a HH:MM time: %r' % raw_time)
+
+    return time(int(hours), int(minutes))
+
+
+def timestamp(day: date, raw_time: str) -> datetime:
+    """ Combine a day and a 'HH:MM' string into a datetime. Empty and None return None. """
+
+    t = clock(raw_time)
+    if t is None:
+        return None
+    return datetime(day.year, day.month, day.day, t.hour, t.minute)
+
+
+@lru_cache(maxsize=4096)
+def decimal(raw_number: str) -> float:
+    """ Parse a German decimal number ('11,20') into a float. Empty and None return None. """
+
+    if raw_number in (None, ''):
+        return None
+    return float(raw_number.replace(',', '.'))
+
+
+def decimals(raw_numbers) -> list:
+    """ Parse a batch of German decimal numbers. """
+    return list(map(decimal, raw_numbers))
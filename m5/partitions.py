@@ -0,0 +1,287 @@
+"""
+The partitions module: keep a user's orders and checkins in one database file per year
+(or per quarter), next to the main database that holds everything else.
+
+    db/<username>.sqlite             clients, checkpoints, legs
+    db/<username>/<2014>.sqlite      the orders and checkins of 2014
+    db/<username>/<2014q3>.sqlite    ... or of the third quarter of 2014
+
+Writes are routed to the partition of each row's date. The main database and up to
+MAX_ATTACHED - 1 partitions commit in one transaction: a write that spans more
+partitions than that commits in several, one per chunk of partitions. Rows are
+inserted or replaced, so a failed write can simply be repeated. The rows of a user
+who switched to partitions stay in the main tables until they are pushed again:
+then they move to their partition, and out of the main tables.
+
+Reads open a connection on the main database and attach only the partitions
+that overlap the date range of the query. The attached tables are put behind TEMP
+views named "order" and "checkin": SQLite looks up TEMP first, so the queries of the
+Stats and the Router run unchanged. SQLite attaches a limited number of files to a
+connection, so the Stats and the Router read a long history one chunk of partitions
+at a time and merge the results (c.f. sessions).
+
+Past partitions can be sealed: they are vacuumed, made read-only, then attached read-
+only and memory-mapped. A sealed partition refuses writes until it's unsealed.
+"""
+
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime
+from os import chmod, listdir, makedirs, stat
+from os.path import abspath, isdir, isfile, join
+from stat import S_IWUSR
+from urllib.parse import quote
+
+from sqlalchemy import bindparam, create_engine
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm.session import Session as DatabaseSession
+from sqlalchemy.pool import NullPool
+
+from m5.model import Base, Checkin, Order
+
+
+PERIODS = ('year', 'quarter')
+
+# The partitioned tables, and the column that decides the partition of a row
+PARTITIONED = {Order.__table__.name: 'date', Checkin.__table__.name: 'timestamp'}
+
+# SQLite's default limit on attached databases (SQLITE_MAX_ATTACHED)
+MAX_ATTACHED = 10
+
+# How much of a sealed partition is memory-mapped, in bytes
+MMAP_SIZE = 2 ** 28
+
+_EXTENSION = '.sqlite'
+
+
+class SealedPartition(Exception):
+    """ Rows were written to a partition that has been sealed. """
+
+
+class Partitions():
+    """ The partitions of a user's orders and checkins, and the routing to them. """
+
+    def __init__(self, database: str, directory: str, period: str='year', mmap_size: int=MMAP_SIZE,
+                 read_only: bool=False):
+        """
+        :param database: the filepath of the main database
+        :param directory: where the partition files go
+        :param period: 'year' or 'quarter'
+        :param mmap_size: memory-map that many bytes of each sealed partition (0 for none)
+        :param read_only: open every file read-only (the TEMP views never touch the files)
+        """
+
+        assert period in PERIODS, 'Period must be one of %s' % ', '.join(PERIODS)
+
+        self.database = database
+        self.directory = directory
+        self.period = period
+        self.mmap_size = mmap_size
+        self.read_only = read_only
+
+        if not read_only and not isdir(directory):
+            makedirs(directory)
+
+        # A fresh connection for each scope: the attachments go away with it
+        self.engine = create_engine('sqlite:///file:%s?%suri=true' % (quote(abspath(database)),
+                                                                     'mode=ro&' if read_only else ''),
+                                    poolclass=NullPool, echo=False)
+
+    def key(self, day: date) -> str:
+        """ The partition of a day: '2014' or '2014q3'. """
+
+        if self.period == 'year':
+            return '%d' % day.year
+        return '%dq%d' % (day.year, (day.month - 1) // 3 + 1)
+
+    def span(self, key: str) -> tuple:
+        """ The first day of a partition, and the first day after it. """
+
+        year, _, quarter = key.partition('q')
+        if not quarter:
+            return date(int(year), 1, 1), date(int(year) + 1, 1, 1)
+
+        month = 3 * (int(quarter) - 1) + 1
+        after = date(int(year) + 1, 1, 1) if month == 10 else date(int(year), month + 3, 1)
+        return date(int(year), month, 1), after
+
+    def keys(self, begin: date=None, end: date=None) -> list:
+        """ The existing partitions that overlap [begin, end] (both included), in order. """
+
+        keys = sorted(filename[:-len(_EXTENSION)] for filename in listdir(self.directory)
+                      if filename.endswith(_EXTENSION))
+
+        if begin is not None:
+            keys = [key for key in keys if self.span(key)[1] > _day(begin)]
+        if end is not None:
+            keys = [key for key in keys if self.span(key)[0] <= _day(end)]
+
+        return keys
+
+    def filepath(self, key: str) -> str:
+        return join(self.directory, key + _EXTENSION)
+
+    def create(self, key: str):
+        """ Create the partition's file and tables, if they don't exist yet. """
+
+        if isfile(self.filepath(key)):
+            return
+
+        engine = create_engine('sqlite:///%s' % self.filepath(key), echo=False)
+        Base.metadata.create_all(engine, tables=[Base.metadata.tables[name] for name in PARTITIONED])
+        engine.dispose()
+
+    def is_sealed(self, key: str) -> bool:
+        return not stat(self.filepath(key)).st_mode & S_IWUSR
+
+    def seal(self, key: str):
+        """ Compact a partition and make it read-only. """
+
+        assert not self.is_sealed(key), 'Partition %s is already sealed' % key
+
+        engine = create_engine('sqlite:///%s' % self.filepath(key), echo=False)
+        with engine.connect() as connection:
+            connection.exec_driver_sql('VACUUM')
+        engine.dispose()
+
+        chmod(self.filepath(key), 0o444)
+
+    def unseal(self, key: str):
+        chmod(self.filepath(key), 0o644)
+
+    @contextmanager
+    def session(self, begin: date=None, end: date=None) -> DatabaseSession:
+        """
+        A read session that sees the orders and checkins of the
+        partitions overlapping [begin, end] (both included).
+        """
+
+        keys = self.keys(begin, end)
+        assert len(keys) < MAX_ATTACHED, 'Too many partitions to attach at once: read them with sessions()'
+
+        with self._session(keys) as session:
+            yield session
+
+    def sessions(self, begin: date=None, end: date=None):
+        """
+        Generate read sessions over [begin, end], one per chunk of partitions
+        that SQLite attaches at once. Only the first one sees the rows left in
+        the main tables, so the results of all of them add up to the whole.
+        """
+
+        for n, chunk in enumerate(_chunks(self.keys(begin, end))):
+            with self._session(chunk, main=n == 0) as session:
+                yield session
+
+    def write(self, values: dict):
+        """
+        Insert or replace rows, each partitioned row into the partition of its date.
+
+        :param values: table -> a list of rows as dictionaries
+        """
+
+        assert not self.read_only, 'These partitions were opened read-only'
+
+        routed = defaultdict(list)
+        for table, rows in values.items():
+            column = PARTITIONED.get(table.name)
+            for row in rows:
+                key = self.key(row[column]) if column and row[column] is not None else None
+                routed[key, table].append(row)
+
+        keys = sorted({key for key, _ in routed if key is not None})
+
+        for key in keys:
+            self.create(key)
+            if self.is_sealed(key):
+                raise SealedPartition('Partition %s is sealed: unseal it first' % key)
+
+        # The main database and the attached partitions commit together,
+        # one transaction per chunk of partitions (c.f. the module docstring)
+        for n, chunk in enumerate(_chunks(keys)):
+            with self.engine.begin() as connection:
+                self._attach(connection, chunk, writable=True)
+
+                # A row moves to its partition: the copy left in the main
+                # table from before the partitioning would be counted twice.
+                for (key, table), rows in routed.items():
+                    if key in chunk:
+                        primary_key = table.primary_key.columns.values()[0]
+                        connection.execute(table.delete().where(primary_key == bindparam('key')),
+                                           [{'key': row[primary_key.name]} for row in rows])
+
+                # The main database's rows go in with the first chunk
+                for (key, table), rows in sorted(routed.items(), key=lambda item: (item[0][0] or '', item[0][1].name)):
+                    if key in chunk or (key is None and n == 0):
+                        connection.execute(table.insert().prefix_with('OR REPLACE'), rows,
+                                           execution_options={'schema_translate_map': {None: _alias(key)}
+                                                              if key else None})
+
+    @contextmanager
+    def _session(self, keys: list, main: bool=True) -> DatabaseSession:
+        """ A read session with the partitions attached, behind the TEMP views. """
+
+        with self.engine.connect() as connection:
+            self._attach(connection, keys)
+            for name in PARTITIONED:
+                self._view(connection, name, keys, main=main)
+
+            session = DatabaseSession(bind=connection)
+            try:
+                yield session
+            finally:
+                session.close()
+
+    def _attach(self, connection: Connection, keys: list, writable: bool=False):
+        for key in keys:
+            sealed = self.is_sealed(key)
+            mode = 'ro' if sealed else 'rw' if writable else 'ro'
+
+            connection.exec_driver_sql('ATTACH DATABASE ? AS "%s"' % _alias(key),
+                                       ('file:%s?mode=%s' % (quote(abspath(self.filepath(key))), mode),))
+
+            if sealed and self.mmap_size:
+                connection.exec_driver_sql('PRAGMA "%s".mmap_size = %d' % (_alias(key), self.mmap_size))
+
+    @staticmethod
+    def _view(connection: Connection, name: str, keys: list, main: bool=True):
+        """ A TEMP view over the main table (unless main is False) and the attached partitions. """
+
+        schemas = (['main'] if main else []) + list(map(_alias, keys))
+        columns = ', '.join('"%s"' % column.name for column in Base.metadata.tables[name].columns)
+        selects = ['SELECT %s FROM "%s"."%s"' % (columns, schema, name) for schema in schemas]
+
+        connection.exec_driver_sql('CREATE TEMP VIEW "%s" AS %s' % (name, ' UNION ALL '.join(selects)))
+
+
+@contextmanager
+def scope(database_session: DatabaseSession, partitions: Partitions, begin: date=None, end: date=None):
+    """ The user's session, or a session on the partitions of the date range (c.f. User.partitions). """
+
+    if partitions is None:
+        yield database_session
+    else:
+        with partitions.session(begin, end) as session:
+            yield session
+
+
+def scopes(database_session: DatabaseSession, partitions: Partitions, begin: date=None, end: date=None):
+    """ Same as scope(), but one session per chunk of partitions (c.f. Partitions.sessions). """
+
+    if partitions is None:
+        yield database_session
+    else:
+        yield from partitions.sessions(begin, end)
+
+
+def _alias(key: str) -> str:
+    return 'p' + key
+
+
+def _chunks(keys: list) -> list:
+    """ The keys in chunks that can be attached next to the main database, at least one chunk. """
+    return [keys[n:n + MAX_ATTACHED - 1] for n in range(0, len(keys), MAX_ATTACHED - 1)] or [[]]
+
+
+def _day(day) -> date:
+    return day.date() if isinstance(day, datetime) else day
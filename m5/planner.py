@@ -0,0 +1,99 @@
+"""
+The planner module: plan a crawl before downloading anything.
+
+Instead of fetching each day's summary just before its jobs, the planner fetches
+the summaries of the whole date range at once, with a pool of threads. Days gone
+by without any jobs are recorded, so that weekends are never asked for again. The
+result is a single work list of jobs, which the download threads then go through
+at full speed. The Miner serves the downloaded pages from its cache afterwards.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from m5.factory import Miner
+from m5.utilities import notify, Stamp
+
+
+# Concurrent requests toward the server (c.f. transport.POOL_SIZE)
+WORKERS = 8
+
+
+class CrawlPlanner():
+    """ Fetch the summaries of a date range up front and download the jobs in parallel. """
+
+    def __init__(self, miner: Miner, workers: int=WORKERS):
+        """
+        :param miner: the Miner that owns the download cache
+        :param workers: the number of threads fetching pages at once
+        """
+
+        self.miner = miner
+        self.workers = workers
+
+        self.empty = 0
+        self.downloaded = 0
+
+    def plan(self, begin: date, end: date) -> list:
+        """
+        Fetch the summaries from begin to end (excluded), except the days known to be empty.
+
+        :return: a sorted list of Stamp(date, uuid) without duplicates
+        """
+
+        assert isinstance(begin, date), 'Argument 1 must be a date object'
+        assert isinstance(end, date), 'Argument 2 must be a date object'
+
+        days = [begin + timedelta(days=n) for n in range((end - begin).days)]
+        todo = [day for day in days if not self.miner.is_empty(day)]
+        self.empty = len(days) - len(todo)
+
+        if not todo:
+            return list()
+
+        # The first request logs in if needed, the others can then go in parallel
+        summaries = [self.miner.summary(todo[0])]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            summaries.extend(pool.map(self.miner.summary, todo[1:]))
+
+        work = set()
+        for day, (uuids, digest) in zip(todo, summaries):
+            self.miner.record(day, uuids, digest)
+            work.update(Stamp(day, uuid) for uuid in uuids)
+
+        self.miner.save_index()
+
+        notify('Planned {} jobs over {} days ({} days known to be empty).', len(work), len(days), self.empty)
+
+        return sorted(work)
+
+    def download(self, work: list) -> int:
+        """
+        Download the jobs of a work list that aren't cached yet (or may have changed).
+
+        :return: the number of pages saved
+        """
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            self.downloaded = sum(pool.map(self.miner.fetch, work))
+
+        self.miner.save_index()
+
+        notify('Downloaded {} of {} planned jobs.', self.downloaded, len(work))
+
+        limiter = getattr(self.miner.remote_session, 'limiter', None)
+        if limiter is not None:
+            notify('Concurrency: {limit:.1f} requests in flight, {errors} errors, '
+                   '{increases} increases, {slowdowns} slowdowns, {backoffs} backoffs.', **limiter.metrics())
+
+        return self.downloaded
+
+    @staticmethod
+    def days(work: list) -> OrderedDict:
+        """ The work list as day -> list of uuids, in order. """
+
+        days = OrderedDict()
+        for stamp in work:
+            days.setdefault(stamp.date, []).append(stamp.uuid)
+        return days
@@ -0,0 +1,279 @@
+"""
+The profiling module: see where a migration spends its time and its memory.
+
+Profiling is opt-in, stage by stage. Either pass a StageProfiler to the Factory,
+or set the environment variables before a run:
+
+    M5_PROFILE=scraper,pusher    # the stages to profile, or 'all'
+    M5_PROFILE_MEMORY=1          # also trace the memory allocations (slower)
+    M5_PROFILE_DIR=/tmp/m5       # where the results go (default: profiles/<user>)
+
+Each run writes into its own folder, for each profiled stage:
+
+    <stage>.pstats      cProfile statistics (python -m pstats, snakeviz...)
+    <stage>.collapsed   collapsed stacks (flamegraph.pl, speedscope...)
+    <stage>.memory      the peak and the top allocators (with M5_PROFILE_MEMORY)
+
+The stages are nested generators (the Packager pulls from the Scraper, which pulls
+from the Miner), so the profiler keeps a stack of active stages: a stage is paused
+while the stage it pulls from runs, and only its own work is measured. A write-behind
+Pusher writes from its own thread, which cProfile doesn't follow: only the queueing
+is measured then. When nothing is profiled, the Factory has no profiler at all and
+the generators run unwrapped.
+"""
+
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from cProfile import Profile
+from datetime import datetime
+from os import environ, getpid, makedirs
+from os.path import basename, join
+from pstats import Stats
+
+from m5.utilities import notify
+
+
+STAGES = ('miner', 'scraper', 'packager', 'pusher', 'router')
+
+# Memory: the depth of the tracebacks and one call in SAMPLE_EVERY compared before and after
+TRACE_FRAMES = 25
+SAMPLE_EVERY = 20
+TOP_ALLOCATORS = 25
+
+# Collapsed stacks: deeper or thinner paths (in microseconds) are cut
+MAX_DEPTH = 64
+MIN_WEIGHT = 1
+
+
+class StageProfiler():
+    """ cProfile and tracemalloc statistics for some stages of the Factory only. """
+
+    def __init__(self, stages: tuple, directory: str, memory: bool=False):
+        """
+        :param stages: the names of the stages to profile (c.f. STAGES)
+        :param directory: the parent folder of the run folders
+        :param memory: also trace the memory allocations of these stages
+        """
+
+        assert set(stages) <= set(STAGES), 'Stages are %s' % ', '.join(STAGES)
+
+        self.stages = tuple(stages)
+        self.memory = memory
+        self.directory = join(directory, '{:%Y%m%d-%H%M%S}-{}'.format(datetime.now(), getpid()))
+
+        self.profiles = {stage: Profile() for stage in stages}
+        self.calls = Counter()
+
+        # Memory: the peak of each stage, the bytes kept by allocation site
+        # and the code of each stage as filename -> [(first, last, stage)]
+        self.peaks = Counter()
+        self.allocators = defaultdict(Counter)
+        self._regions = defaultdict(list)
+
+        # The active stages, innermost last: [stage, memory at entry]
+        self._stack = list()
+
+        if memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(TRACE_FRAMES)
+
+    @classmethod
+    def from_environment(cls, directory: str):
+        """ A profiler configured by the M5_PROFILE variables, or None if they aren't set. """
+
+        names = environ.get('M5_PROFILE', '').strip()
+        if not names:
+            return None
+
+        stages = STAGES if names == 'all' else tuple(name.strip() for name in names.split(','))
+        memory = environ.get('M5_PROFILE_MEMORY', '') not in ('', '0')
+
+        return cls(stages, environ.get('M5_PROFILE_DIR', directory), memory=memory)
+
+    def bind(self, **departments):
+        """
+        Tell which code belongs to which stage, so that the allocations
+        made deeper down (in requests, bs4, sqlalchemy...) are attributed.
+
+        :param departments: stage -> the object doing the work (the Miner...)
+        """
+
+        if not self.memory:
+            return
+
+        from inspect import getsourcefile, getsourcelines
+
+        for stage, department in departments.items():
+            for cls in type(department).__mro__:
+                if cls is not object:
+                    lines, first = getsourcelines(cls)
+                    self._regions[getsourcefile(cls)].append((first, first + len(lines), stage))
+
+    def iterate(self, stage: str, iterable):
+        """ Generate the items of a stage's generator, profiling only while the stage works. """
+
+        iterator = iter(iterable)
+        while True:
+            with self.stage(stage):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    @contextmanager
+    def stage(self, stage: str):
+        """ Profile the block as the work of a stage, pausing the enclosing stage. """
+
+        self._enter(stage)
+
+        sample = None
+        if self.memory and stage in self.profiles and self.calls[stage] % SAMPLE_EVERY == 0:
+            sample = self._snapshot()
+
+        self.calls[stage] += 1
+
+        try:
+            yield
+        finally:
+            if sample is not None:
+                self._snapshot(before=sample)
+            self._exit()
+
+    def save(self) -> str:
+        """
+        Write the statistics of each profiled stage into the run folder.
+
+        :return: the run folder
+        """
+
+        makedirs(self.directory, exist_ok=True)
+
+        for stage, profile in self.profiles.items():
+            if not self.calls[stage]:
+                continue
+
+            filepath = join(self.directory, stage)
+
+            profile.dump_stats(filepath + '.pstats')
+            with open(filepath + '.collapsed', 'w') as f:
+                f.writelines('%s %d\n' % (';'.join(path), weight)
+                             for path, weight in sorted(collapse(Stats(profile)).items()))
+
+            if self.memory:
+                with open(filepath + '.memory', 'w') as f:
+                    f.write('Peak: {:.1f} KiB over {} calls\n\n'.format(self.peaks[stage] / 1024, self.calls[stage]))
+                    for site, size in self.allocators[stage].most_common(TOP_ALLOCATORS):
+                        f.write('{:>12.1f} KiB  {}\n'.format(size / 1024, site))
+
+        notify('Profiled {} in {}.', ', '.join(self.stages), self.directory)
+
+        return self.directory
+
+    def _enter(self, stage: str):
+        if self._stack:
+            self._pause(self._stack[-1])
+        self._stack.append([stage, 0])
+        self._resume(self._stack[-1])
+
+    def _exit(self):
+        self._pause(self._stack.pop())
+        if self._stack:
+            self._resume(self._stack[-1])
+
+    def _pause(self, frame: list):
+        stage, base = frame
+
+        if stage in self.profiles:
+            self.profiles[stage].disable()
+
+            if self.memory:
+                import tracemalloc
+                self.peaks[stage] = max(self.peaks[stage], tracemalloc.get_traced_memory()[1] - base)
+
+    def _resume(self, frame: list):
+        stage = frame[0]
+
+        if stage in self.profiles:
+            if self.memory:
+                import tracemalloc
+                tracemalloc.reset_peak()
+                frame[1] = tracemalloc.get_traced_memory()[0]
+
+            self.profiles[stage].enable()
+
+    def _snapshot(self, before=None):
+        """
+        Take a snapshot of the memory, outside of the measures of the current stage. With
+        the snapshot taken at its entry, add up the memory kept by the stage's own code.
+        """
+
+        import tracemalloc
+
+        frame = self._stack[-1]
+        self._pause(frame)
+
+        snapshot = tracemalloc.take_snapshot()
+
+        if before is not None:
+            stage = frame[0]
+            for difference in snapshot.compare_to(before, 'traceback'):
+                if difference.size_diff > 0 and self._owner(difference.traceback) == stage:
+                    site = difference.traceback[-1]
+                    self.allocators[stage]['%s:%d' % (site.filename, site.lineno)] += difference.size_diff
+
+        self._resume(frame)
+
+        return snapshot
+
+    def _owner(self, traceback) -> str:
+        """ The innermost stage in a traceback, if any. """
+
+        for frame in reversed(traceback):
+            for first, last, stage in self._regions.get(frame.filename, ()):
+                if first <= frame.lineno < last:
+                    return stage
+        return None
+
+
+def collapse(stats: Stats) -> Counter:
+    """
+    Rebuild the call stacks from cProfile's call graph, in the collapsed format of
+    flame graphs. cProfile only knows the callers of each function, so the time of
+    a function is shared between its callers in proportion to the time of each call.
+
+    :return: tuple of frames -> microseconds spent in the innermost frame
+    """
+
+    callees = defaultdict(dict)
+    for function, (_, _, _, _, callers) in stats.stats.items():
+        for caller, edge in callers.items():
+            callees[caller][function] = edge[3]
+
+    stacks = Counter()
+
+    def walk(function, path, seconds):
+        _, _, own, cumulative, _ = stats.stats[function]
+        share = seconds / cumulative if cumulative else 0
+        path = path + (_label(function),)
+
+        stacks[path] += int(own * share * 1e6)
+
+        if len(path) < MAX_DEPTH:
+            for callee, edge in callees[function].items():
+                if _label(callee) not in path and edge * share * 1e6 >= MIN_WEIGHT:
+                    walk(callee, path, edge * share)
+
+    for function, (_, _, _, cumulative, callers) in stats.stats.items():
+        if not callers:
+            walk(function, (), cumulative)
+
+    return Counter({path: weight for path, weight in stacks.items() if weight >= MIN_WEIGHT})
+
+
+def _label(function: tuple) -> str:
+    filename, lineno, name = function
+    if filename == '~':
+        return name.replace(';', ',')
+    return '{} ({}:{})'.format(name, basename(filename), lineno).replace(';', ',')
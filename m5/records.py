@@ -0,0 +1,67 @@
+"""
+Lightweight record types for the data flowing between the Factory departments.
+
+Scraped jobs and addresses are slotted objects instead of dictionaries. They can
+still be read like dictionaries (record['field']), so the Packager doesn't care
+which one it gets. Packaged rows are named tuples with one field per column:
+they go straight into a Core-level insert, without ORM instances.
+"""
+
+from collections import namedtuple
+
+from m5.model import Checkin, Checkpoint, Client, Order
+
+
+class Record():
+    """ A fixed set of fields stored in slots. Missing fields are None, unknown fields are ignored. """
+
+    __slots__ = ()
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def __getitem__(self, name: str):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.as_tuple() == other.as_tuple()
+
+    def __repr__(self):
+        return '<' + self.__class__.__name__ + ' (' + \
+               ', '.join('{}={!r}'.format(name, getattr(self, name)) for name in self.__slots__) + ')>'
+
+    def as_tuple(self) -> tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Job(Record):
+    """ The details of a job as scraped (raw strings). """
+
+    __slots__ = ('order_id', 'type', 'cash', 'client_id', 'client_name', 'km',
+                 'city_tour', 'extra_stops', 'overnight', 'fax_confirm', 'waiting_time')
+
+
+class Address(Record):
+    """ One address of a job as scraped (raw strings). """
+
+    __slots__ = ('company', 'address', 'city', 'postal_code', 'purpose', 'timestamp', 'after', 'until')
+
+
+def _row_type(table: type):
+    """ A named tuple with one field per column of a table, all defaulting to None. """
+
+    columns = [column.name for column in table.__table__.columns]
+    return namedtuple(table.__name__ + 'Row', columns, defaults=[None] * len(columns))
+
+
+ClientRow = _row_type(Client)
+OrderRow = _row_type(Order)
+CheckpointRow = _row_type(Checkpoint)
+CheckinRow = _row_type(Checkin)
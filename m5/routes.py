@@ -0,0 +1,136 @@
+"""
+The routes module: stitch each day's checkins back into the route that was actually ridden.
+
+The result goes into the derived leg table: one row per stretch between two consecutive
+checkins, with its distance, duration, idle time and speed. Legs are recomputed one day
+at a time, so the table can be kept up to date as new days are pushed.
+"""
+
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy.orm.session import Session as DatabaseSession
+
+from m5.model import Checkin, Checkpoint, Leg
+from m5.partitions import Partitions, scopes
+from m5.spatial import haversine
+from m5.utilities import notify, DEBUG
+
+
+# Anything slower than a relaxed bike ride
+# between two stops is counted as idle time.
+CRUISING_SPEED = 15 / 3.6  # meters per second
+
+
+class Router():
+    """ The Router class computes and stores legs for a range of days. """
+
+    def __init__(self, database_session: DatabaseSession, partitions: Partitions=None):
+        """
+        :param partitions: read the checkins from the partitions of the days routed
+        """
+
+        self.database_session = database_session
+        self.partitions = partitions
+
+    def update(self, begin: date, end: date=None) -> int:
+        """
+        Replace the legs of every day from begin to end (included).
+
+        :return: the number of legs written
+        """
+
+        end = end or begin
+        assert isinstance(begin, date), 'Argument 1 must be a date object'
+        assert isinstance(end, date), 'Argument 2 must be a date object'
+
+        start, stop = self._bounds(begin, end)
+
+        legs = self.route(begin, end)
+
+        self.database_session.query(Leg)\
+            .filter(Leg.date >= start, Leg.date < stop)\
+            .delete(synchronize_session=False)
+
+        if legs:
+            self.database_session.execute(Leg.__table__.insert(), legs)
+
+        self.database_session.commit()
+
+        if DEBUG:
+            notify('Routed {} legs from {} to {}.', len(legs), str(begin), str(end))
+
+        return len(legs)
+
+    def route(self, begin: date, end: date=None) -> list:
+        """
+        Compute the legs of every day from begin to end (included) without storing them.
+
+        :return: a list of leg dictionaries (the columns of the leg table)
+        """
+
+        end = end or begin
+        start, stop = self._bounds(begin, end)
+
+        # A long range of partitions is read one chunk at a time
+        rows = list()
+        for session in scopes(self.database_session, self.partitions, begin, end):
+            rows.extend(session.query(Checkin.checkin_id, Checkin.timestamp,
+                                      Checkpoint.lat, Checkpoint.lon)
+                        .join(Checkpoint, Checkin.checkpoint_id == Checkpoint.checkpoint_id)
+                        .filter(Checkin.timestamp >= start, Checkin.timestamp < stop)
+                        .order_by(Checkin.timestamp, Checkin.checkin_id)
+                        .all())
+
+        rows.sort(key=lambda row: (row[1], row[0]))
+
+        if len(rows) < 2:
+            return list()
+
+        ids = [row[0] for row in rows]
+        timestamps = np.array([row[1] for row in rows], dtype='datetime64[s]')
+        coordinates = np.array([(row[2], row[3]) for row in rows], dtype=np.float64)
+
+        # A leg joins two consecutive checkins
+        # as long as they happen on the same day.
+        days = timestamps.astype('datetime64[D]')
+        same_day = days[1:] == days[:-1]
+
+        distance = haversine(coordinates[:-1, 0], coordinates[:-1, 1],
+                             coordinates[1:, 0], coordinates[1:, 1])
+        duration = (timestamps[1:] - timestamps[:-1]).astype(np.float64)
+        idle = np.maximum(duration - distance / CRUISING_SPEED, 0)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed = np.where(duration > 0, distance / duration * 3.6, np.nan)
+
+        legs = list()
+        for n in np.flatnonzero(same_day):
+            day = datetime.combine(rows[n][1].date(), datetime.min.time())
+
+            # Start counting again every morning.
+            if legs and legs[-1]['date'] == day:
+                sequence = legs[-1]['sequence'] + 1
+            else:
+                sequence = 1
+
+            legs.append({'date': day,
+                         'sequence': sequence,
+                         'departure_id': ids[n],
+                         'arrival_id': ids[n + 1],
+                         'departure': rows[n][1],
+                         'arrival': rows[n + 1][1],
+                         'distance': float(distance[n]),
+                         'duration': float(duration[n]),
+                         'idle': float(idle[n]),
+                         'speed': None if np.isnan(speed[n]) else float(speed[n])})
+
+        return legs
+
+    @staticmethod
+    def _bounds(begin: date, end: date) -> tuple:
+        """ Turn a range of days into a half-open range of datetimes. """
+
+        start = datetime.combine(begin, datetime.min.time())
+        stop = datetime.combine(end + timedelta(days=1), datetime.min.time())
+        return start, stop
@@ -0,0 +1,222 @@
+"""
+The snapshot module: a columnar copy of the local database on disk.
+
+Each table is written as one .npy file per column and one folder per month:
+
+    <directory>/<table>/<YYYY-MM>/<column>.npy
+
+Old months never change, so partitions are written once and never rewritten.
+Reloading uses memory-mapping, i.e. reads are zero-copy and almost free.
+When the user's orders and checkins live in yearly or quarterly database files
+(c.f. the partitions module), each month is read from the file that holds it.
+"""
+
+from os import listdir, makedirs, rename
+from os.path import isdir, join
+from shutil import rmtree
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm.session import Session as DatabaseSession
+
+from m5.model import Checkin, Checkpoint, Client, Order
+from m5.partitions import Partitions, scope
+from m5.utilities import notify, DEBUG
+
+
+# Numpy can't memory-map python objects, so
+# missing values are stored with a sentinel.
+NULL_INT = -1
+NULL_BOOL = -1
+NULL_STR = ''
+
+
+class Snapshot():
+    """ Export the four database tables to monthly columnar partitions and reload them. """
+
+    def __init__(self, database_session: DatabaseSession, directory: str, partitions: Partitions=None):
+        """
+        Instantiate a re-useable Snapshot object.
+
+        :param partitions: read the orders and checkins from there (c.f. User.partitions)
+        """
+
+        self.database_session = database_session
+        self.directory = directory
+        self.partitions = partitions
+
+    def export(self, until: date=None) -> list:
+        """
+        Write every complete month that has not been exported yet. The month
+        of the 'until' date (today by default) is still changing, so it's not
+        included. Existing partitions are left untouched.
+
+        :return: the list of months exported as YYYY-MM strings
+        """
+
+        until = until or date.today()
+        assert isinstance(until, date), 'Argument must be a date object'
+
+        first = self._first_day()
+        if first is None:
+            return list()
+
+        exported = list()
+        month = date(first.year, first.month, 1)
+        stop = date(until.year, until.month, 1)
+
+        while month < stop:
+            if not self._is_exported(month):
+                self._export_month(month)
+                exported.append(self._label(month))
+            month = self._next_month(month)
+
+        return exported
+
+    def months(self, table: type=Order) -> list:
+        """ Return the list of exported months for a table. """
+
+        folder = join(self.directory, table.__tablename__)
+        if not isdir(folder):
+            return list()
+        return sorted(m for m in listdir(folder) if not m.endswith('.tmp'))
+
+    def load(self, table: type, months: list=None) -> dict:
+        """
+        Reopen the snapshot of a table as column name/array pairs. A single
+        month is served as read-only memory-maps (no copy). Several months
+        are concatenated, which means reading them into memory.
+
+        :param table: one of the m5.model classes
+        :param months: a list of YYYY-MM strings (default: all months)
+        """
+
+        months = self.months(table) if months is None else months
+        columns = [column.name for column in table.__table__.columns]
+
+        partitions = list()
+        for month in months:
+            folder = join(self.directory, table.__tablename__, month)
+            partitions.append({column: np.load(join(folder, column + '.npy'), mmap_mode='r')
+                               for column in columns})
+
+        if len(partitions) == 1:
+            return partitions[0]
+        elif not partitions:
+            return {column: np.empty(0) for column in columns}
+        else:
+            return {column: np.concatenate([p[column] for p in partitions])
+                    for column in columns}
+
+    def _export_month(self, month: date):
+        """ Write all four tables for one month. """
+
+        begin = datetime(month.year, month.month, 1)
+        end = datetime.combine(self._next_month(month), datetime.min.time())
+
+        with scope(self.database_session, self.partitions, month, end.date() - timedelta(days=1)) as session:
+            orders = self._query(session, Order, Order.date >= begin, Order.date < end)
+            checkins = self._query(session, Checkin, Checkin.timestamp >= begin, Checkin.timestamp < end)
+
+            # Clients and checkpoints have no date: they go into the
+            # partition of the month in which they are first referenced.
+            client_ids = self._keys(Client, orders['client_id']) - self._exported_ids(Client)
+            checkpoint_ids = self._keys(Checkpoint, checkins['checkpoint_id']) - self._exported_ids(Checkpoint)
+
+            clients = self._query(session, Client, Client.client_id.in_(client_ids))
+            checkpoints = self._query(session, Checkpoint, Checkpoint.checkpoint_id.in_(checkpoint_ids))
+
+        # The dimension tables first: a month is
+        # complete once the orders have been written.
+        self._write(Client, month, clients)
+        self._write(Checkpoint, month, checkpoints)
+        self._write(Checkin, month, checkins)
+        self._write(Order, month, orders)
+
+        if DEBUG:
+            notify('Exported snapshot {} ({} orders, {} checkins).',
+                   self._label(month), len(orders['order_id']), len(checkins['checkin_id']))
+
+    @staticmethod
+    def _query(session: DatabaseSession, table: type, *criteria) -> dict:
+        """ Fetch rows at the Core level and return them as column name/list pairs. """
+
+        columns = list(table.__table__.columns)
+        rows = session.query(*columns).filter(*criteria).all()
+        return {column.name: [row[i] for row in rows] for i, column in enumerate(columns)}
+
+    def _first_day(self) -> datetime:
+        """ The date of the first order. With partitions, only the first of them is read. """
+
+        end = None
+        if self.partitions is not None and self.partitions.keys():
+            end = self.partitions.span(self.partitions.keys()[0])[1] - timedelta(days=1)
+
+        with scope(self.database_session, self.partitions, None, end) as session:
+            return session.query(func.min(Order.date)).scalar()
+
+    def _write(self, table: type, month: date, values: dict):
+        """ Write one partition atomically: first to a temporary folder, then rename. """
+
+        folder = join(self.directory, table.__tablename__, self._label(month))
+        temporary = folder + '.tmp'
+
+        if isdir(temporary):
+            rmtree(temporary)
+        makedirs(temporary)
+
+        for column in table.__table__.columns:
+            array = self._to_array(column.type.python_type, values[column.name])
+            np.save(join(temporary, column.name + '.npy'), array)
+
+        if isdir(folder):
+            rmtree(folder)
+        rename(temporary, folder)
+
+    def _exported_ids(self, table: type) -> set:
+        """ The primary keys already held by earlier partitions. """
+
+        key = table.__table__.primary_key.columns.values()[0].name
+        ids = set()
+        for month in self.months(table):
+            column = np.load(join(self.directory, table.__tablename__, month, key + '.npy'), mmap_mode='r')
+            ids.update(self._keys(table, column.tolist()))
+        return ids
+
+    @staticmethod
+    def _keys(table: type, values: list) -> set:
+        """ Foreign keys don't always have the type of the primary key they refer to. """
+
+        key_type = table.__table__.primary_key.columns.values()[0].type.python_type
+        return {key_type(v) for v in values if v is not None}
+
+    def _is_exported(self, month: date) -> bool:
+        return isdir(join(self.directory, Order.__tablename__, self._label(month)))
+
+    @staticmethod
+    def _to_array(python_type: type, values: list) -> np.ndarray:
+        """ Convert a list of python values into a fixed-width numpy array. """
+
+        if python_type is int:
+            return np.array([NULL_INT if v is None else v for v in values], dtype=np.int64)
+        elif python_type is float:
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        elif python_type is bool:
+            return np.array([NULL_BOOL if v is None else v for v in values], dtype=np.int8)
+        elif python_type is datetime:
+            return np.array([np.datetime64('NaT') if v is None else v for v in values],
+                            dtype='datetime64[m]')
+        else:
+            return np.array([NULL_STR if v is None else str(v) for v in values], dtype=np.str_)
+
+    @staticmethod
+    def _label(month: date) -> str:
+        return month.strftime('%Y-%m')
+
+    @staticmethod
+    def _next_month(month: date) -> date:
+        if month.month == 12:
+            return date(month.year + 1, 1, 1)
+        else:
+            return date(month.year, month.month + 1, 1)
@@ -0,0 +1,258 @@
+"""
+The spatial module: find checkpoints by location without scanning the whole table.
+
+There are two levels. In the database, each checkpoint has an indexed geohash
+column, so a prefix filter narrows a query down to a neighbourhood. In memory,
+the SpatialIndex class buckets checkpoints into a regular grid and answers
+radius, bounding-box and k-nearest queries in well under a millisecond.
+"""
+
+from math import asin, cos, radians, floor, sin
+from operator import itemgetter
+
+import numpy as np
+from sqlalchemy.orm.session import Session as DatabaseSession
+
+from m5.model import Checkpoint
+
+
+EARTH_RADIUS = 6371008.8  # meters
+METERS_PER_DEGREE = 111195.0  # along a meridian
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash(lat: float, lon: float, precision: int=7) -> str:
+    """ Encode a coordinate into a geohash (precision 7 is a cell of about 150 m). """
+
+    if lat is None or lon is None:
+        return None
+
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+
+    characters = list()
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(characters) < precision:
+        # Bits alternate between longitude and latitude.
+        if even:
+            value, interval = float(lon), lon_range
+        else:
+            value, interval = float(lat), lat_range
+
+        middle = (interval[0] + interval[1]) / 2
+        if value >= middle:
+            bits = (bits << 1) | 1
+            interval[0] = middle
+        else:
+            bits <<= 1
+            interval[1] = middle
+
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            characters.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(characters)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """ Great-circle distance in meters. Works on scalars and numpy arrays alike. """
+
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+
+    a = np.sin((lat2 - lat1) / 2) ** 2 + \
+        np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+def neighbourhood(database_session: DatabaseSession, lat: float, lon: float, precision: int=6):
+    """ Query the checkpoints that share a geohash cell with a point (precision 6 is about 1 km). """
+
+    prefix = geohash(lat, lon, precision)
+    return database_session.query(Checkpoint).filter(Checkpoint.geohash.startswith(prefix))
+
+
+class SpatialIndex():
+    """
+    An in-memory grid index over checkpoint coordinates. Points are added
+    one by one, so the index can be kept up to date incrementally with
+    the update() method after each push, instead of being rebuilt.
+    """
+
+    def __init__(self, cell_size: float=500):
+        """
+        :param cell_size: the side of a grid cell in meters (roughly)
+        """
+
+        self.cell_size = cell_size
+        self._degrees = cell_size / METERS_PER_DEGREE
+
+        self._cells = dict()
+        self._points = dict()
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, checkpoint_id):
+        return checkpoint_id in self._points
+
+    def add(self, checkpoint_id, lat: float, lon: float):
+        """ Insert or move one checkpoint. Checkpoints without coordinates are ignored. """
+
+        if lat is None or lon is None:
+            return
+
+        lat, lon = float(lat), float(lon)
+
+        if checkpoint_id in self._points:
+            self.remove(checkpoint_id)
+
+        self._points[checkpoint_id] = (lat, lon)
+        self._cells.setdefault(self._cell(lat, lon), list()).append(checkpoint_id)
+
+    def remove(self, checkpoint_id):
+        """ Drop one checkpoint from the index. """
+
+        lat, lon = self._points.pop(checkpoint_id)
+        cell = self._cell(lat, lon)
+        self._cells[cell].remove(checkpoint_id)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def update(self, database_session: DatabaseSession) -> int:
+        """
+        Index the checkpoints that are in the database but not in the index yet.
+
+        :return: the number of checkpoints added
+        """
+
+        rows = database_session.query(Checkpoint.checkpoint_id, Checkpoint.lat, Checkpoint.lon)
+        added = 0
+
+        for checkpoint_id, lat, lon in rows:
+            if checkpoint_id not in self._points:
+                self.add(checkpoint_id, lat, lon)
+                added += 1
+
+        return added
+
+    def bbox(self, south: float, west: float, north: float, east: float) -> list:
+        """ Return the checkpoint ids inside a bounding box. """
+
+        i_min, j_min = self._cell(south, west)
+        i_max, j_max = self._cell(north, east)
+
+        ids = list()
+        for i in range(i_min, i_max + 1):
+            for j in range(j_min, j_max + 1):
+                for checkpoint_id in self._cells.get((i, j), ()):
+                    lat, lon = self._points[checkpoint_id]
+                    if south <= lat <= north and west <= lon <= east:
+                        ids.append(checkpoint_id)
+
+        return ids
+
+    def radius(self, lat: float, lon: float, meters: float) -> list:
+        """ Return (checkpoint_id, distance) pairs within a radius, nearest first. """
+
+        # The longitude span of the search
+        # box widens away from the equator.
+        d_lat = meters / METERS_PER_DEGREE
+        d_lon = d_lat / max(cos(radians(lat)), 1e-6)
+
+        candidates = self.bbox(lat - d_lat, lon - d_lon, lat + d_lat, lon + d_lon)
+        return [(c, d) for c, d in self._measure(lat, lon, candidates) if d <= meters]
+
+    def nearest(self, lat: float, lon: float, k: int=1) -> list:
+        """ Return the k nearest (checkpoint_id, distance) pairs, nearest first. """
+
+        if not self._points:
+            return list()
+
+        k = min(k, len(self._points))
+        i, j = self._cell(lat, lon)
+        scale = cos(radians(lat))
+
+        # Visit the rings of cells around the query point, from the
+        # inside out, until a ring lies beyond the k-th best distance.
+        best = list()
+        pending = list()
+        seen = 0
+        ring = 0
+
+        while seen < len(self._points):
+            # The nearest cells of a ring are straight east and west
+            if len(best) == k and self._gap(i, j, (i, j + ring), scale) > best[-1][1]:
+                break
+
+            # Far from any point, most cells of a ring are empty:
+            # visit all the cells left over instead.
+            last = 8 * ring > len(self._cells)
+            if last:
+                cells = [cell for cell in self._cells if max(abs(cell[0] - i), abs(cell[1] - j)) >= ring]
+            else:
+                cells = [cell for cell in self._ring(i, j, ring) if cell in self._cells]
+
+            for cell in cells:
+                if len(best) < k or self._gap(i, j, cell, scale) <= best[-1][1]:
+                    pending.extend(self._cells[cell])
+                seen += len(self._cells[cell])
+
+            # Measure in batches, once there are enough candidates to bound the search
+            if len(best) + len(pending) >= k:
+                best = sorted(best + self._measure(lat, lon, pending), key=itemgetter(1))[:k]
+                pending = list()
+
+            if last:
+                break
+            ring += 1
+
+        return best
+
+    def _gap(self, i: int, j: int, cell: tuple, scale: float) -> float:
+        """
+        The least distance in meters from a point of cell (i, j) to any point of another cell.
+
+        :param scale: the cosine of the point's latitude
+        """
+
+        # Whole cells between them in latitude, or in longitude, where
+        # meters per degree shrink with the cosine of the latitude.
+        rows = max(abs(cell[0] - i) - 1, 0) * self.cell_size
+        columns = radians(min(max(abs(cell[1] - j) - 1, 0) * self._degrees, 90))
+
+        return max(rows, EARTH_RADIUS * asin(scale * sin(columns)))
+
+    @staticmethod
+    def _ring(i: int, j: int, ring: int) -> list:
+        """ The cells at exactly ring cells from (i, j), around a square. """
+
+        if not ring:
+            return [(i, j)]
+
+        sides = range(-ring, ring + 1)
+        return [(i - ring, j + b) for b in sides] + [(i + ring, j + b) for b in sides] + \
+               [(i + a, j - ring) for a in sides[1:-1]] + [(i + a, j + ring) for a in sides[1:-1]]
+
+    def _measure(self, lat: float, lon: float, candidates: list) -> list:
+        """ Sort candidates by distance to a point. """
+
+        if not candidates:
+            return list()
+
+        coordinates = np.array([self._points[c] for c in candidates])
+        distances = haversine(lat, lon, coordinates[:, 0], coordinates[:, 1])
+        order = np.argsort(distances)
+
+        return [(candidates[n], float(distances[n])) for n in order]
+
+    def _cell(self, lat: float, lon: float) -> tuple:
+        return floor(lat / self._degrees), floor(lon / self._degrees)
@@ -1,15 +1,42 @@
 """  The module that produces statistics, maps and plots. """
 
 
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
 from m5.model import Order, Checkin, Checkpoint, Client
+from sqlalchemy import func
 from sqlalchemy.orm.session import Session as DatabaseSession
-from m5.user import User
+from m5.cache import QueryCache
+from m5.partitions import Partitions, scopes
+
+# Numpy is imported by the methods that need it:
+# plain queries on the local database start faster.
+
+
+Grid = namedtuple('Grid', ['counts', 'lat_edges', 'lon_edges'])
+
+
+# What the courier earns for an order (missing prices count as zero)
+_REVENUE = sum(func.coalesce(price, 0) for price in (Order.city_tour,
+                                                     Order.overnight,
+                                                     Order.waiting_time,
+                                                     Order.extra_stops,
+                                                     Order.fax_confirm))
 
 
 class Stats():
 
-    def __init__(self, database_session: DatabaseSession):
+    def __init__(self, database_session: DatabaseSession, cache: QueryCache=None, partitions: Partitions=None):
+        """
+        :param database_session: the user's database session
+        :param cache: share it with the Factory to have pushes invalidate it
+        :param partitions: query only the partitions of the date range (c.f. User.partitions)
+        """
+
         self.session = database_session
+        self.cache = cache if cache is not None else QueryCache()
+        self.partitions = partitions
 
     def play(self):
 
@@ -28,8 +55,178 @@ class Stats():
         for instance in self.session.query(Order).filter(Order.cash == True).order_by(Order.id):
             print(instance.id, instance.date)
 
+    def density(self,
+                begin: date=None,
+                end: date=None,
+                purpose: str=None,
+                client_id: int=None,
+                bins: tuple=(100, 100),
+                bounds: tuple=None) -> Grid:
+        """
+        Bin checkin locations into a raster grid (a heatmap). The grid is
+        cached, so asking again with the same parameters costs nothing.
+
+        :param begin: the first day included (default: the beginning of time)
+        :param end: the last day included (default: the end of time)
+        :param purpose: 'pickup' or 'dropoff' (default: both)
+        :param client_id: only count one client's checkins (default: all)
+        :param bins: the number of (lat, lon) cells
+        :param bounds: (south, west, north, east) (default: fit the data)
+        :return: a Grid(counts, lat_edges, lon_edges) object
+        """
+
+        assert purpose in (None, 'pickup', 'dropoff'), 'Purpose must be pickup or dropoff'
+
+        key = ('density', begin, end, purpose, client_id, tuple(bins), tuple(bounds) if bounds else None)
+
+        def compute():
+            import numpy as np
+
+            lat, lon = self._locations(begin, end, purpose, client_id)
+
+            if bounds is not None:
+                south, west, north, east = bounds
+            elif len(lat):
+                south, west, north, east = lat.min(), lon.min(), lat.max(), lon.max()
+            else:
+                south, west, north, east = 0, 0, 0, 0
+
+            counts, lat_edges, lon_edges = np.histogram2d(lat, lon, bins=bins,
+                                                          range=[[south, north], [west, east]])
+            return Grid(counts, lat_edges, lon_edges)
+
+        return self.cache.cached(key, compute, begin, end)
+
+    def monthly_totals(self, begin: date=None, end: date=None) -> list:
+        """ Return (YYYY-MM, number of orders, revenue) for each month. """
+
+        month = func.strftime('%Y-%m', Order.date)
+
+        def query(session):
+            query = session.query(month, func.count(Order.order_id), func.sum(_REVENUE))
+            return self._between(query, Order.date, begin, end).group_by(month).order_by(month)
+
+        def compute():
+            return self._sum(self._gather(query, begin, end), 1)
+
+        return self.cache.cached(('monthly_totals', begin, end), compute, begin, end)
+
+    def top_clients(self, n: int=10, begin: date=None, end: date=None) -> list:
+        """ Return (client_id, name, number of orders, revenue) for the n best clients. """
+
+        def compute():
+            # The best clients of each chunk of partitions are not enough: merge all the totals
+            if self.partitions is not None:
+                return sorted(self.client_totals(begin, end), key=lambda row: row[3], reverse=True)[:n]
+
+            revenue = func.sum(_REVENUE)
+            query = self.session.query(Client.client_id, Client.name, func.count(Order.order_id), revenue)\
+                .join(Order, Order.client_id == Client.client_id)
+            query = self._between(query, Order.date, begin, end)
+            query = query.group_by(Client.client_id).order_by(revenue.desc()).limit(n)
+            return [tuple(row) for row in query]
+
+        return self.cache.cached(('top_clients', n, begin, end), compute, begin, end)
+
+    def client_totals(self, begin: date=None, end: date=None) -> list:
+        """ Return (client_id, name, number of orders, revenue) for every client, by client_id. """
+
+        def query(session):
+            query = session.query(Client.client_id, Client.name, func.count(Order.order_id), func.sum(_REVENUE))\
+                .join(Order, Order.client_id == Client.client_id)
+            query = self._between(query, Order.date, begin, end)
+            return query.group_by(Client.client_id).order_by(Client.client_id)
+
+        def compute():
+            return self._sum(self._gather(query, begin, end), 2)
+
+        return self.cache.cached(('client_totals', begin, end), compute, begin, end)
+
+    def cash_orders(self, begin: date=None, end: date=None) -> list:
+        """ Return (order_id, date, client_id) for the orders paid in cash. """
+
+        def query(session):
+            query = session.query(Order.order_id, Order.date, Order.client_id).filter(Order.cash == True)
+            return self._between(query, Order.date, begin, end).order_by(Order.date)
+
+        def compute():
+            return sorted(self._gather(query, begin, end), key=lambda row: row[1])
+
+        return self.cache.cached(('cash_orders', begin, end), compute, begin, end)
+
+    def clear(self):
+        """ Forget all cached results. """
+        self.cache.clear()
+
+    def _locations(self, begin: date, end: date, purpose: str, client_id: int) -> tuple:
+        """
+        Return the coordinates of the filtered checkins as two numpy arrays. With a
+        client, a checkin is matched with its order in the same chunk of partitions:
+        an order that ends past midnight at the turn of a partition loses the later stops.
+        """
+
+        def query(session):
+            query = session.query(Checkpoint.lat, Checkpoint.lon)\
+                .join(Checkin, Checkin.checkpoint_id == Checkpoint.checkpoint_id)
+            query = self._between(query, Checkin.timestamp, begin, end)
+
+            if purpose is not None:
+                query = query.filter(Checkin.purpose == purpose)
+            if client_id is not None:
+                query = query.join(Order, Order.order_id == Checkin.order_id)\
+                    .filter(Order.client_id == client_id)
+
+            return query
+
+        rows = self._gather(query, begin, end)
+
+        import numpy as np
+
+        coordinates = np.array(rows, dtype=np.float64).reshape(-1, 2)
+
+        return coordinates[:, 0], coordinates[:, 1]
+
+    def _gather(self, query, begin: date, end: date) -> list:
+        """
+        Run a query on the user's session, or on each chunk of partitions
+        of the date range, and return all the rows together.
+
+        :param query: a function that builds the query on a session
+        """
+
+        rows = list()
+        for session in scopes(self.session, self.partitions, begin, end):
+            rows.extend(tuple(row) for row in query(session))
+        return rows
+
+    @staticmethod
+    def _sum(rows: list, width: int) -> list:
+        """ Add up the rows that share their first columns (one row per chunk of partitions), in order. """
+
+        totals = dict()
+        for row in rows:
+            if row[:width] in totals:
+                totals[row[:width]] = [(a or 0) + (b or 0) for a, b in zip(totals[row[:width]], row[width:])]
+            else:
+                totals[row[:width]] = list(row[width:])
+
+        return [key + tuple(total) for key, total in sorted(totals.items())]
+
+    @staticmethod
+    def _between(query, column, begin: date, end: date):
+        """ Filter a query on a range of days (both included). """
+
+        if begin is not None:
+            query = query.filter(column >= datetime.combine(begin, datetime.min.time()))
+        if end is not None:
+            query = query.filter(column < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+        return query
+
+
 if __name__ == '__main__':
+    from m5.user import User
+
     u = User('m-134', 'PASSWORD')
     s = Stats(u.database_session)
 
-    s.play()
\ No newline at end of file
+    s.play()
@@ -0,0 +1,337 @@
+"""
+The transport module: a requests session tuned for long bulk downloads.
+
+It keeps a pool of keep-alive connections, asks for compressed pages, retries
+timeouts and server errors a bounded number of times with exponential backoff
+and jitter, and sets a timeout on every request. When the server says the
+session has expired, it logs in again and repeats the request, transparently.
+
+Logging in is lazy: it happens on the first request, not when the session is
+created. The cookie jar can be persisted between runs (readable by the owner
+only), in which case the saved cookies are trusted until the server says that
+they have expired: short scripts don't pay a login round trip every time.
+
+The number of requests in flight is adaptive (AIMD): it grows slowly while the
+response times are stable and shrinks quickly on errors, timeouts or slowdowns.
+"""
+
+from collections import deque
+from contextlib import contextmanager
+from json import dump, load
+from os import O_CREAT, O_TRUNC, O_WRONLY, fdopen, makedirs, open as os_open, remove, replace
+from os.path import dirname, isfile
+from random import uniform
+from threading import Condition, Lock, local
+from time import time, monotonic
+
+from requests import Session
+from requests.cookies import create_cookie
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+POOL_SIZE = 10
+RETRIES = 5
+BACKOFF = 0.5  # seconds, doubled after each retry
+TIMEOUT = (5, 30)  # seconds to connect, seconds to read
+
+_RETRY_STATUS = (500, 502, 503, 504)
+
+# Adaptive concurrency: start with few requests in flight, add one
+# per round trip while latency holds, halve on errors, cut a little
+# when the recent latency drifts too far above the long-term latency.
+MIN_LIMIT = 1
+MAX_LIMIT = POOL_SIZE
+INITIAL_LIMIT = 2
+BACKOFF_FACTOR = 0.5
+SLOWDOWN_FACTOR = 0.9
+LATENCY_TOLERANCE = 2.0
+
+
+class JitteredRetry(Retry):
+    """ Exponential backoff with jitter, so that parallel workers don't retry in lockstep. """
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        return backoff / 2 + uniform(0, backoff / 2)
+
+
+class AdaptiveLimiter():
+    """ An AIMD limit on the number of requests in flight, shared by all the threads of a session. """
+
+    def __init__(self,
+                 initial: float=INITIAL_LIMIT,
+                 minimum: float=MIN_LIMIT,
+                 maximum: float=MAX_LIMIT,
+                 tolerance: float=LATENCY_TOLERANCE):
+        """
+        :param initial: the number of requests in flight to start with
+        :param minimum: never go below this
+        :param maximum: never go above this (more than the connection pool is pointless)
+        :param tolerance: slow down when the recent latency exceeds the long-term latency that many times
+        """
+
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.tolerance = tolerance
+
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+
+        # Latency averages in seconds, short-term and long-term
+        self.latency = None
+        self.baseline = None
+
+        # How many times each decision was made, and the
+        # last changes of the limit: (time, decision, limit)
+        self.counts = {'increase': 0, 'slowdown': 0, 'backoff': 0}
+        self.decisions = deque(maxlen=100)
+
+        self._condition = Condition()
+
+    def acquire(self) -> float:
+        """ Wait for a free slot and return the start time of the request. """
+
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+        return monotonic()
+
+    def release(self, start: float, ok: bool):
+        """
+        Free the slot and adapt the limit to what happened.
+
+        :param start: what acquire() returned
+        :param ok: False for a timeout, a connection error or a server error
+        """
+
+        latency = monotonic() - start
+
+        with self._condition:
+            self.in_flight -= 1
+            self.requests += 1
+
+            if not ok:
+                self.errors += 1
+                self._decide('backoff', self.limit * BACKOFF_FACTOR)
+            else:
+                self.latency = latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+                self.baseline = latency if self.baseline is None else 0.98 * self.baseline + 0.02 * latency
+
+                if self.latency > self.tolerance * self.baseline:
+                    self._decide('slowdown', self.limit * SLOWDOWN_FACTOR)
+                else:
+                    # About one more slot per round trip of the whole window
+                    self._decide('increase', self.limit + 1 / self.limit)
+
+            self._condition.notify_all()
+
+    def metrics(self) -> dict:
+        """ The current state of the limiter and the count of each decision. """
+
+        with self._condition:
+            return {'limit': self.limit,
+                    'in_flight': self.in_flight,
+                    'requests': self.requests,
+                    'errors': self.errors,
+                    'latency': self.latency,
+                    'baseline': self.baseline,
+                    'increases': self.counts['increase'],
+                    'slowdowns': self.counts['slowdown'],
+                    'backoffs': self.counts['backoff']}
+
+    def _decide(self, decision: str, limit: float):
+        self.counts[decision] += 1
+        limit = min(max(limit, self.minimum), self.maximum)
+        if int(limit) != int(self.limit):
+            self.decisions.append((time(), decision, limit))
+        self.limit = limit
+
+
+class RemoteSession(Session):
+    """ A requests session with a sized connection pool, retries, timeouts and re-login. """
+
+    def __init__(self,
+                 pool_size: int=POOL_SIZE,
+                 retries: int=RETRIES,
+                 backoff: float=BACKOFF,
+                 timeout: tuple=TIMEOUT,
+                 login=None,
+                 expired=None,
+                 cookie_file: str=None,
+                 throttle=None,
+                 limiter: AdaptiveLimiter=None):
+        """
+        :param pool_size: the number of keep-alive connections per host
+        :param retries: how many times a failed request is retried
+        :param backoff: the first backoff delay in seconds
+        :param timeout: the default (connect, read) timeout of each request
+        :param login: a function without arguments that logs in again
+        :param expired: a function that tells whether a response means the session has expired
+        :param cookie_file: where the cookie jar is persisted between runs (optional)
+        :param throttle: a function without arguments called before each request (optional)
+        :param limiter: adapts the number of requests in flight (optional)
+        """
+
+        super().__init__()
+
+        retry = JitteredRetry(total=retries,
+                              backoff_factor=backoff,
+                              status_forcelist=_RETRY_STATUS,
+                              allowed_methods=frozenset(['GET', 'POST']),
+                              raise_on_status=False)
+
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.mount('http://', adapter)
+        self.mount('https://', adapter)
+
+        # The server doesn't seem to care but...
+        self.headers.update({'User-Agent': 'Mozilla/5.0',
+                             'Accept-Encoding': 'gzip, deflate',
+                             'Connection': 'keep-alive'})
+
+        self.timeout = timeout
+        self.login = login
+        self.expired = expired
+        self.cookie_file = cookie_file
+        self.throttle = throttle
+        self.limiter = limiter
+
+        # One thread logs in at a time, the others wait for it. Its own
+        # login requests are not checked for expiry (c.f. _login_guard).
+        self._login_lock = Lock()
+        self._login_thread = local()
+        self._generation = 0
+
+        self.authenticated = False
+        self.logins = 0
+        self.relogins = 0
+
+        if cookie_file:
+            self.load_cookies()
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request with the default timeout. Log in first if we have no
+        cookies at all, and log in again if the session has expired.
+        """
+
+        kwargs.setdefault('timeout', self.timeout)
+
+        if getattr(self._login_thread, 'active', False):
+            return self._send(method, url, **kwargs)
+
+        if self.login and not self.authenticated and not len(self.cookies):
+            self.authenticate(self._generation)
+
+        # Which login the request was sent with
+        generation = self._generation
+        response = self._send(method, url, **kwargs)
+
+        if self.login and self.expired and self.expired(response):
+            if self.authenticate(generation):
+                self.relogins += 1
+            response = self._send(method, url, **kwargs)
+
+        return response
+
+    def _send(self, method, url, **kwargs):
+        """ Send one request, within the rate limit and the concurrency limit. """
+
+        if self.throttle:
+            self.throttle()
+
+        if self.limiter is None:
+            return super().request(method, url, **kwargs)
+
+        start = self.limiter.acquire()
+        ok = False
+        try:
+            response = super().request(method, url, **kwargs)
+            ok = response.status_code < 500
+        finally:
+            self.limiter.release(start, ok)
+
+        return response
+
+    def authenticate(self, generation: int=None) -> bool:
+        """
+        Log in, without checking the login requests themselves for expiry.
+
+        :param generation: the login a request was sent with: if another thread
+                           has logged in since, wait for it instead of logging in again
+        :return: True if this call logged in
+        """
+
+        with self._login_lock:
+            if generation is not None and generation != self._generation:
+                return False
+
+            with self._login_guard():
+                self.login()
+
+            self._generation += 1
+            self.authenticated = True
+            self.logins += 1
+            self.save_cookies()
+
+        return True
+
+    def load_cookies(self):
+        """ Load the cookies persisted by a previous run, except those that have expired. """
+
+        if not self.cookie_file or not isfile(self.cookie_file):
+            return
+
+        with open(self.cookie_file) as f:
+            cookies = load(f)
+
+        now = time()
+        for cookie in cookies:
+            if cookie['expires'] is None or cookie['expires'] > now:
+                self.cookies.set_cookie(create_cookie(**cookie))
+
+    def save_cookies(self):
+        """ Persist the cookie jar atomically, readable by the owner only. """
+
+        if not self.cookie_file:
+            return
+
+        cookies = [{'name': c.name, 'value': c.value, 'domain': c.domain,
+                    'path': c.path, 'expires': c.expires, 'secure': c.secure}
+                   for c in self.cookies]
+
+        makedirs(dirname(self.cookie_file) or '.', mode=0o700, exist_ok=True)
+
+        temporary = self.cookie_file + '.tmp'
+        with fdopen(os_open(temporary, O_WRONLY | O_CREAT | O_TRUNC, 0o600), 'w') as f:
+            dump(cookies, f)
+        replace(temporary, self.cookie_file)
+
+    def forget(self):
+        """ Drop the cookies, in memory and on disk: the next request logs in again. """
+
+        self.cookies.clear()
+        self.authenticated = False
+
+        if self.cookie_file and isfile(self.cookie_file):
+            remove(self.cookie_file)
+
+    def close(self):
+        """ Keep the cookies for the next run, then close the connections. """
+
+        if self.cookies:
+            self.save_cookies()
+        super().close()
+
+    @contextmanager
+    def _login_guard(self):
+        self._login_thread.active = True
+        try:
+            yield
+        finally:
+            self._login_thread.active = False
@@ -2,12 +2,23 @@
 
 from os.path import dirname, join
 from getpass import getpass
-from requests import Session as RequestsSession
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 
 from m5.utilities import notify, log_me, safe_request, DEBUG
 from m5.model import Base
+from m5.migrations import upgrade
+
+# The network stack (m5.transport, requests) is only
+# imported when the user actually goes online.
+
+
+# After that, give up and raise
+MAX_LOGIN_ATTEMPTS = 3
+
+
+class AuthenticationError(Exception):
+    """ The remote server keeps refusing the credentials. """
 
 
 class User:
@@ -17,59 +28,107 @@ class User:
     It can theoretically be overridden for other courier companies.
     """
 
-    def __init__(self, username: str=None, password: str=None, local=False):
-        """  Authenticate the user on the remote server and initialise the local database. """
+    def __init__(self, username: str=None, password: str=None, local=False, transport: dict=None,
+                 partitioned: str=None, database: bool=True):
+        """
+        Prepare the remote session and initialise the local database. The user
+        is only authenticated on the remote server when a request needs it, and
+        the session cookies of the previous run are re-used if still valid.
+
+        :param transport: keyword arguments for the RemoteSession (pool size, retries, timeout, limiter...)
+        :param partitioned: keep the orders and checkins in one database file per 'year' or 'quarter'
+        :param database: open the local database (the backfill workers don't: only the parent writes it)
+        """
 
         self.username = username
         self._password = password
         self.local = local
 
-        # Say hello to the company server
-        if not local:
-            self.remote_session = RequestsSession()
-            self._authenticate(self.username, self._password)
-
         # Make paths bulletproof
         self.m5_path = dirname(__file__)
         self.db_path = join(self.m5_path, '../db/%s.sqlite' % self.username)
         self.downloads = join(self.m5_path, '../downloads', username)
+        self.cookie_file = join(self.m5_path, '../sessions/%s.json' % self.username)
+
+        # Say hello to the company server (later)
+        if not local:
+            from m5.transport import RemoteSession, AdaptiveLimiter
+
+            transport = dict(transport or {})
+            transport.setdefault('limiter', AdaptiveLimiter())
+
+            self.remote_session = RemoteSession(login=self._relogin,
+                                                expired=self._is_expired,
+                                                cookie_file=self.cookie_file,
+                                                **transport)
+
+        self.engine = None
+        self.database_session = None
+        self.partitions = None
+
+        if not database:
+            return
 
         # Create one database per user
         self.engine = create_engine('sqlite:///%s' % self.db_path, echo=DEBUG)
         self.Base = Base.metadata.create_all(self.engine)
+        upgrade(self.engine)
 
         # Start a database query session
         _Session = sessionmaker(bind=self.engine)
         self.database_session = _Session()
 
+        # The orders and checkins may live in partitions next to the database
+        if partitioned:
+            from m5.partitions import Partitions
+            self.partitions = Partitions(self.db_path, join(self.m5_path, '../db', self.username), period=partitioned)
+
+    def _relogin(self):
+        """ Log in with the credentials we already have. """
+        self._authenticate(self.username, self._password)
+
     @log_me
     @safe_request
     def _authenticate(self, username=None, password=None):
-        """ Make recursive login attempts until successful. """
-
-        if not username:
-            self.username = input('Enter username: ')
-        if not password:
-            self._password = getpass('Enter password: ')
+        """ Make login attempts until successful, but not forever. """
 
         url = 'http://bamboo-mec.de/ll.php5'
-        credentials = {'username': self.username,
-                       'password': self._password}
-
-        # The server doesn't seem to care but...
-        headers = {'user-agent': 'Mozilla/5.0'}
-        self.remote_session.headers.update(headers)
-
-        response = self.remote_session.post(url, credentials)
-        if not response.ok:
-            self._authenticate()
-        else:
-            print('Now logged into remote server.')
 
-    def quit(self):
-        """ Make a clean exit from the program. """
-
-        self._logout()
+        for attempt in range(MAX_LOGIN_ATTEMPTS):
+            if not username:
+                self.username = input('Enter username: ')
+            if not password:
+                self._password = getpass('Enter password: ')
+
+            credentials = {'username': self.username,
+                           'password': self._password}
+
+            response = self.remote_session.post(url, credentials)
+            if response.ok and not self._is_expired(response):
+                print('Now logged into remote server.')
+                return
+
+            # Ask for the credentials again
+            username = password = None
+
+        raise AuthenticationError('Failed to log in after {n} attempts.'.format(n=MAX_LOGIN_ATTEMPTS))
+
+    @staticmethod
+    def _is_expired(response) -> bool:
+        """ Once the session has expired, the server serves the login form again. """
+        return 'name="password"' in response.text
+
+    def quit(self, logout: bool=False):
+        """
+        Make a clean exit from the program. The remote session is kept
+        alive for the next run, unless we explicitly log out.
+        """
+
+        if not self.local:
+            if logout:
+                self._logout()
+            else:
+                self.remote_session.close()
         exit(0)
 
     def _logout(self):
@@ -78,10 +137,14 @@ class User:
         url = 'http://bamboo-mec.de/index.php5'
         payload = {'logout': '1'}
 
+        # The home page looks like an expired session
+        self.remote_session.login = None
+
         response = self.remote_session.get(url, params=payload)
 
         if response.history[0].status_code == 302:
             # We have been redirected to the home page
             notify('Logged out. Goodbye!')
 
+        self.remote_session.forget()
         self.remote_session.close()
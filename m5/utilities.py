@@ -5,6 +5,9 @@ from collections import namedtuple
 
 DEBUG = True
 
+# Checkin keys are order_id * MAX_STOPS + rank
+MAX_STOPS = 100
+
 Stamped = namedtuple('Stamped', ['stamp', 'data'])
 Stamp = namedtuple('Stamp', ['date', 'uuid'])
 Tables = namedtuple('Tables', ['clients', 'orders', 'checkpoints', 'checkins'])
@@ -0,0 +1,86 @@
+""" Unittest scripts for the archive module. """
+
+from unittest import TestCase
+from unittest.mock import patch
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import listdir
+from os.path import join, getsize
+from datetime import date
+
+from m5.archive import Archive
+from m5.factory import Miner
+from m5.utilities import Stamp
+
+
+class TestArchive(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.archive = Archive(self.directory)
+
+    def tearDown(self):
+        self.archive.close()
+        rmtree(self.directory)
+
+    def _loose(self, filename: str, html: str):
+        with open(join(self.directory, filename), 'w') as f:
+            f.write(html)
+
+    def testRandomAccess(self):
+        """ Each page is read on its own, from the right month. """
+
+        self.archive.add({'2014-12-05-uuid-1234567.html': '<p>One</p>',
+                          '2014-12-06-uuid-1234568.html': '<p>Two</p>',
+                          '2015-01-02-uuid-1234569.html': '<p>Three</p>'})
+
+        self.assertEqual(self.archive.months(), ['2014-12', '2015-01'])
+        self.assertEqual(self.archive.get('2014-12-06-uuid-1234568.html'), '<p>Two</p>')
+        self.assertEqual(self.archive.get('2015-01-02-uuid-1234569.html'), '<p>Three</p>')
+        self.assertIsNone(self.archive.get('2014-12-07-uuid-1234570.html'))
+        self.assertIn('2014-12-05-uuid-1234567.html', self.archive)
+
+    def testCompact(self):
+        """ Loose files are folded into the packs, and superseded copies are dropped. """
+
+        self.archive.add({'2014-12-05-uuid-1234567.html': '<p>Old</p>'})
+        self._loose('2014-12-05-uuid-1234567.html', '<p>New</p>')
+        self._loose('2014-12-06-uuid-1234568.html', '<p>Two</p>')
+
+        self.assertEqual(self.archive.compact(), 2)
+
+        self.assertEqual(sorted(listdir(self.directory)), ['2014-12.index', '2014-12.pack'])
+        self.assertEqual(self.archive.get('2014-12-05-uuid-1234567.html'), '<p>New</p>')
+        self.assertEqual(self.archive.get('2014-12-06-uuid-1234568.html'), '<p>Two</p>')
+
+        size = getsize(join(self.directory, '2014-12.pack'))
+        self.archive.compact()
+        self.assertEqual(getsize(join(self.directory, '2014-12.pack')), size)
+
+    def testMonthByMonth(self):
+        """ A month's loose files are only deleted once its pack is on disk: a failure leaves the next months alone. """
+
+        self._loose('2014-12-05-uuid-1234567.html', '<p>One</p>')
+        self._loose('2015-01-02-uuid-1234569.html', '<p>Two</p>')
+
+        with patch('m5.archive.fsync', side_effect=[None, OSError('Disk full')]):
+            self.assertRaises(OSError, self.archive.compact)
+
+        self.assertEqual(self.archive.get('2014-12-05-uuid-1234567.html'), '<p>One</p>')
+        self.assertNotIn('2014-12-05-uuid-1234567.html', listdir(self.directory))
+        self.assertIn('2015-01-02-uuid-1234569.html', listdir(self.directory))
+
+        self.assertEqual(self.archive.compact(), 1)
+        self.assertEqual(self.archive.get('2015-01-02-uuid-1234569.html'), '<p>Two</p>')
+
+    def testMiner(self):
+        """ The Miner reads archived pages like loose ones. """
+
+        self._loose('2014-12-05-uuid-1234567.html', '<p>Job</p>')
+        self.archive.compact()
+
+        miner = Miner(None, self.directory)
+        miner.stamp = Stamp(date(2014, 12, 5), '1234567')
+
+        self.assertTrue(miner._is_cached())
+        self.assertEqual(miner._load_job().p.text, 'Job')
@@ -0,0 +1,64 @@
+""" Unittest scripts for the cache module. """
+
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from datetime import date
+
+from m5.cache import QueryCache
+
+
+class TestQueryCache(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.calls = 0
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def _compute(self):
+        self.calls += 1
+        return self.calls
+
+    def testLeastRecentlyUsed(self):
+        """ The oldest entry is evicted first. """
+
+        cache = QueryCache(size=2)
+        cache.cached('a', self._compute)
+        cache.cached('b', self._compute)
+        cache.cached('a', self._compute)
+        cache.cached('c', self._compute)
+
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.cached('a', self._compute), 1)
+        self.assertEqual(cache.cached('b', self._compute), 4)
+
+    def testInvalidate(self):
+        """ Only the entries whose date range contains a pushed day are dropped. """
+
+        cache = QueryCache()
+        cache.cached('january', self._compute, date(2014, 1, 1), date(2014, 1, 31))
+        cache.cached('february', self._compute, date(2014, 2, 1), date(2014, 2, 28))
+        cache.cached('since february', self._compute, date(2014, 2, 1))
+        cache.cached('forever', self._compute)
+
+        self.assertEqual(cache.invalidate([date(2014, 1, 15)]), 2)
+        self.assertEqual(cache.cached('february', self._compute), 2)
+        self.assertEqual(cache.cached('since february', self._compute), 3)
+        self.assertEqual(cache.cached('january', self._compute), 5)
+
+    def testDisk(self):
+        """ The disk tier is shared between cache objects and invalidated across them. """
+
+        writer = QueryCache(directory=self.directory)
+        reader = QueryCache(directory=self.directory)
+
+        january = date(2014, 1, 1), date(2014, 1, 31)
+
+        writer.cached('a', self._compute, *january)
+        self.assertEqual(reader.cached('a', self._compute, *january), 1)
+        self.assertEqual(reader.hits, 1)
+
+        writer.invalidate([date(2014, 1, 2)])
+        self.assertEqual(reader.cached('a', self._compute, *january), 2)
@@ -2,19 +2,28 @@
 
 
 from unittest import TestCase
+from unittest.mock import patch
 
 from os import listdir, remove
+from shutil import rmtree
+from tempfile import mkdtemp
 from requests import Session
 from bs4 import BeautifulSoup
 from random import randint
 from os.path import join, dirname, normpath
 from random import sample
 from re import search, match
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
+from threading import Event, current_thread
 
-from m5.factory import Scraper, Miner, Packager
-from m5.utilities import Stamp, Stamped, Tables
-from m5.model import Client, Order, Checkin, Checkpoint
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from m5.factory import Scraper, Miner, Packager, Pusher, WriteBehindPusher
+from m5.cache import QueryCache, ScrapeCache
+from m5.utilities import Stamp, Stamped, Tables, MAX_STOPS
+from m5.model import Client, Order, Checkin, Checkpoint, Base
 
 
 class TestDownloader(TestCase):
@@ -236,4 +245,335 @@ class TestPackager(TestCase):
         self.assertIsInstance(tables.clients[0], Client)
         self.assertIsInstance(tables.orders[0], Order)
         self.assertIsInstance(tables.checkins[0], Checkin)
-        self.assertIsInstance(tables.checkpoints[0], Checkpoint)
\ No newline at end of file
+        self.assertIsInstance(tables.checkpoints[0], Checkpoint)
+
+
+class TestStreaming(TestCase):
+
+    def testStream(self):
+        """ The Packager pulls one serial job at a time and yields one Tables per job. """
+
+        pulled = list()
+
+        def serial_items():
+            for n in range(3):
+                pulled.append(n)
+                job_details = {'client_id': '30349', 'client_name': 'Lisa D. Productions',
+                               'order_id': str(1412050830 + n), 'km': '6,414', 'cash': None,
+                               'city_tour': '11,20', 'extra_stops': None, 'overnight': None,
+                               'fax_confirm': None, 'waiting_time': None, 'type': 'Stadtkurier'}
+                addresses = [{'company': None, 'address': None, 'postal_code': None, 'after': None,
+                              'purpose': None, 'until': None, 'timestamp': '14:46', 'city': None}]
+                yield Stamped(Stamp(date(2014, 12, 5), '123456%d' % n), (job_details, addresses))
+
+        somewhere = {'osm_id': '10', 'lat': 52.5, 'lon': 13.4, 'display_name': 'Somewhere'}
+
+        with patch.object(Packager, 'geocode', return_value=somewhere):
+            stream = Packager().stream(serial_items())
+
+            first = next(stream)
+            self.assertEqual(pulled, [0])
+            self.assertIsInstance(first, Tables)
+            self.assertEqual([len(table) for table in first], [1, 1, 1, 1])
+
+            self.assertEqual(len(list(stream)), 2)
+            self.assertEqual(pulled, [0, 1, 2])
+
+
+class TestCheckinKeys(TestCase):
+
+    def testKeys(self):
+        """ Stops in the same minute get distinct keys, and the same keys every time. """
+
+        addresses = [{'company': None, 'address': None, 'postal_code': None, 'after': None,
+                      'purpose': None, 'until': None, 'timestamp': t, 'city': None}
+                     for t in ('15:10', '14:46', '14:46')]
+        job_details = {'client_id': '30349', 'client_name': 'Lisa D.', 'order_id': '1412050834',
+                       'km': None, 'cash': None, 'city_tour': None, 'extra_stops': None, 'overnight': None,
+                       'fax_confirm': None, 'waiting_time': None, 'type': None}
+        serial_items = [Stamped(Stamp(date(2014, 12, 5), '1234567'), (job_details, addresses))]
+
+        somewhere = {'osm_id': '10', 'lat': 52.5, 'lon': 13.4, 'display_name': 'Somewhere'}
+
+        with patch.object(Packager, 'geocode', return_value=somewhere):
+            first = [c.checkin_id for c in Packager().package(serial_items).checkins]
+            again = [c.checkin_id for c in Packager().package(serial_items).checkins]
+
+        self.assertEqual(first, [141205083402, 141205083400, 141205083401])
+        self.assertEqual(first, again)
+
+    def testUnstorable(self):
+        """ Stops without a location or a time are left out before ranking, and so are stops beyond MAX_STOPS. """
+
+        addresses = [{'company': None, 'address': street, 'postal_code': None, 'after': None,
+                      'purpose': None, 'until': None, 'timestamp': t, 'city': None}
+                     for street, t in (('A', '09:00'), ('Nowhere', '09:30'), ('B', None), ('C', '10:00'))]
+        job_details = {'client_id': '30349', 'client_name': 'Lisa D.', 'order_id': '1412050834',
+                       'km': None, 'cash': None, 'city_tour': None, 'extra_stops': None, 'overnight': None,
+                       'fax_confirm': None, 'waiting_time': None, 'type': None}
+
+        def geocode(address):
+            if address['address'] == 'Nowhere':
+                return {'osm_id': None, 'lat': None, 'lon': None, 'display_name': None}
+            return {'osm_id': address['address'], 'lat': 52.5, 'lon': 13.4, 'display_name': address['address']}
+
+        with patch.object(Packager, 'geocode', side_effect=geocode):
+            serial_items = [Stamped(Stamp(date(2014, 12, 5), '1234567'), (job_details, addresses))]
+            checkins = Packager().package(serial_items).checkins
+
+            self.assertEqual([(c.checkin_id, c.checkpoint_id) for c in checkins],
+                             [(141205083400, 'A'), (141205083401, 'C')])
+
+            addresses = [dict(addresses[0], timestamp='09:%02d' % (n % 60)) for n in range(MAX_STOPS + 5)]
+            serial_items = [Stamped(Stamp(date(2014, 12, 5), '1234567'), (job_details, addresses))]
+            self.assertEqual(len(Packager().package(serial_items).checkins), MAX_STOPS)
+
+
+class FakeServer():
+    """ Serves one summary page and one job page, with an ETag. """
+
+    def __init__(self):
+        self.summary = '<a href="ll_detail.php5?uuid=1234567">Job</a>\n'
+        self.page = '<html><body>Job 1234567</body></html>'
+        self.etag = '"v1"'
+        self.requests = list()
+
+    def get(self, url, params=None, headers=None):
+        self.requests.append((url, headers or dict()))
+
+        class Response():
+            pass
+
+        response = Response()
+        response.headers = {'ETag': self.etag}
+
+        if url.endswith('ll.php5'):
+            response.status_code, response.text = 200, self.summary
+        elif (headers or dict()).get('If-None-Match') == self.etag:
+            response.status_code, response.text = 304, ''
+        else:
+            response.status_code, response.text = 200, self.page
+
+        response.content = response.text.encode('utf-8')
+        return response
+
+
+class TestRefresh(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.server = FakeServer()
+        self.day = date.today()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def testRecency(self):
+        """ Recent pages are asked for again, conditionally, and skipped when unchanged. """
+
+        list(Miner(self.server, self.directory).stream(self.day))
+
+        miner = Miner(self.server, self.directory, recency=2)
+        self.assertEqual(list(miner.stream(self.day, changed_only=True)), [])
+        self.assertEqual(self.server.requests[-1][1], {'If-None-Match': '"v1"'})
+        self.assertEqual(miner.unchanged, 1)
+
+        # Old pages are served from the cache
+        miner = Miner(self.server, self.directory)
+        self.assertEqual(len(list(miner.stream(self.day))), 1)
+        self.assertTrue(self.server.requests[-1][0].endswith('ll.php5'))
+
+    def testOldDay(self):
+        """ The cached pages of an old day whose summary hasn't changed are not refreshed. """
+
+        day = self.day - timedelta(days=30)
+        list(Miner(self.server, self.directory).stream(day))
+        self.server.requests.clear()
+
+        miner = Miner(self.server, self.directory, recency=2)
+        self.assertEqual(list(miner.stream(day, changed_only=True)), [])
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertTrue(self.server.requests[0][0].endswith('ll.php5'))
+        self.assertEqual(miner.unchanged, 1)
+
+    def testListing(self):
+        """ A changed summary triggers a refresh, and a changed page is parsed again. """
+
+        list(Miner(self.server, self.directory).stream(self.day))
+
+        self.server.summary += '<p>Status changed</p> uuid=1234567\n'
+        self.server.page = '<html><body>Job 1234567, amended</body></html>'
+        self.server.etag = '"v2"'
+
+        soups = list(Miner(self.server, self.directory).stream(self.day, changed_only=True))
+        self.assertEqual(len(soups), 1)
+        self.assertIn('amended', soups[0].data.text)
+
+
+class TestSessionScope(TestCase):
+
+    def testBatch(self):
+        """ Each batch has its own session: the user's session is left untouched. """
+
+        engine = create_engine('sqlite://', poolclass=StaticPool)
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+
+        pusher = Pusher(session)
+        for n in range(5):
+            pusher.push(Tables([Client(client_id=1, name='A')],
+                               [Order(order_id=n, client_id=1, date=datetime(2014, 12, 1))], [], []))
+
+        self.assertEqual(len(session.identity_map), 0)
+        self.assertFalse(session.in_transaction())
+        self.assertEqual(session.query(Order).count(), 5)
+
+
+class TestWriteBehind(TestCase):
+
+    def setUp(self):
+        # One connection, shared with the writer thread
+        engine = create_engine('sqlite://', poolclass=StaticPool, connect_args={'check_same_thread': False})
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+    def testGroupCommit(self):
+        """ Batches are coalesced into one commit, and flush() is a barrier. """
+
+        pusher = WriteBehindPusher(self.session, group_rows=1000, group_seconds=5)
+
+        for n in range(10):
+            pusher.push(Tables([Client(client_id=1, name='A')],
+                               [Order(order_id=n, client_id=1, date=datetime(2014, 12, 1 + n))], [], []))
+
+        days = pusher.flush()
+        pusher.close()
+
+        self.assertEqual(pusher.commits, 1)
+        self.assertEqual(len(days), 10)
+        self.assertEqual(self.session.query(Order).count(), 10)
+
+    def testInvalidate(self):
+        """ The cache is invalidated by flush(), on the calling thread, never by the writer. """
+
+        cache = QueryCache()
+        cache.cached(('monthly_totals',), lambda: 'stale', date(2014, 12, 1), date(2014, 12, 31))
+
+        threads = list()
+        original = cache.invalidate
+
+        def invalidate(days):
+            threads.append(current_thread())
+            return original(days)
+
+        pusher = WriteBehindPusher(self.session, cache=cache, group_seconds=0)
+
+        with patch.object(cache, 'invalidate', invalidate):
+            pusher.push(Tables([Client(client_id=1, name='A')],
+                               [Order(order_id=1, client_id=1, date=datetime(2014, 12, 5))], [], []))
+            pusher.flush()
+            pusher.close()
+
+        self.assertEqual(threads, [current_thread()] * 2)
+        self.assertEqual(len(cache), 0)
+
+    def testError(self):
+        """ A failed write is raised in the migration thread. """
+
+        pusher = WriteBehindPusher(self.session, group_seconds=0)
+        pusher.push(Tables(['Not a row'], [], [], []))
+
+        self.assertRaises(Exception, pusher.flush)
+        self.assertRaises(Exception, pusher.close)
+
+        # A closed pusher starts over
+        pusher.push(Tables([Client(client_id=1, name='A')], [], [], []))
+        pusher.close()
+
+    def testStickyError(self):
+        """ The batches queued behind a failed write are reported, and new ones are refused until close(). """
+
+        started = Event()
+        resume = Event()
+
+        def fail(tables):
+            started.set()
+            resume.wait()
+            raise ValueError('Disk full')
+
+        def batch(day):
+            return Tables([], [Order(order_id=day, client_id=1, date=datetime(2014, 12, day))], [], [])
+
+        pusher = WriteBehindPusher(self.session, group_rows=1, group_seconds=0)
+
+        with patch.object(Pusher, 'insert', side_effect=fail):
+            pusher.push(batch(1))
+            started.wait()
+            pusher.push(batch(2))
+            resume.set()
+
+            self.assertRaises(ValueError, pusher.flush)
+            self.assertEqual(pusher.failed, {date(2014, 12, 1), date(2014, 12, 2)})
+
+            self.assertRaises(ValueError, pusher.push, batch(3))
+            self.assertRaises(ValueError, pusher.flush)
+            self.assertRaises(ValueError, pusher.close)
+
+        self.assertEqual(self.session.query(Order).count(), 0)
+
+
+JOB_PAGE = """
+<html><body><div id="order_detail">
+<h2>BAR 1412050834 Stadtkurier</h2>
+<h4>Kunde: Lisa D. | 30349</h4>
+<p>6,414 km</p>
+<table><tbody><tr><td>Stadtkurier</td><td>11,20</td></tr></tbody></table>
+<div data-collapsed="true"><h3>Abholung</h3><p>Lisa D.</p><p>Oranienstr. 1</p><p>10999 Berlin</p>
+<p>ab 14:00 bis 15:00</p><p>ST: 14:46</p><p>Ende</p></div>
+</div></body></html>
+"""
+
+
+class TestScrapeCache(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.cache = ScrapeCache(join(self.directory, 'scraped.sqlite'))
+        self.page = [Stamped(Stamp(date(2014, 12, 5), '1234567'), JOB_PAGE)]
+
+    def tearDown(self):
+        self.cache.close()
+        rmtree(self.directory)
+
+    def testSkip(self):
+        """ A page that has already been scraped is not parsed again, and scrapes the same. """
+
+        first = Scraper(cache=self.cache)
+        expected = first.scrape(self.page)
+
+        second = Scraper(cache=self.cache)
+        with patch('bs4.BeautifulSoup') as parser:
+            serial_items = second.scrape(self.page)
+
+        self.assertFalse(parser.called)
+        self.assertEqual((second.parsed, second.skipped), (0, 1))
+        self.assertEqual(serial_items, expected)
+        self.assertEqual(serial_items[0].data[0]['order_id'], '1412050834')
+        self.assertEqual(serial_items[0].data[1][0]['timestamp'], '14:46')
+
+    def testBlueprints(self):
+        """ When a blueprint changes, only its fragment is scraped again. """
+
+        Scraper(cache=self.cache).scrape(self.page)
+
+        class Scraper_(Scraper):
+            _BLUEPRINTS = dict(Scraper._BLUEPRINTS,
+                               itinerary=dict(km={'line_nb': 0, 'pattern': r'(\d{1,2}),', 'nullable': True}))
+
+        scraper = Scraper_(cache=self.cache)
+        with patch.object(Scraper_, '_scrape_fragments', wraps=scraper._scrape_fragments) as scrape:
+            serial_items = scraper.scrape(self.page)
+
+        self.assertEqual(scrape.call_args[0][2], ['itinerary'])
+        self.assertEqual(serial_items[0].data[0]['km'], '6')
+        self.assertEqual(serial_items[0].data[0]['client_id'], '30349')
@@ -0,0 +1,93 @@
+""" Unittest scripts for the federation module. """
+
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from os.path import join
+from datetime import datetime, date
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from m5.model import Base
+from m5.factory import Pusher
+from m5.federation import FederatedStats
+from m5.partitions import Partitions
+from m5.cache import GeocodeCache
+from m5.records import ClientRow, OrderRow
+from m5.utilities import Tables
+
+
+class TestFederatedStats(TestCase):
+
+    def setUp(self):
+        """ Two couriers, who both work for client 1. """
+
+        self.directory = mkdtemp()
+
+        self._database('m-134', [OrderRow(order_id=100, client_id=1, date=datetime(2014, 1, 5), city_tour=10.0),
+                                 OrderRow(order_id=101, client_id=2, date=datetime(2014, 2, 5), city_tour=30.0,
+                                          cash=True)])
+        self._database('m-135', [OrderRow(order_id=200, client_id=1, date=datetime(2014, 1, 6), city_tour=25.0,
+                                          cash=True),
+                                 OrderRow(order_id=201, client_id=1, date=datetime(2014, 3, 1), city_tour=5.0)])
+
+        # The shared geocode cache lives in the same folder
+        GeocodeCache(join(self.directory, 'geocode.sqlite')).close()
+
+        self.federation = FederatedStats.from_directory(self.directory)
+
+    def tearDown(self):
+        self.federation.close()
+        rmtree(self.directory)
+
+    def _database(self, username, orders, partitioned=None):
+        database = join(self.directory, username + '.sqlite')
+        engine = create_engine('sqlite:///%s' % database, echo=False)
+        Base.metadata.create_all(engine)
+
+        partitions = Partitions(database, join(self.directory, username), partitioned) if partitioned else None
+
+        clients = [ClientRow(client_id=1, name='A'), ClientRow(client_id=2, name='B')]
+        Pusher(sessionmaker(bind=engine)(), partitions=partitions).insert(Tables(clients, orders, [], []))
+        engine.dispose()
+
+    def testMonthlyTotals(self):
+        """ The months of both databases add up. """
+
+        self.assertEqual(list(self.federation.stats), ['m-134', 'm-135'])
+        self.assertEqual(self.federation.monthly_totals(),
+                         [('2014-01', 2, 35.0), ('2014-02', 1, 30.0), ('2014-03', 1, 5.0)])
+
+    def testTopClients(self):
+        """ A client's totals are merged across databases before ranking. """
+
+        # Client 2 is the best client of m-134, but client 1 is the best overall
+        self.assertEqual(self.federation.top_clients(n=1), [(1, 'A', 3, 40.0)])
+        self.assertEqual(len(self.federation.top_clients()), 2)
+
+    def testCashOrders(self):
+        """ The rows tell whose database they come from. """
+
+        self.assertEqual(self.federation.cash_orders(),
+                         [('m-135', 200, datetime(2014, 1, 6), 1), ('m-134', 101, datetime(2014, 2, 5), 2)])
+
+    def testPartitioned(self):
+        """ The orders of a partitioned user are read from the partitions. """
+
+        self._database('m-136', [OrderRow(order_id=300, client_id=2, date=datetime(2014, 2, 7), city_tour=20.0,
+                                          cash=True)], partitioned='quarter')
+
+        federation = FederatedStats.from_directory(self.directory)
+        try:
+            self.assertEqual(list(federation.stats), ['m-134', 'm-135', 'm-136'])
+            self.assertEqual(federation.monthly_totals(begin=date(2014, 2, 1)),
+                             [('2014-02', 2, 50.0), ('2014-03', 1, 5.0)])
+            self.assertEqual(federation.cash_orders()[-1], ('m-136', 300, datetime(2014, 2, 7), 2))
+
+            # The partitioned database is opened read-only too
+            with self.assertRaises(OperationalError):
+                with federation.stats['m-136'].partitions.engine.begin() as connection:
+                    connection.exec_driver_sql('DELETE FROM client')
+        finally:
+            federation.close()
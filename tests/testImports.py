@@ -0,0 +1,58 @@
+""" Import-time budget: commands that only read the local database must start fast. """
+
+from unittest import TestCase
+from subprocess import run
+from sys import executable
+from os.path import dirname, join, normpath
+
+
+# Microseconds, cumulative, measured with -X importtime. Generous on
+# purpose: it catches the network stack creeping back in, not jitter.
+BUDGET = 1500000
+
+ROOT = normpath(join(dirname(__file__), '..'))
+
+
+def import_times(module: str) -> dict:
+    """ Import a module in a fresh interpreter and return the cumulative import time of each module. """
+
+    result = run([executable, '-X', 'importtime', '-c', 'import ' + module],
+                 cwd=ROOT, capture_output=True, text=True, check=True)
+
+    times = dict()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+
+    return times
+
+
+class TestImportTime(TestCase):
+
+    def testStatistics(self):
+        """ Stats only need the model and SQLAlchemy. """
+
+        times = import_times('m5.statistics')
+
+        for heavy in ('requests', 'm5.transport', 'geopy', 'bs4', 'numpy', 'm5.factory'):
+            self.assertNotIn(heavy, times)
+        self.assertLess(times['m5.statistics'], BUDGET)
+
+    def testUser(self):
+        """ A local user doesn't need the network stack. """
+
+        times = import_times('m5.user')
+
+        self.assertNotIn('requests', times)
+        self.assertNotIn('numpy', times)
+        self.assertLess(times['m5.user'], BUDGET)
+
+    def testFactory(self):
+        """ Geocoding and html parsing are loaded on first use. """
+
+        times = import_times('m5.factory')
+
+        self.assertNotIn('geopy', times)
+        self.assertNotIn('bs4', times)
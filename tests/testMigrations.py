@@ -0,0 +1,97 @@
+""" Unittest scripts for the migrations module. """
+
+from unittest import TestCase
+from unittest.mock import patch
+from datetime import datetime, date
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine, text
+
+from m5.model import Base, Checkin, Checkpoint, Client, Order, Leg
+from m5.migrations import upgrade
+from m5.factory import Packager, Pusher
+from m5.utilities import Stamp, Stamped
+from m5.spatial import geohash
+
+
+class TestMigrations(TestCase):
+
+    def setUp(self):
+        """  A database with old-style checkin keys (timestamp hashes). """
+
+        self.engine = create_engine('sqlite://', echo=False)
+        Base.metadata.create_all(self.engine)
+        self.session = sessionmaker(bind=self.engine)()
+
+        first = datetime(2014, 1, 5, 9, 30)
+        second = datetime(2014, 1, 5, 9, 0)
+
+        self.session.add_all([Client(client_id=1, name='A'),
+                              Order(order_id=1412050834, client_id=1, date=datetime(2014, 1, 5)),
+                              Checkpoint(checkpoint_id='10', lat=52.5, lon=13.4),
+                              Checkin(checkin_id=hash(first), order_id=1412050834, checkpoint_id=10, timestamp=first),
+                              Checkin(checkin_id=hash(second), order_id=1412050834, checkpoint_id=10, timestamp=second),
+                              Leg(date=datetime(2014, 1, 5), sequence=1,
+                                  departure_id=hash(second), arrival_id=hash(first))])
+        self.session.commit()
+
+    def testRekey(self):
+        """ Checkins get order_id * 100 + rank as key, legs follow, and it only happens once. """
+
+        upgrade(self.engine)
+        upgrade(self.engine)
+
+        self.session.expire_all()
+        keys = self.session.query(Checkin.checkin_id, Checkin.timestamp).order_by(Checkin.checkin_id).all()
+        self.assertEqual(keys, [(141205083400, datetime(2014, 1, 5, 9, 0)),
+                                (141205083401, datetime(2014, 1, 5, 9, 30))])
+
+        leg = self.session.query(Leg).one()
+        self.assertEqual((leg.departure_id, leg.arrival_id), (141205083400, 141205083401))
+
+        with self.engine.connect() as connection:
+            self.assertEqual(connection.execute(text('PRAGMA user_version')).scalar(), 2)
+
+    def testRepush(self):
+        """ A migrated day pushed again keeps its checkins: both sides rank the same stops. """
+
+        addresses = [{'company': None, 'address': street, 'postal_code': None, 'after': None,
+                      'purpose': None, 'until': None, 'timestamp': t, 'city': None}
+                     for street, t in (('A', '11:00'), ('Nowhere', '11:30'), ('B', '12:00'))]
+        job_details = {'client_id': '1', 'client_name': 'A', 'order_id': '1412050835',
+                       'km': None, 'cash': None, 'city_tour': None, 'extra_stops': None, 'overnight': None,
+                       'fax_confirm': None, 'waiting_time': None, 'type': None}
+
+        def geocode(address):
+            if address['address'] == 'Nowhere':
+                return {'osm_id': None, 'lat': None, 'lon': None, 'display_name': None}
+            return {'osm_id': address['address'], 'lat': 52.5, 'lon': 13.4, 'display_name': address['address']}
+
+        with patch.object(Packager, 'geocode', side_effect=geocode):
+            serial_items = [Stamped(Stamp(date(2014, 1, 6), '1234568'), (job_details, addresses))]
+            tables = next(Packager().rows(serial_items))
+
+        # The day as the old scheme stored it
+        pusher = Pusher(self.session)
+        pusher.insert(tables._replace(checkins=[c._replace(checkin_id=hash(c.timestamp)) for c in tables.checkins]))
+        count = self.session.query(Checkin).count()
+
+        upgrade(self.engine)
+        pusher.insert(tables)
+
+        self.session.expire_all()
+        self.assertEqual(self.session.query(Checkin).count(), count)
+        self.assertEqual(self.session.query(Checkin.checkin_id).filter(Checkin.order_id == 1412050835).all(),
+                         [(141205083500,), (141205083501,)])
+
+    def testGeohashes(self):
+        """ The checkpoints that predate the geohash column get one, the others keep theirs. """
+
+        self.session.add(Checkpoint(checkpoint_id='11', lat=48.1, lon=11.6, geohash='u281z7j'))
+        self.session.commit()
+
+        upgrade(self.engine)
+
+        self.session.expire_all()
+        self.assertEqual(self.session.query(Checkpoint.checkpoint_id, Checkpoint.geohash)
+                         .order_by(Checkpoint.checkpoint_id).all(),
+                         [('10', geohash(52.5, 13.4)), ('11', 'u281z7j')])
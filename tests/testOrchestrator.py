@@ -0,0 +1,182 @@
+""" Unittest scripts for the orchestrator module and the shared geocode cache. """
+
+from unittest import TestCase
+from unittest.mock import patch
+from multiprocessing import Process
+from tempfile import mkdtemp
+from shutil import rmtree
+from os.path import join
+from datetime import date, datetime
+from time import time
+from types import SimpleNamespace
+from os import getpid
+from json import load
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from m5 import orchestrator
+from m5.orchestrator import Orchestrator, Migration, RateLimiter, Progress, Backfill, Shard, shards
+from m5.cache import GeocodeCache
+from m5.factory import Packager
+from m5.utilities import Stamp, Stamped, Tables
+from m5.model import Base, Order
+from m5.records import ClientRow, OrderRow
+
+
+def _hammer(limiter, n):
+    for _ in range(n):
+        limiter()
+
+
+def _fake_migrate(migration):
+    """ Pretend to migrate, one job a day, through the worker's shared state. """
+
+    days = (migration.end - migration.begin).days
+    for _ in range(days):
+        _worker()['limiter']()
+        _worker()['events'].put(('day', migration.username, 1, 0.01))
+
+    if migration.username == 'm-666':
+        raise RuntimeError('Wrong password')
+
+    return migration.username
+
+
+def _fake_package_shard(task):
+    """ One order a day, packaged in a worker process that must not be the writer. """
+
+    migration, shard, overwrite, downloads = task
+    days = (shard.end - shard.begin).days
+
+    orders = [OrderRow(order_id=getpid() * 1000 + shard.begin.toordinal() % 1000 + n, client_id=1,
+                       date=datetime.combine(shard.begin, datetime.min.time()))
+              for n in range(days)]
+
+    index = {'summaries': {str(shard.begin): 'digest'}}
+
+    return shard, [(1, 0.01)] * days, Tables([ClientRow(client_id=1, name='A')], orders, [], []), index
+
+
+def _worker():
+    return orchestrator._worker
+
+
+class TestRateLimiter(TestCase):
+
+    def testShared(self):
+        """ Two processes share one rate: 8 calls at 40/s take at least 7 intervals. """
+
+        limiter = RateLimiter(rate=40)
+        processes = [Process(target=_hammer, args=(limiter, 4)) for _ in range(2)]
+
+        start = time()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        self.assertGreaterEqual(time() - start, 7 / 40)
+
+
+class TestGeocodeCache(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def testOnce(self):
+        """ Each address is geocoded once, whoever asks for it. """
+
+        address = {'company': None, 'address': 'Oranienstr. 1', 'postal_code': '10999', 'after': None,
+                   'purpose': None, 'until': None, 'timestamp': '14:46', 'city': 'Berlin'}
+        job_details = {'client_id': '30349', 'client_name': 'Lisa D.', 'order_id': '1412050834',
+                       'km': None, 'cash': None, 'city_tour': None, 'extra_stops': None, 'overnight': None,
+                       'fax_confirm': None, 'waiting_time': None, 'type': None}
+        serial_items = [Stamped(Stamp(date(2014, 12, 5), '1234567'), (job_details, [address, address]))]
+
+        matched = {'osm_id': 42, 'lat': 52.5, 'lon': 13.4, 'display_name': 'Oranienstr.', 'place_id': 1}
+        filepath = join(self.directory, 'geocode.sqlite')
+
+        with patch.object(Packager, 'geocode', return_value=matched) as geocode:
+            Packager(geocache=GeocodeCache(filepath)).package(serial_items)
+            tables = Packager(geocache=GeocodeCache(filepath)).package(serial_items)
+
+        self.assertEqual(geocode.call_count, 1)
+        self.assertEqual(tables.checkpoints[0].checkpoint_id, 42)
+        self.assertEqual(GeocodeCache(filepath).get(address)['lat'], 52.5)
+
+
+class TestOrchestrator(TestCase):
+
+    def testRun(self):
+        """ Every user runs in its own process, failures are reported, not raised. """
+
+        migrations = [Migration('m-134', 'PASSWORD', date(2014, 12, 1), date(2014, 12, 4)),
+                      Migration('m-135', 'PASSWORD', date(2014, 12, 1), date(2014, 12, 3)),
+                      Migration('m-666', 'PASSWORD', date(2014, 12, 1), date(2014, 12, 2))]
+
+        with patch.object(orchestrator, '_migrate', _fake_migrate):
+            progress = Orchestrator(migrations, processes=2, rate=100).run(interval=0.1)
+
+        self.assertEqual((progress.days, progress.total, progress.jobs), (6, 6, 6))
+        self.assertIn('Wrong password', progress.users['m-666']['error'])
+        self.assertIsNone(progress.users['m-134']['error'])
+
+    def testProgress(self):
+        progress = Progress([Migration('m-134', None, date(2014, 12, 1), date(2014, 12, 11))])
+
+        progress.update(('day', 'm-134', 12, 3.0))
+        progress.update(('day', 'm-134', 8, 1.0))
+
+        self.assertEqual(progress.jobs, 20)
+        self.assertIn('m-134: 2/10 days, 20 jobs, 2.0s per day', progress.report())
+
+
+class TestBackfill(TestCase):
+
+    def testShards(self):
+        self.assertEqual(shards(date(2014, 1, 1), date(2014, 1, 17), size=7),
+                         [Shard(date(2014, 1, 1), date(2014, 1, 8)),
+                          Shard(date(2014, 1, 8), date(2014, 1, 15)),
+                          Shard(date(2014, 1, 15), date(2014, 1, 17))])
+        self.assertEqual(shards(date(2014, 1, 1), date(2014, 1, 1)), [])
+
+    def testSingleWriter(self):
+        """ The shards are packaged in other processes and written by this one. """
+
+        engine = create_engine('sqlite://', echo=False)
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+        downloads = mkdtemp()
+        user = SimpleNamespace(username='m-134', _password='PASSWORD', database_session=session,
+                               partitions=None, downloads=downloads)
+
+        with patch.object(orchestrator, '_package_shard', _fake_package_shard):
+            progress = Backfill(user, processes=2, size=3).run(date(2014, 1, 1), date(2014, 1, 11))
+
+        # The parent merged the index of every shard
+        with open(join(downloads, '.index.json')) as f:
+            self.assertEqual(sorted(load(f)['summaries']), ['2014-01-01', '2014-01-04', '2014-01-07', '2014-01-10'])
+        rmtree(downloads)
+
+        orders = session.query(Order).all()
+
+        self.assertEqual((progress.days, progress.jobs), (10, 10))
+        self.assertEqual(len(orders), 10)
+        self.assertNotIn(getpid(), {order.order_id // 1000 for order in orders})
+
+    def testOffline(self):
+        """ A worker only builds the remote session: it never opens the user's database. """
+
+        downloads = mkdtemp()
+        orchestrator._initialise(None, None, None)
+        task = (Migration('m-134', 'PASSWORD', date(2014, 1, 1), date(2014, 1, 1)),
+                Shard(date(2014, 1, 1), date(2014, 1, 1)), None, downloads)
+
+        with patch('m5.user.create_engine', side_effect=AssertionError('A worker opened the database')):
+            shard, jobs, tables, index = orchestrator._package_shard(task)
+
+        self.assertEqual((jobs, tables), ([], Tables([], [], [], [])))
+        rmtree(downloads)
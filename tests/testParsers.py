@@ -0,0 +1,25 @@
+""" Unittest scripts for the parsers module. """
+
+from unittest import TestCase
+from datetime import date, datetime
+
+from m5.parsers import clock, timestamp, decimal, decimals
+
+
+class TestParsers(TestCase):
+
+    def testTimestamp(self):
+        """ Same results as strptime, including empty values. """
+
+        self.assertEqual(timestamp(date(2014, 12, 5), '14:46'), datetime(2014, 12, 5, 14, 46))
+        self.assertEqual(timestamp(date(2014, 12, 5), '9:05'), datetime(2014, 12, 5, 9, 5))
+        self.assertIsNone(timestamp(date(2014, 12, 5), ''))
+        self.assertIsNone(timestamp(date(2014, 12, 5), None))
+        self.assertRaises(ValueError, clock, '1446')
+        self.assertRaises(ValueError, clock, '25:00')
+
+    def testDecimals(self):
+        """ German decimals, one at a time or in a batch. """
+
+        self.assertEqual(decimal('11,20'), 11.2)
+        self.assertEqual(decimals(['6,414', None, '', '3']), [6.414, None, None, 3.0])
@@ -0,0 +1,142 @@
+""" Unittest scripts for the partitions module. """
+
+from unittest import TestCase
+from unittest.mock import patch
+from tempfile import mkdtemp
+from shutil import rmtree
+from os.path import join
+from datetime import datetime, date
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from m5 import partitions as module
+from m5.model import Base, Order, Checkin, Checkpoint
+from m5.factory import Pusher
+from m5.partitions import Partitions, SealedPartition
+from m5.records import ClientRow, OrderRow, CheckpointRow, CheckinRow
+from m5.routes import Router
+from m5.snapshot import Snapshot
+from m5.statistics import Stats
+from m5.utilities import Tables, MAX_STOPS
+
+
+def _job(order_id, when, price=10.0):
+    """ One order with a pickup and a dropoff. """
+
+    return Tables([ClientRow(client_id=1, name='A')],
+                  [OrderRow(order_id=order_id, client_id=1, date=datetime.combine(when, datetime.min.time()),
+                            city_tour=price)],
+                  [CheckpointRow(checkpoint_id='10', lat=52.50, lon=13.30),
+                   CheckpointRow(checkpoint_id='11', lat=52.51, lon=13.31)],
+                  [CheckinRow(checkin_id=order_id * MAX_STOPS, checkpoint_id='10', order_id=order_id,
+                              timestamp=datetime.combine(when, datetime.min.time()).replace(hour=9),
+                              purpose='pickup'),
+                   CheckinRow(checkin_id=order_id * MAX_STOPS + 1, checkpoint_id='11', order_id=order_id,
+                              timestamp=datetime.combine(when, datetime.min.time()).replace(hour=10),
+                              purpose='dropoff')])
+
+
+class TestPartitions(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        database = join(self.directory, 'm-134.sqlite')
+
+        engine = create_engine('sqlite:///%s' % database, echo=False)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+        self.partitions = Partitions(database, join(self.directory, 'm-134'), period='quarter')
+        self.pusher = Pusher(self.session, partitions=self.partitions)
+
+        for order_id, when in ((1, date(2013, 12, 30)), (2, date(2014, 1, 2)), (3, date(2014, 5, 5))):
+            self.pusher.insert(_job(order_id, when))
+
+    def tearDown(self):
+        for key in self.partitions.keys():
+            self.partitions.unseal(key)
+        rmtree(self.directory)
+
+    def testRouting(self):
+        """ Orders and checkins go into the partition of their date, the rest stays in the main database. """
+
+        self.assertEqual(self.partitions.keys(), ['2013q4', '2014q1', '2014q2'])
+        self.assertEqual(self.partitions.keys(date(2014, 1, 1), date(2014, 3, 31)), ['2014q1'])
+        self.assertEqual(self.partitions.span('2014q4'), (date(2014, 10, 1), date(2015, 1, 1)))
+
+        self.assertEqual(self.session.query(Order).count(), 0)
+        self.assertEqual(self.session.execute(func.count().select().select_from(Base.metadata.tables['client']))
+                         .scalar(), 1)
+
+        with self.partitions.session(date(2014, 1, 1), date(2014, 3, 31)) as session:
+            self.assertEqual([order.order_id for order in session.query(Order)], [2])
+
+        with self.partitions.session() as session:
+            self.assertEqual(session.query(Checkin).count(), 6)
+
+    def testQueries(self):
+        """ The Stats and the Router read through the partitions of their date range. """
+
+        stats = Stats(self.session, partitions=self.partitions)
+        self.assertEqual(stats.monthly_totals(), [('2013-12', 1, 10.0), ('2014-01', 1, 10.0), ('2014-05', 1, 10.0)])
+        self.assertEqual(stats.monthly_totals(begin=date(2014, 1, 1)), [('2014-01', 1, 10.0), ('2014-05', 1, 10.0)])
+        self.assertEqual(stats.top_clients(), [(1, 'A', 3, 30.0)])
+
+        router = Router(self.session, partitions=self.partitions)
+        self.assertEqual(router.update(date(2014, 1, 2)), 1)
+
+    def testManyPartitions(self):
+        """ More partitions than SQLite attaches at once are read chunk by chunk and merged. """
+
+        with patch.object(module, 'MAX_ATTACHED', 2):
+            self.pusher.insert(_job(4, date(2014, 8, 8), price=5.0))
+            self.assertEqual(len(list(self.partitions.sessions())), 4)
+
+            with self.assertRaises(AssertionError):
+                with self.partitions.session():
+                    pass
+
+            stats = Stats(self.session, partitions=self.partitions)
+            self.assertEqual(stats.monthly_totals(), [('2013-12', 1, 10.0), ('2014-01', 1, 10.0),
+                                                      ('2014-05', 1, 10.0), ('2014-08', 1, 5.0)])
+            self.assertEqual(stats.top_clients(), [(1, 'A', 4, 35.0)])
+
+            router = Router(self.session, partitions=self.partitions)
+            self.assertEqual(router.update(date(2013, 12, 30), date(2014, 8, 8)), 4)
+
+    def testRepush(self):
+        """ Rows pushed before partitioning move out of the main tables when pushed again. """
+
+        Pusher(self.session).insert(_job(5, date(2014, 2, 2)))
+        self.assertEqual(self.session.query(Order).count(), 1)
+        self.assertEqual(Stats(self.session, partitions=self.partitions).monthly_totals(begin=date(2014, 2, 1)),
+                         [('2014-02', 1, 10.0), ('2014-05', 1, 10.0)])
+
+        self.pusher.insert(_job(5, date(2014, 2, 2)))
+        self.assertEqual(self.session.query(Order).count(), 0)
+        self.assertEqual(self.session.query(Checkin).count(), 0)
+        self.assertEqual(Stats(self.session, partitions=self.partitions).monthly_totals(begin=date(2014, 2, 1)),
+                         [('2014-02', 1, 10.0), ('2014-05', 1, 10.0)])
+
+    def testSealed(self):
+        """ A sealed partition is still read, but refuses writes. """
+
+        self.partitions.seal('2013q4')
+        self.assertTrue(self.partitions.is_sealed('2013q4'))
+
+        with self.assertRaises(SealedPartition):
+            self.pusher.insert(_job(1, date(2013, 12, 30), price=99.0))
+
+        stats = Stats(self.session, partitions=self.partitions)
+        self.assertEqual(stats.monthly_totals(end=date(2013, 12, 31)), [('2013-12', 1, 10.0)])
+
+    def testSnapshot(self):
+        """ The snapshot exports the months of every partition. """
+
+        snapshot = Snapshot(self.session, join(self.directory, 'snapshot'), partitions=self.partitions)
+
+        self.assertEqual(snapshot.export(until=date(2014, 6, 1)),
+                         ['2013-12', '2014-01', '2014-02', '2014-03', '2014-04', '2014-05'])
+        self.assertEqual(list(snapshot.load(Order)['order_id']), [1, 2, 3])
+        self.assertEqual(len(snapshot.load(Checkin)['checkin_id']), 6)
+        self.assertEqual(len(snapshot.load(Checkpoint)['checkpoint_id']), 2)
@@ -0,0 +1,112 @@
+""" Unittest scripts for the planner module. """
+
+from unittest import TestCase
+from tempfile import mkdtemp
+from shutil import rmtree
+from threading import Lock, get_ident
+from time import sleep
+from datetime import date, datetime
+
+from m5.factory import Miner
+from m5.planner import CrawlPlanner
+
+
+class FakeServer():
+    """ Two jobs on weekdays, none on weekends. Slow, so that parallelism shows. """
+
+    def __init__(self):
+        self.requests = list()
+        self.threads = set()
+        self._lock = Lock()
+
+    def get(self, url, params=None, headers=None):
+        with self._lock:
+            self.requests.append((url, params['datum']))
+            self.threads.add(get_ident())
+        sleep(0.01)
+
+        day = datetime.strptime(params['datum'], '%d.%m.%Y').date()
+
+        class Response():
+            status_code = 200
+            headers = dict()
+
+        response = Response()
+        if url.endswith('ll.php5'):
+            jobs = [] if day.weekday() >= 5 else ['%07d' % (day.toordinal() % 10 ** 6 * 10 + n) for n in range(2)]
+            # The same job is listed twice
+            response.text = '\n'.join('<a href="ll_detail.php5?uuid=%s">Job</a>' % uuid for uuid in jobs + jobs)
+        else:
+            response.text = '<html><body>Job %s</body></html>' % params['uuid']
+
+        response.content = response.text.encode('utf-8')
+        return response
+
+
+class TestCrawlPlanner(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.server = FakeServer()
+
+        # Monday 1st to Monday 15th of December 2014 (excluded): two weekends
+        self.begin, self.end = date(2014, 12, 1), date(2014, 12, 15)
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def _summaries(self) -> int:
+        return len([url for url, _ in self.server.requests if url.endswith('ll.php5')])
+
+    def testPlan(self):
+        """ One deduplicated work list, and the empty days are never asked for again. """
+
+        planner = CrawlPlanner(Miner(self.server, self.directory), workers=4)
+        work = planner.plan(self.begin, self.end)
+
+        self.assertEqual(len(work), 10 * 2)
+        self.assertEqual(work, sorted(set(work)))
+        self.assertEqual(self._summaries(), 14)
+        self.assertGreater(len(self.server.threads), 1)
+
+        planner = CrawlPlanner(Miner(self.server, self.directory), workers=4)
+        planner.plan(self.begin, self.end)
+
+        self.assertEqual(planner.empty, 4)
+        self.assertEqual(self._summaries(), 14 + 10)
+
+    def testDownload(self):
+        """ The jobs are downloaded once, then the Miner serves them without asking the server. """
+
+        miner = Miner(self.server, self.directory)
+        planner = CrawlPlanner(miner, workers=4)
+
+        work = planner.plan(self.begin, self.end)
+        self.assertEqual(planner.download(work), 20)
+        self.assertEqual(planner.download(work), 0)
+
+        requests = len(self.server.requests)
+        days = planner.days(work)
+
+        soups = list(miner.stream(date(2014, 12, 2), uuids=days[date(2014, 12, 2)]))
+
+        self.assertEqual(len(soups), 2)
+        self.assertEqual(len(self.server.requests), requests)
+        self.assertNotIn(date(2014, 12, 6), days)
+        self.assertTrue(miner.is_empty(date(2014, 12, 6)))
+
+    def testFresh(self):
+        """ Even when overwriting, the pages the planner has just downloaded aren't asked for again. """
+
+        miner = Miner(self.server, self.directory, overwrite=True)
+        planner = CrawlPlanner(miner, workers=4)
+
+        work = planner.plan(self.begin, self.end)
+        planner.download(work)
+        requests = len(self.server.requests)
+
+        day = date(2014, 12, 2)
+        soups = list(miner.stream(day, uuids=planner.days(work)[day], fresh=set(work)))
+
+        self.assertEqual(len(soups), 2)
+        self.assertEqual(len(self.server.requests), requests)
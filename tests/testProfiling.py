@@ -0,0 +1,116 @@
+""" Unittest scripts for the profiling module. """
+
+from unittest import TestCase
+from unittest.mock import patch
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import listdir
+from os.path import join
+from contextlib import redirect_stdout
+from io import StringIO
+from cProfile import Profile
+from pstats import Stats
+import tracemalloc
+
+from m5.profiling import StageProfiler, collapse
+
+
+def _busy(n):
+    return sum(i * i for i in range(n))
+
+
+class _Upstream():
+    def stream(self):
+        for n in range(5):
+            _busy(20000)
+            yield n
+
+
+class _Downstream():
+    def stream(self, items):
+        for n in items:
+            # Kept across calls, so that the allocations show
+            yield [str(i) for i in range(1000 + n)]
+
+
+class TestStageProfiler(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.directory)
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def _run(self, profiler):
+        upstream = profiler.iterate('miner', _Upstream().stream())
+        downstream = profiler.iterate('scraper', _Downstream().stream(upstream))
+        return list(downstream)
+
+    def testExclusive(self):
+        """ A stage's statistics leave out the stage it pulls from. """
+
+        profiler = StageProfiler(('miner', 'scraper'), self.directory)
+        self.assertEqual(len(self._run(profiler)), 5)
+
+        functions = {stage: {name for _, _, name in Stats(profile).stats}
+                     for stage, profile in profiler.profiles.items()}
+
+        self.assertIn('_busy', functions['miner'])
+        self.assertNotIn('_busy', functions['scraper'])
+        self.assertIn('<listcomp>', functions['scraper'])
+        self.assertEqual(profiler.calls['miner'], 6)
+
+    def testFiles(self):
+        """ Each profiled stage gets readable pstats, collapsed stacks and a memory report. """
+
+        profiler = StageProfiler(('scraper',), self.directory, memory=True)
+        profiler.bind(scraper=_Downstream())
+        self._run(profiler)
+
+        with redirect_stdout(StringIO()):
+            run = profiler.save()
+
+        self.assertEqual(sorted(listdir(run)), ['scraper.collapsed', 'scraper.memory', 'scraper.pstats'])
+
+        Stats(join(run, 'scraper.pstats'))
+
+        with open(join(run, 'scraper.collapsed')) as f:
+            for line in f:
+                stack, weight = line.rsplit(' ', 1)
+                self.assertTrue(int(weight) > 0)
+
+        with open(join(run, 'scraper.memory')) as f:
+            report = f.read()
+        self.assertTrue(report.startswith('Peak: '))
+        self.assertIn('testProfiling.py', report)
+
+    def testEnvironment(self):
+        """ No variable, no profiler. """
+
+        with patch.dict('os.environ', {}, clear=True):
+            self.assertIsNone(StageProfiler.from_environment(self.directory))
+
+        with patch.dict('os.environ', {'M5_PROFILE': 'scraper, pusher', 'M5_PROFILE_DIR': '/tmp/m5'}):
+            profiler = StageProfiler.from_environment(self.directory)
+
+        self.assertEqual(profiler.stages, ('scraper', 'pusher'))
+        self.assertFalse(profiler.memory)
+        self.assertTrue(profiler.directory.startswith('/tmp/m5/'))
+
+
+class TestCollapse(TestCase):
+
+    def testStacks(self):
+        """ The time of each function ends up below its callers. """
+
+        profile = Profile()
+        profile.enable()
+        _busy(200000)
+        profile.disable()
+
+        stacks = collapse(Stats(profile))
+
+        self.assertTrue(any(path[-1].startswith('<genexpr>') and any(p.startswith('_busy') for p in path)
+                            for path in stacks))
@@ -0,0 +1,46 @@
+""" Unittest scripts for the records module. """
+
+from unittest import TestCase
+from datetime import datetime
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+
+from m5.model import Base, Checkin, Checkpoint, Order
+from m5.records import Job, Address, ClientRow, OrderRow, CheckpointRow, CheckinRow
+from m5.factory import Pusher
+from m5.utilities import Tables
+
+
+class TestRecords(TestCase):
+
+    def testRecord(self):
+        """ Records read like dictionaries and ignore unknown fields. """
+
+        job = Job(order_id='1412050834', client_name='Lisa D. Productions', Stadtkurier='11,20')
+
+        self.assertEqual(job['order_id'], '1412050834')
+        self.assertIsNone(job['km'])
+        self.assertRaises(KeyError, job.__getitem__, 'Stadtkurier')
+        self.assertFalse(hasattr(job, '__dict__'))
+        self.assertEqual(Address(city='Berlin'), Address(**Address(city='Berlin').as_dict()))
+
+    def testInsert(self):
+        """ Rows go in at the Core level, twice without conflict, and incomplete rows are dropped. """
+
+        engine = create_engine('sqlite://', echo=False)
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+
+        tables = Tables([ClientRow(client_id=1, name='A')],
+                        [OrderRow(order_id=100, client_id=1, date=datetime(2014, 1, 5))],
+                        [CheckpointRow(checkpoint_id='10', lat=52.5, lon=13.4), CheckpointRow(checkpoint_id='11')],
+                        [CheckinRow(checkin_id=1, order_id=100, checkpoint_id=10,
+                                    timestamp=datetime(2014, 1, 5, 9, 0))])
+
+        pusher = Pusher(session)
+        self.assertEqual(pusher.insert(tables), {datetime(2014, 1, 5).date()})
+        pusher.insert(tables)
+
+        self.assertEqual(session.query(Order).count(), 1)
+        self.assertEqual(session.query(Checkin).count(), 1)
+        self.assertEqual(session.query(Checkpoint.checkpoint_id).all(), [('10',)])
@@ -0,0 +1,56 @@
+""" Unittest scripts for the routes module. """
+
+from unittest import TestCase
+from datetime import datetime, date
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+
+from m5.model import Checkin, Checkpoint, Client, Order, Leg, Base
+from m5.routes import Router
+
+
+class TestRouter(TestCase):
+
+    def setUp(self):
+        """  Two days of checkins: three stops on the first day, one on the second. """
+
+        engine = create_engine('sqlite://', echo=False)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+        self.session.add_all([Client(client_id=1, name='A'),
+                              Order(order_id=100, client_id=1, date=datetime(2014, 1, 5)),
+                              Checkpoint(checkpoint_id='10', lat=52.50, lon=13.40),
+                              Checkpoint(checkpoint_id='11', lat=52.51, lon=13.40)])
+        self.session.add_all([Checkin(checkin_id=1, order_id=100, checkpoint_id=10,
+                                      timestamp=datetime(2014, 1, 5, 9, 0)),
+                              Checkin(checkin_id=2, order_id=100, checkpoint_id=11,
+                                      timestamp=datetime(2014, 1, 5, 9, 6)),
+                              Checkin(checkin_id=3, order_id=100, checkpoint_id=11,
+                                      timestamp=datetime(2014, 1, 5, 10, 0)),
+                              Checkin(checkin_id=4, order_id=100, checkpoint_id=10,
+                                      timestamp=datetime(2014, 1, 6, 9, 0))])
+        self.session.commit()
+
+        self.router = Router(self.session)
+
+    def testRoute(self):
+        """ Legs don't cross midnight and carry distance, speed and idle time. """
+
+        legs = self.router.route(date(2014, 1, 5), date(2014, 1, 6))
+        self.assertEqual(len(legs), 2)
+
+        first, second = legs
+        self.assertEqual([first['sequence'], second['sequence']], [1, 2])
+        self.assertAlmostEqual(first['distance'], 1112, delta=2)
+        self.assertAlmostEqual(first['speed'], 11.1, delta=0.1)
+        self.assertAlmostEqual(first['idle'], 360 - first['distance'] / (15 / 3.6))
+        self.assertEqual(second['distance'], 0)
+        self.assertEqual(second['idle'], 3240)
+
+    def testUpdate(self):
+        """ Updating a day twice replaces its legs instead of duplicating them. """
+
+        self.assertEqual(self.router.update(date(2014, 1, 5)), 2)
+        self.assertEqual(self.router.update(date(2014, 1, 5)), 2)
+        self.assertEqual(self.session.query(Leg).count(), 2)
@@ -0,0 +1,67 @@
+""" Unittest scripts for the snapshot module. """
+
+from unittest import TestCase
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+from tempfile import mkdtemp
+from shutil import rmtree
+from datetime import datetime, date
+from os.path import join
+from numpy import memmap
+
+from m5.model import Checkin, Checkpoint, Client, Order, Base
+from m5.snapshot import Snapshot, NULL_INT
+
+
+class TestSnapshot(TestCase):
+
+    def setUp(self):
+        """  Set up a temporary database with two months of data. """
+
+        self.directory = mkdtemp()
+        engine = create_engine('sqlite:///%s' % join(self.directory, 'db.sqlite'), echo=False)
+        Base.metadata.create_all(engine)
+
+        self.session = sessionmaker(bind=engine)()
+
+        self.session.add_all([Client(client_id=1, name='A'),
+                              Client(client_id=2, name='B'),
+                              Checkpoint(checkpoint_id='10', lat=52.5, lon=13.4)])
+        self.session.add_all([Order(order_id=100, client_id=1, date=datetime(2014, 1, 5), cash=True),
+                              Order(order_id=101, client_id=2, date=datetime(2014, 2, 5))])
+        self.session.add_all([Checkin(checkin_id=1000, order_id=100, checkpoint_id=10,
+                                      timestamp=datetime(2014, 1, 5, 9, 30)),
+                              Checkin(checkin_id=1001, order_id=101, checkpoint_id=10,
+                                      timestamp=datetime(2014, 2, 5, 10, 0))])
+        self.session.commit()
+
+        self.snapshot = Snapshot(self.session, join(self.directory, 'snapshot'))
+
+    def tearDown(self):
+        """  Delete the temporary files. """
+        self.session.close()
+        rmtree(self.directory)
+
+    def testExport(self):
+        """ Only complete months are exported and dimension rows are not duplicated. """
+
+        self.assertEqual(self.snapshot.export(until=date(2014, 2, 20)), ['2014-01'])
+        self.assertEqual(self.snapshot.export(until=date(2014, 3, 1)), ['2014-02'])
+        self.assertEqual(self.snapshot.export(until=date(2014, 3, 1)), [])
+
+        self.assertEqual(self.snapshot.months(Order), ['2014-01', '2014-02'])
+        self.assertEqual(len(self.snapshot.load(Checkpoint)['checkpoint_id']), 1)
+        self.assertEqual(list(self.snapshot.load(Client)['client_id']), [1, 2])
+
+    def testLoad(self):
+        """ A single month is memory-mapped and missing values use sentinels. """
+
+        self.snapshot.export(until=date(2014, 3, 1))
+
+        january = self.snapshot.load(Order, ['2014-01'])
+        self.assertIsInstance(january['order_id'], memmap)
+        self.assertEqual(list(january['order_id']), [100])
+        self.assertEqual(list(january['uuid']), [NULL_INT])
+
+        checkins = self.snapshot.load(Checkin)
+        self.assertEqual(str(checkins['timestamp'][1]), '2014-02-05T10:00')
@@ -0,0 +1,94 @@
+""" Unittest scripts for the spatial module. """
+
+from unittest import TestCase
+from random import seed, uniform
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+
+from m5.model import Checkpoint, Base
+from m5.spatial import SpatialIndex, geohash, haversine, neighbourhood
+
+
+class TestSpatial(TestCase):
+
+    def setUp(self):
+        """  Scatter random checkpoints over Berlin. """
+
+        seed(134)
+        self.points = {str(i): (uniform(52.40, 52.60), uniform(13.20, 13.60)) for i in range(2000)}
+
+        self.index = SpatialIndex(cell_size=500)
+        for checkpoint_id, (lat, lon) in self.points.items():
+            self.index.add(checkpoint_id, lat, lon)
+
+    def _brute_force(self, lat, lon):
+        return sorted((haversine(lat, lon, a, b), c) for c, (a, b) in self.points.items())
+
+    def testGeohash(self):
+        """ The reference example from the geohash literature. """
+        self.assertEqual(geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertIsNone(geohash(None, 13.4))
+
+    def testRadius(self):
+        """ The radius query agrees with a full scan. """
+
+        lat, lon = 52.52, 13.40
+        expected = [c for d, c in self._brute_force(lat, lon) if d <= 800]
+        found = [c for c, d in self.index.radius(lat, lon, 800)]
+
+        self.assertEqual(found, expected)
+
+    def testNearest(self):
+        """ The k-nearest query agrees with a full scan, even far from any point. """
+
+        for lat, lon in [(52.52, 13.40), (52.30, 13.00)]:
+            expected = [c for d, c in self._brute_force(lat, lon)[:5]]
+            found = [c for c, d in self.index.nearest(lat, lon, k=5)]
+            self.assertEqual(found, expected)
+
+    def testNearestRings(self):
+        """ The ring search stops early without missing a closer point, at any k and latitude. """
+
+        for n in range(20):
+            lat, lon = uniform(52.35, 52.65), uniform(13.15, 13.65)
+            k = 1 + n * 7
+            expected = [c for d, c in self._brute_force(lat, lon)[:k]]
+            self.assertEqual([c for c, d in self.index.nearest(lat, lon, k=k)], expected)
+
+        # Cells get narrow in meters up north
+        index = SpatialIndex(cell_size=500)
+        points = {str(i): (uniform(69.5, 70.5), uniform(18.0, 20.0)) for i in range(500)}
+        for checkpoint_id, (lat, lon) in points.items():
+            index.add(checkpoint_id, lat, lon)
+
+        expected = sorted((haversine(70.0, 19.0, a, b), c) for c, (a, b) in points.items())[:10]
+        self.assertEqual([c for c, d in index.nearest(70.0, 19.0, k=10)], [c for d, c in expected])
+
+    def testBoundingBox(self):
+        """ Points move cells when they are added again. """
+
+        self.index.add('moved', 52.0, 13.0)
+        self.index.add('moved', 52.5, 13.3)
+
+        self.assertNotIn('moved', self.index.bbox(51.9, 12.9, 52.1, 13.1))
+        self.assertIn('moved', self.index.bbox(52.49, 13.29, 52.51, 13.31))
+
+    def testUpdate(self):
+        """ The index picks up new database rows incrementally. """
+
+        engine = create_engine('sqlite://', echo=False)
+        Base.metadata.create_all(engine)
+        session = sessionmaker(bind=engine)()
+
+        session.add(Checkpoint(checkpoint_id='1', lat=52.52, lon=13.40, geohash=geohash(52.52, 13.40)))
+        session.commit()
+
+        index = SpatialIndex()
+        self.assertEqual(index.update(session), 1)
+
+        session.add(Checkpoint(checkpoint_id='2', lat=52.521, lon=13.401, geohash=geohash(52.521, 13.401)))
+        session.commit()
+
+        self.assertEqual(index.update(session), 1)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(neighbourhood(session, 52.52, 13.40, precision=5).count(), 2)
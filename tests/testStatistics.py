@@ -0,0 +1,105 @@
+""" Unittest scripts for the statistics module. """
+
+from unittest import TestCase
+from datetime import datetime, date
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy import create_engine
+
+from m5.model import Checkin, Checkpoint, Client, Order, Base
+from m5.statistics import Stats
+from m5.factory import Pusher
+from m5.cache import QueryCache
+from m5.utilities import Tables
+
+
+class TestDensity(TestCase):
+
+    def setUp(self):
+        """  Set up an in-memory database with a handful of checkins. """
+
+        engine = create_engine('sqlite://', echo=False)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+        self.session.add_all([Client(client_id=1, name='A'),
+                              Client(client_id=2, name='B'),
+                              Checkpoint(checkpoint_id='10', lat=52.50, lon=13.30),
+                              Checkpoint(checkpoint_id='11', lat=52.60, lon=13.50),
+                              Order(order_id=100, client_id=1, date=datetime(2014, 1, 5)),
+                              Order(order_id=101, client_id=2, date=datetime(2014, 2, 5))])
+        self.session.add_all([Checkin(checkin_id=1, order_id=100, checkpoint_id=10, purpose='pickup',
+                                      timestamp=datetime(2014, 1, 5, 9, 0)),
+                              Checkin(checkin_id=2, order_id=100, checkpoint_id=11, purpose='dropoff',
+                                      timestamp=datetime(2014, 1, 5, 9, 30)),
+                              Checkin(checkin_id=3, order_id=101, checkpoint_id=11, purpose='pickup',
+                                      timestamp=datetime(2014, 2, 5, 10, 0))])
+        self.session.commit()
+
+        self.stats = Stats(self.session)
+        self.bounds = (52.4, 13.2, 52.7, 13.6)
+
+    def testFilters(self):
+        """ Each filter narrows down the counted checkins. """
+
+        self.assertEqual(self.stats.density(bounds=self.bounds).counts.sum(), 3)
+        self.assertEqual(self.stats.density(purpose='pickup', bounds=self.bounds).counts.sum(), 2)
+        self.assertEqual(self.stats.density(client_id=2, bounds=self.bounds).counts.sum(), 1)
+        self.assertEqual(self.stats.density(begin=date(2014, 1, 5), end=date(2014, 1, 5),
+                                            bounds=self.bounds).counts.sum(), 2)
+
+    def testCache(self):
+        """ The same parameters return the cached grid until it's cleared. """
+
+        grid = self.stats.density(bins=(10, 10))
+        self.assertEqual(grid.counts.shape, (10, 10))
+        self.assertIs(self.stats.density(bins=(10, 10)), grid)
+
+        self.stats.clear()
+        self.assertIsNot(self.stats.density(bins=(10, 10)), grid)
+
+    def testEmpty(self):
+        """ No matching checkins make an empty grid, not an error. """
+        self.assertEqual(self.stats.density(client_id=999).counts.sum(), 0)
+
+
+class TestQueries(TestCase):
+
+    def setUp(self):
+        """  Set up an in-memory database with two months of orders. """
+
+        engine = create_engine('sqlite://', echo=False)
+        Base.metadata.create_all(engine)
+        self.session = sessionmaker(bind=engine)()
+
+        self.session.add_all([Client(client_id=1, name='A'),
+                              Client(client_id=2, name='B'),
+                              Order(order_id=100, client_id=1, date=datetime(2014, 1, 5), city_tour=10, cash=True),
+                              Order(order_id=101, client_id=2, date=datetime(2014, 1, 6), city_tour=20),
+                              Order(order_id=102, client_id=2, date=datetime(2014, 2, 5), city_tour=5,
+                                    waiting_time=None)])
+        self.session.commit()
+
+        self.cache = QueryCache()
+        self.stats = Stats(self.session, cache=self.cache)
+
+    def testQueries(self):
+        """ Missing prices count as zero. """
+
+        self.assertEqual(self.stats.monthly_totals(), [('2014-01', 2, 30), ('2014-02', 1, 5)])
+        self.assertEqual(self.stats.top_clients(n=1), [(2, 'B', 2, 25)])
+        self.assertEqual([row[0] for row in self.stats.cash_orders()], [100])
+
+    def testInvalidationOnPush(self):
+        """ A push drops the results that depend on the days it touched, and only those. """
+
+        january = self.stats.monthly_totals(date(2014, 1, 1), date(2014, 1, 31))
+        february = self.stats.monthly_totals(date(2014, 2, 1), date(2014, 2, 28))
+
+        pusher = Pusher(self.session, cache=self.cache)
+        days = pusher.push(Tables([], [Order(order_id=103, client_id=1, date=datetime(2014, 2, 6), city_tour=7)],
+                                  [], []))
+
+        self.assertEqual(days, {date(2014, 2, 6)})
+        self.assertIs(self.stats.monthly_totals(date(2014, 1, 1), date(2014, 1, 31)), january)
+        self.assertEqual(self.stats.monthly_totals(date(2014, 2, 1), date(2014, 2, 28)), [('2014-02', 2, 12)])
+        self.assertNotEqual(february, [('2014-02', 2, 12)])
@@ -0,0 +1,245 @@
+""" Unittest scripts for the transport module, against a local web server. """
+
+from unittest import TestCase
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from threading import Thread
+from time import sleep
+from tempfile import mkdtemp
+from shutil import rmtree
+from os import stat
+from os.path import join
+
+from m5.transport import RemoteSession, AdaptiveLimiter
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """ Fails the first requests with a 503, then serves the login form until logged in. """
+
+    failures = 0
+    logged_in = False
+    token = None
+    requests = list()
+
+    def do_GET(self):
+        _Handler.requests.append((self.path, self.headers.get('Accept-Encoding')))
+
+        cookie = 'session=%s' % _Handler.token
+        if _Handler.failures:
+            _Handler.failures -= 1
+            self._reply(503, 'Busy')
+        elif not _Handler.logged_in and cookie not in (self.headers.get('Cookie') or ''):
+            self._reply(200, '<input name="password">')
+        else:
+            self._reply(200, 'Jobs')
+
+    def do_POST(self):
+        _Handler.requests.append((self.path, None))
+        _Handler.token = str(len(_Handler.requests))
+        self._reply(200, 'Welcome', cookie='session=%s; Path=/' % _Handler.token)
+
+    def _reply(self, status, body, cookie=None):
+        self.send_response(status)
+        if cookie:
+            self.send_header('Set-Cookie', cookie)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode('utf-8'))
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRemoteSession(TestCase):
+
+    def setUp(self):
+        _Handler.failures = 0
+        _Handler.logged_in = False
+        _Handler.token = None
+        _Handler.requests = list()
+        self.directory = mkdtemp()
+
+        self.server = HTTPServer(('127.0.0.1', 0), _Handler)
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:%d/' % self.server.server_port
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        rmtree(self.directory)
+
+    def _session(self, retries=3, cookie_file=None, login=True, limiter=None):
+        session = RemoteSession(retries=retries, backoff=0.01, timeout=2, cookie_file=cookie_file,
+                                expired=lambda response: 'name="password"' in response.text,
+                                limiter=limiter)
+        if login:
+            session.login = lambda: session.post(self.url + 'login', {'password': 'PASSWORD'})
+        return session
+
+    def testRetries(self):
+        """ Server errors are retried and compression is requested. """
+
+        _Handler.failures = 2
+        _Handler.logged_in = True
+
+        response = self._session(login=False).get(self.url + 'jobs')
+
+        self.assertEqual(response.text, 'Jobs')
+        self.assertEqual(len(_Handler.requests), 3)
+        self.assertIn('gzip', _Handler.requests[0][1])
+
+    def testBoundedRetries(self):
+        """ After the last retry, the error is handed back instead of retrying forever. """
+
+        _Handler.failures = 10
+        response = self._session(retries=2, login=False).get(self.url + 'jobs')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(_Handler.requests), 3)
+
+    def testRelogin(self):
+        """ An expired session logs in again and repeats the request. """
+
+        session = self._session()
+        session.get(self.url + 'jobs')
+
+        # The server forgets us
+        _Handler.token = 'expired'
+        response = session.get(self.url + 'jobs')
+
+        self.assertEqual(response.text, 'Jobs')
+        self.assertEqual(session.relogins, 1)
+
+    def testConcurrentRelogin(self):
+        """ When the session expires under several threads, one logs in and the others wait for it. """
+
+        session = self._session()
+        login = session.login
+
+        def slow_login():
+            sleep(0.2)
+            login()
+
+        session.login = slow_login
+        session.get(self.url + 'jobs')
+
+        _Handler.token = 'expired'
+        responses = list()
+
+        threads = [Thread(target=lambda: responses.append(session.get(self.url + 'jobs').text)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=10)
+
+        self.assertEqual(responses, ['Jobs'] * 8)
+        self.assertEqual((session.logins, session.relogins), (2, 1))
+
+    def testLazyLogin(self):
+        """ Nothing is sent until a request is made, which logs in first. """
+
+        session = self._session()
+        self.assertEqual(_Handler.requests, [])
+
+        response = session.get(self.url + 'jobs')
+
+        self.assertEqual(response.text, 'Jobs')
+        self.assertEqual([path for path, _ in _Handler.requests], ['/login', '/jobs'])
+        self.assertEqual((session.logins, session.relogins), (1, 0))
+
+    def testPersistedCookies(self):
+        """ The next run re-uses the saved cookies without logging in, privately. """
+
+        cookie_file = join(self.directory, 'sessions', 'm-134.json')
+
+        first = self._session(cookie_file=cookie_file)
+        first.get(self.url + 'jobs')
+        first.close()
+
+        self.assertEqual(stat(cookie_file).st_mode & 0o777, 0o600)
+
+        second = self._session(cookie_file=cookie_file)
+        response = second.get(self.url + 'jobs')
+
+        self.assertEqual(response.text, 'Jobs')
+        self.assertEqual(second.logins, 0)
+
+        # Stale cookies are only detected on use
+        _Handler.token = 'expired'
+        third = self._session(cookie_file=cookie_file)
+        self.assertEqual(third.get(self.url + 'jobs').text, 'Jobs')
+        self.assertEqual(third.relogins, 1)
+
+    def testLimitedSession(self):
+        """ Each request goes through the limiter, which backs off on server errors. """
+
+        _Handler.failures = 10
+        limiter = AdaptiveLimiter(initial=4)
+        session = self._session(retries=0, login=False, limiter=limiter)
+
+        self.assertEqual(session.get(self.url + 'jobs').status_code, 503)
+        self.assertEqual(limiter.metrics()['errors'], 1)
+        self.assertEqual(limiter.limit, 2)
+        self.assertEqual(limiter.in_flight, 0)
+
+
+class TestAdaptiveLimiter(TestCase):
+
+    @staticmethod
+    def _round_trip(limiter, ok=True, latency=0.0):
+        start = limiter.acquire()
+        limiter.release(start - latency, ok)
+
+    def testIncrease(self):
+        """ The limit grows by about one per window of successful requests, up to the maximum. """
+
+        limiter = AdaptiveLimiter(initial=2, maximum=4)
+
+        for _ in range(2):
+            self._round_trip(limiter, latency=0.1)
+        self.assertAlmostEqual(limiter.limit, 2.9, places=1)
+
+        for _ in range(20):
+            self._round_trip(limiter, latency=0.1)
+        self.assertEqual(limiter.limit, 4)
+        self.assertEqual([limit for _, _, limit in limiter.decisions][-1], 4)
+
+    def testBackoff(self):
+        """ An error halves the limit, but never below the minimum. """
+
+        limiter = AdaptiveLimiter(initial=8, maximum=8)
+
+        self._round_trip(limiter, ok=False)
+        self.assertEqual(limiter.limit, 4)
+
+        for _ in range(5):
+            self._round_trip(limiter, ok=False)
+        self.assertEqual(limiter.limit, 1)
+        self.assertEqual(limiter.metrics()['backoffs'], 6)
+
+    def testSlowdown(self):
+        """ A latency spike well above the baseline trims the limit. """
+
+        limiter = AdaptiveLimiter(initial=4, maximum=4)
+
+        for _ in range(10):
+            self._round_trip(limiter, latency=0.1)
+        self._round_trip(limiter, latency=2.0)
+
+        self.assertLess(limiter.limit, 4)
+        self.assertEqual(limiter.metrics()['slowdowns'], 1)
+
+    def testWait(self):
+        """ A request waits while the limit is reached. """
+
+        limiter = AdaptiveLimiter(initial=1)
+        start = limiter.acquire()
+        started = list()
+
+        thread = Thread(target=lambda: started.append(limiter.acquire()))
+        thread.start()
+        sleep(0.1)
+        self.assertEqual(started, [])
+
+        limiter.release(start, True)
+        thread.join(timeout=2)
+        self.assertEqual(len(started), 1)